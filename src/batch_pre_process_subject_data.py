@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run this script from command line, for example to add every subject in the
+data directory using 4 subjects at a time:
+
+    'python batch_pre_process_subject_data.py --data_root "../data/Subject*"
+        --num_subject_workers 4'
+    Args:
+        data_root: str: Glob pattern matching the subject directories. The
+        subject number of each directory is the number its name ends in (e.g.
+        Subject12 is subject 12).
+
+        num_subject_workers: int: Optional, number of subjects pre-processed
+        at the same time (default 4).
+
+        max_concurrent_writes: int: Optional, number of subjects writing to
+        the database at the same time (default 2).
+
+        All options of pre_process_subject_data.py (time_zone, num_workers,
+        chunk_secs, ...) apply to every subject.
+
+This script pre-processes a whole cohort in one run, as
+pre_process_subject_data.py does for one subject. The subjects share one
+pooled database engine. A subject that fails (for instance because it is
+already in the database) does not stop the others; a summary of every subject
+is printed at the end and the script exits with status 1 if any subject
+failed.
+"""
+
+# Import the following modules:
+
+from pre_process_subject_data import get_argument_parser, \
+    check_arguments, connect_to_storage, pre_process_subject
+from sleeposcope_modules.sanity_check_module import \
+    infer_subject_num_from_subject_files_path
+from sleeposcope_modules.storage_backend_module import \
+    ConcurrencyLimitedStorageBackend
+from sleeposcope_modules.preprocessing_module import invalidate_cache
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+import os.path
+import sys
+import time
+
+
+def pre_process_subject_and_report(subject_files_path, storage_backend, args):
+    """ Pre-processes one subject and reports the outcome instead of raising
+    an exception.
+
+        Args:
+            subject_files_path: str: Directory were subject files are stored
+            storage_backend: see storage_backend_module
+            args: argparse.Namespace: Parsed command line options
+        Returns:
+            report: dict with the keys subject_files_path, subject_num,
+            succeeded, num_rows, secs and error
+    """
+
+    report = {'subject_files_path': subject_files_path, 'subject_num': None,
+              'succeeded': False, 'num_rows': 0, 'secs': 0.0, 'error': ''}
+    start = time.perf_counter()
+    try:
+        report['subject_num'] = infer_subject_num_from_subject_files_path(
+            subject_files_path)
+        report['num_rows'] = pre_process_subject(
+            report['subject_num'], subject_files_path, storage_backend, args)
+        report['succeeded'] = True
+    except Exception as error:
+        report['error'] = '{0}: {1}'.format(type(error).__name__, error)
+    report['secs'] = time.perf_counter() - start
+
+    return report
+
+
+def print_summary(reports):
+    """ Prints one line per subject with the outcome of its pre-processing.
+
+        Args:
+            reports: list of dicts returned by pre_process_subject_and_report
+        Returns: Nothing
+    """
+
+    for report in reports:
+        print('{0:<40} subject {1!s:>5}  {2:<6} {3:>10} rows {4:>8.1f} s  '
+              '{5}'.format(report['subject_files_path'],
+                           report['subject_num'],
+                           'OK' if report['succeeded'] else 'FAILED',
+                           report['num_rows'], report['secs'],
+                           report['error']))
+    num_failed = sum(not report['succeeded'] for report in reports)
+    print('{0} subjects, {1} succeeded, {2} failed'.format(
+        len(reports), len(reports) - num_failed, num_failed))
+
+
+def main():
+
+    parser = get_argument_parser()
+    parser.add_argument("--data_root", type=str)
+    parser.add_argument("--num_subject_workers", type=int, default=4)
+    parser.add_argument("--max_concurrent_writes", type=int, default=2)
+    args = parser.parse_args()
+    check_arguments(parser, args)
+
+    if args.invalidate_cache:
+        print("{0} cached subjects removed".format(
+            invalidate_cache(args.cache_path)))
+
+    subject_files_paths = sorted(path.rstrip('/') for path in
+                                 glob(args.data_root) if os.path.isdir(path))
+
+    # One engine for all subjects, with a connection for each writer:
+    storage_backend = ConcurrencyLimitedStorageBackend(
+        connect_to_storage(args, pool_size=args.max_concurrent_writes),
+        args.max_concurrent_writes)
+
+    with ThreadPoolExecutor(max_workers=args.num_subject_workers) as executor:
+        reports = list(executor.map(
+            lambda path: pre_process_subject_and_report(
+                path, storage_backend, args),
+            subject_files_paths))
+
+    print_summary(reports)
+    if not all(report['succeeded'] for report in reports):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
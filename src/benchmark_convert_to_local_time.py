@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run this script from command line, for example to time 1 week of 1 Hz data:
+
+    'python benchmark_convert_to_local_time.py --num_rows 604800'
+    Args:
+        num_rows: int: Number of time-stamps to convert
+
+        repeats: int: Number of times each conversion is timed, the best time
+        is reported
+
+This script compares the time it takes to convert csv time-stamps to local
+time with the original row by row implementation (three Series.apply passes)
+and with the vectorized convert_to_local_time in preprocessing_module.
+"""
+
+# Import the following modules:
+
+from sleeposcope_modules.preprocessing_module import convert_to_local_time, \
+    LOCAL_TIME_ZONE
+import pandas as pd
+import argparse
+import timeit
+
+
+def convert_to_local_time_row_by_row(time_stamps):
+    """The original implementation of convert_to_local_time, kept here as the
+    reference for the benchmark.
+
+        Args:
+            time_stamps: a Pandas series containing time-stamps that are
+            character strings of the form: yyyy-mm-ddThh:mm:ssZ
+        Returns:
+            date_time: a Pandas series containing pandas datetime objects in
+            local time
+    """
+
+    date_time = time_stamps.apply(
+        lambda x: x.replace('Z', '').replace('T', ' '))
+    date_time = pd.to_datetime(date_time)
+    date_time = date_time.apply(lambda x: x.tz_localize('UTC'))
+    date_time = date_time.apply(lambda x: x.tz_convert(LOCAL_TIME_ZONE))
+
+    return date_time
+
+
+def make_time_stamps(num_rows):
+    """Creates 1 Hz time-stamps in the csv file format.
+
+        Args:
+            num_rows: int
+        Returns:
+            time_stamps: a Pandas series of character strings
+    """
+
+    date_time = pd.date_range('2017-08-18 18:18:20', periods=num_rows,
+                              freq='s')
+    return pd.Series(date_time.strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_rows", type=int, default=86400)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    time_stamps = make_time_stamps(args.num_rows)
+
+    # Both implementations must agree before their times are compared:
+    assert (convert_to_local_time_row_by_row(time_stamps) ==
+            convert_to_local_time(time_stamps)).all()
+
+    row_by_row_time = min(timeit.repeat(
+        lambda: convert_to_local_time_row_by_row(time_stamps),
+        number=1, repeat=args.repeats))
+    vectorized_time = min(timeit.repeat(
+        lambda: convert_to_local_time(time_stamps),
+        number=1, repeat=args.repeats))
+
+    print("rows: {0}".format(args.num_rows))
+    print("row by row: {0:.3f} s".format(row_by_row_time))
+    print("vectorized: {0:.3f} s".format(vectorized_time))
+    print("speedup:    {0:.1f}x".format(row_by_row_time / vectorized_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run this script from command line, for example to benchmark recordings of 1,
+7, 30 and 90 days:
+
+    'python benchmark_pipeline.py --num_days 1 7 30 90 --output
+        benchmark_results.json'
+    Args:
+        num_days: list of float: Lengths of the synthetic recordings (default
+        1 7 30 90).
+
+        num_files: int: Optional, number of csv files per recording (default
+        8).
+
+        num_workers: int: Optional, number of processes reading the csv files
+        (default 1).
+
+        repeat: int: Optional, number of timed runs of each stage, the
+        fastest one is reported (default 3).
+
+        output: str: Optional, JSON file the results are written to.
+
+        seed: int: Optional, seed of the synthetic recordings (default 0).
+
+This script generates synthetic subject folders (see synthetic_data_module)
+and times each stage of the pipeline on them: read_data, fill_missing_data,
+fill_missing_signal_values (on its own) and divide_to_24_hour_periods. Each
+stage is then run once more under tracemalloc to measure its peak memory. The
+results are printed and, with --output, written as JSON together with the
+commit and library versions, so runs on different commits can be compared.
+"""
+
+# Import the following modules:
+
+from sleeposcope_modules.preprocessing_module import read_data, \
+    fill_missing_data, fill_missing_signal_values, \
+    divide_to_24_hour_periods, index_by_seconds, drop_duplicate_seconds
+from sleeposcope_modules.synthetic_data_module import generate_subject_folder
+import pandas as pd
+import numpy as np
+import subprocess
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import json
+import time
+import os
+
+
+def get_fill_signal_inputs(subject_df):
+    """ Prepares the inputs of fill_missing_signal_values the way
+    fill_missing_data does, so that it can be timed on its own.
+
+        Args:
+            subject_df: pandas DataFrame as returned by read_data
+        Returns:
+            full_subject_df: pandas DataFrame re-indexed to continuous seconds
+            missing_secs: numpy array
+    """
+
+    subject_df = index_by_seconds(subject_df,
+                                  subject_df['date_time'].min())
+    subject_df = drop_duplicate_seconds(subject_df)
+    secs = subject_df.index.to_numpy()
+    continuous_secs = pd.RangeIndex(secs.min(), secs.max() + 1, name='secs')
+    missing_secs = np.setdiff1d(continuous_secs.to_numpy(), secs)
+
+    return subject_df.reindex(continuous_secs), missing_secs
+
+
+def measure(stage, repeat):
+    """ Times a stage and measures its peak memory.
+
+        Args:
+            stage: function without arguments
+            repeat: int: Number of timed runs
+        Returns:
+            secs: float: Fastest wall time
+            peak_bytes: int: Peak memory allocated while the stage ran
+            result: what the stage returned
+    """
+
+    secs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = stage()
+        secs.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    stage()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return min(secs), peak_bytes, result
+
+
+def benchmark_recording(subject_folder_path, num_workers, repeat):
+    """ Times each stage of the pipeline on one subject folder.
+
+        Args:
+            subject_folder_path: str
+            num_workers: int
+            repeat: int
+        Returns:
+            results: list of dicts with the keys stage, num_rows, secs and
+            peak_bytes
+    """
+
+    results = []
+
+    def add_result(stage_name, stage):
+        (secs, peak_bytes, result) = measure(stage, repeat)
+        results.append({'stage': stage_name, 'num_rows': len(result),
+                        'secs': secs, 'peak_bytes': peak_bytes})
+        return result
+
+    subject_df = add_result('read_data', lambda: read_data(
+        subject_folder_path, num_workers=num_workers))
+    full_subject_df = add_result('fill_missing_data', lambda:
+                                 fill_missing_data(subject_df.copy()))
+    (reindexed_df, missing_secs) = get_fill_signal_inputs(subject_df)
+    add_result('fill_missing_signal_values', lambda:
+               fill_missing_signal_values(reindexed_df.copy(),
+                                          missing_secs)[0])
+    add_result('divide_to_24_hour_periods', lambda:
+               divide_to_24_hour_periods(full_subject_df.copy()))
+
+    return results
+
+
+def get_environment():
+    """ Describes the code and libraries the benchmark ran with.
+
+        Args: None
+        Returns:
+            environment: dict
+    """
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'],
+                                capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {'commit': commit, 'python': platform.python_version(),
+            'pandas': pd.__version__, 'numpy': np.__version__,
+            'machine': platform.machine(), 'time': pd.Timestamp.now(
+                tz='UTC').isoformat()}
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_days", type=float, nargs='+',
+                        default=[1, 7, 30, 90])
+    parser.add_argument("--num_files", type=int, default=8)
+    parser.add_argument("--num_workers", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", type=str, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = []
+    for num_days in args.num_days:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            subject_folder_path = os.path.join(temp_dir, 'Subject1')
+            generate_subject_folder(subject_folder_path, num_days,
+                                    args.num_files, seed=args.seed)
+            for result in benchmark_recording(subject_folder_path,
+                                              args.num_workers, args.repeat):
+                result['num_days'] = num_days
+                results.append(result)
+                print("{0:>6g} days {1:<28} {2:>10} rows {3:>8.3f} s "
+                      "{4:>8.1f} MiB".format(num_days, result['stage'],
+                                             result['num_rows'],
+                                             result['secs'],
+                                             result['peak_bytes'] / 2 ** 20))
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump({'environment': get_environment(),
+                       'parameters': vars(args),
+                       'results': results}, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
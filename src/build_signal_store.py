@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run this script from command line, for example to add subject 2 to the signal
+store:
+
+    'python build_signal_store.py --subject_num 2 --subject_files_path
+        ../data/Subject2'
+    Args:
+        subject_num: int: Current subject number
+
+        subject_files_path: str: Directory were subject files are stored
+
+        store_path: str: Optional, directory of the signal files (default
+        ../data/signal_store).
+
+        time_zone, num_workers, max_gap_secs, fill_method, duplicates,
+        day_boundary and period_length: Optional, as in
+        pre_process_subject_data.py. The storage options of that script do
+        not apply here.
+
+This script pre-processes a subject as pre_process_subject_data.py does and
+writes its signal to a binary signal file (see signal_store_module), replacing
+the subject's previous signal file if there is one. The signal file can be
+memory-mapped, e.g. to read hours 30 to 38 of subject 2:
+
+    signal, gap_mask = open_signal_file(
+        get_signal_file_path('../data/signal_store', 2)).get_time_range(
+            30 * 3600, 38 * 3600)
+"""
+
+# Import the following modules:
+
+from sleeposcope_modules.preprocessing_module import LOCAL_TIME_ZONE, \
+    MAX_COPY_FILL_SECS, FILL_METHODS, DUPLICATE_POLICIES, DAY_BOUNDARY, \
+    PERIOD_LENGTH
+from sleeposcope_modules.sanity_check_module import \
+    check_if_subject_num_matches_subject_files_path
+from sleeposcope_modules.signal_store_module import build_signal_store
+import argparse
+
+# global variables
+STORE_PATH = '../data/signal_store'
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subject_num", type=int)
+    parser.add_argument("--subject_files_path", type=str)
+    parser.add_argument("--store_path", type=str, default=STORE_PATH)
+    parser.add_argument("--time_zone", type=str, default=LOCAL_TIME_ZONE)
+    parser.add_argument("--num_workers", type=int, default=1)
+    parser.add_argument("--max_gap_secs", type=int,
+                        default=MAX_COPY_FILL_SECS)
+    parser.add_argument("--fill_method", type=str, default='copy_previous',
+                        choices=FILL_METHODS)
+    parser.add_argument("--duplicates", type=str, default='first',
+                        choices=DUPLICATE_POLICIES)
+    parser.add_argument("--day_boundary", type=str, default=DAY_BOUNDARY)
+    parser.add_argument("--period_length", type=str, default=PERIOD_LENGTH)
+    args = parser.parse_args()
+
+    # Check if subject_files_path ends in subject_num (it should!):
+    check_if_subject_num_matches_subject_files_path(args.subject_num,
+                                                    args.subject_files_path)
+
+    file_path = build_signal_store(
+        args.subject_num, args.subject_files_path, args.store_path,
+        args.time_zone, args.num_workers, max_gap_secs=args.max_gap_secs,
+        fill_method=args.fill_method, duplicates=args.duplicates,
+        day_boundary=args.day_boundary, period_length=args.period_length)
+    print("Signal of subject {0} written to {1}".format(args.subject_num,
+                                                        file_path))
+
+
+if __name__ == '__main__':
+    main()
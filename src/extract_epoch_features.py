@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run this script from command line, for example to compute the epoch features
+of every subject in the signal store using 4 processes:
+
+    'python extract_epoch_features.py --num_workers 4'
+    Args:
+        store_path: str: Optional, directory of the signal files (default
+        ../data/signal_store, see build_signal_store.py).
+
+        subject_nums: list of int: Optional, the subjects to compute the
+        features of (default every subject in the store).
+
+        epoch_secs: list of int: Optional, the epoch lengths in seconds
+        (default 30 60).
+
+        include_filled: Optional flag, use the seconds filled in because of a
+        gap as if they had been recorded.
+
+        num_workers: int: Optional, number of subjects computed at the same
+        time, each in a process of its own (default 1).
+
+        storage: str: Optional, 'sql' (default) writes the features to
+        'epoch_features_table' in the database, 'parquet' to a dataset
+        partitioned by subject_num and num_days.
+
+        dataset_path: str: Optional, directory of the parquet dataset
+        (default ../data/epoch_features_dataset).
+
+This script computes the features of every epoch (see
+feature_extraction_module) of the subjects in the signal store, replacing the
+subjects' previous features. The signal files are memory-mapped by the worker
+processes, so only the features are sent back to be written. A subject that
+fails does not stop the others; the script exits with status 1 if any
+subject failed.
+"""
+
+# Import the following modules:
+
+from pre_process_subject_data import connect_to_storage
+from sleeposcope_modules.feature_extraction_module import \
+    extract_features_from_signal_file, write_features_to_sql_database, \
+    write_features_to_dataset, EPOCH_SECS
+from sleeposcope_modules.signal_store_module import get_signal_file_path
+from sleeposcope_modules.storage_backend_module import STORAGE_BACKENDS
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+from glob import glob
+import os.path
+import sys
+import re
+
+# global variables
+STORE_PATH = '../data/signal_store'
+FEATURES_PATH = '../data/epoch_features_dataset'
+
+
+def find_stored_subjects(store_path):
+    """ Lists the subjects that have a signal file in a store directory.
+
+        Args:
+            store_path: str: Directory of the signal files
+        Returns:
+            subject_nums: list of int
+    """
+
+    subject_nums = []
+    for file_path in glob(get_signal_file_path(store_path, '*')):
+        match = re.fullmatch(r'subject_(\d+)\.sig', os.path.basename(
+            file_path))
+        if match is not None:
+            subject_nums.append(int(match.group(1)))
+
+    return sorted(subject_nums)
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store_path", type=str, default=STORE_PATH)
+    parser.add_argument("--subject_nums", type=int, nargs='+', default=None)
+    parser.add_argument("--epoch_secs", type=int, nargs='+',
+                        default=list(EPOCH_SECS))
+    parser.add_argument("--include_filled", action='store_true')
+    parser.add_argument("--num_workers", type=int, default=1)
+    parser.add_argument("--storage", type=str, default='sql',
+                        choices=STORAGE_BACKENDS)
+    parser.add_argument("--dataset_path", type=str, default=FEATURES_PATH)
+    args = parser.parse_args()
+
+    subject_nums = args.subject_nums
+    if subject_nums is None:
+        subject_nums = find_stored_subjects(args.store_path)
+    if args.storage == 'sql':
+        engine = connect_to_storage(args).engine
+
+    # The features are computed in the worker processes and written here,
+    # as each subject is done:
+    num_failed = 0
+    with ProcessPoolExecutor(max_workers=args.num_workers) as executor:
+        futures = [executor.submit(
+            extract_features_from_signal_file,
+            get_signal_file_path(args.store_path, subject_num), subject_num,
+            tuple(args.epoch_secs), args.include_filled)
+            for subject_num in subject_nums]
+        for (subject_num, future) in zip(subject_nums, futures):
+            try:
+                features = future.result()
+                if args.storage == 'sql':
+                    write_features_to_sql_database(features, engine,
+                                                   subject_num)
+                else:
+                    write_features_to_dataset(features, args.dataset_path,
+                                              subject_num)
+                print('subject {0:>5}  OK     {1:>10} epochs'.format(
+                    subject_num, len(features)), flush=True)
+            except Exception as error:
+                num_failed += 1
+                print('subject {0:>5}  FAILED {1}: {2}'.format(
+                    subject_num, type(error).__name__, error), flush=True)
+
+    if num_failed > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run this script from command line, for example to create a 30 day synthetic
+subject 900 in 20 csv files:
+
+    'python generate_synthetic_subject.py --subject_files_path
+        ../data/Subject900 --num_days 30 --num_files 20'
+    Args:
+        subject_files_path: str: Directory the csv files are written to.
+
+        num_days: float: Optional, length of the recording (default 1).
+
+        num_files: int: Optional, number of csv files (default 4).
+
+        dropout_rate: float: Optional, probability that a dropout starts at
+        any second (default 0.001).
+
+        mean_dropout_secs: float: Optional, mean length of the short dropouts
+        (default 20).
+
+        long_dropout_fraction: float: Optional, fraction of dropouts that are
+        longer than 5 minutes (default 0.05).
+
+        header_row_rate: float: Optional, probability that a garbage header
+        row follows any row (default 0.0001).
+
+        overlap_secs: int: Optional, seconds each file shares with the next
+        one (default 60).
+
+        seed: int: Optional, seed of the random numbers (default 0).
+
+This script writes the csv files of a synthetic subject (see
+synthetic_data_module), which can be pre-processed like a recorded one.
+"""
+
+# Import the following modules:
+
+from sleeposcope_modules.synthetic_data_module import generate_subject_folder
+import argparse
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subject_files_path", type=str)
+    parser.add_argument("--num_days", type=float, default=1)
+    parser.add_argument("--num_files", type=int, default=4)
+    parser.add_argument("--dropout_rate", type=float, default=1e-3)
+    parser.add_argument("--mean_dropout_secs", type=float, default=20)
+    parser.add_argument("--long_dropout_fraction", type=float, default=0.05)
+    parser.add_argument("--header_row_rate", type=float, default=1e-4)
+    parser.add_argument("--overlap_secs", type=int, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    file_names = generate_subject_folder(
+        args.subject_files_path, args.num_days, args.num_files,
+        args.dropout_rate, args.mean_dropout_secs, args.long_dropout_fraction,
+        args.header_row_rate, args.overlap_secs, seed=args.seed)
+    print("{0} csv files written to {1}".format(len(file_names),
+                                               args.subject_files_path))
+
+
+if __name__ == '__main__':
+    main()
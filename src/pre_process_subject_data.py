@@ -11,6 +11,73 @@ Run this script from command line, for example to input subject_num = 2:
         
         subject_files_path: str: Directory were subject files are
         stored, full or relative path.
+
+        time_zone: str: Optional, time zone the recordings are converted to
+        (default US/Pacific).
+
+        num_workers: int: Optional, number of processes reading the csv files
+        in parallel (default 1). With chunk_secs, files are read ahead while
+        the current one is being processed.
+
+        chunk_secs: int: Optional, process the recording in blocks of this
+        many seconds and write each block as soon as it is ready, so memory
+        use does not grow with the length of the recording. By default the
+        whole recording is processed at once. Either way the subject is
+        stored in a single transaction: if any block fails, nothing is
+        stored.
+
+        pipelined: flag: Optional, with chunk_secs, read, pre-process and
+        write the blocks at the same time in separate threads.
+
+        queue_size: int: Optional, number of blocks held between two steps of
+        the pipelined mode (default 4).
+
+        max_gap_secs: int: Optional, longest gap in the signal that is filled
+        (default 300).
+
+        fill_method: str: Optional, how gaps in the signal are filled:
+        copy_previous (default), interpolate or leave_nan.
+
+        duplicates: str: Optional, how seconds recorded in more than one
+        (overlapping) csv file are combined: first (default), last or mean.
+
+        day_boundary: str: Optional, time of day (hh:mm:ss) at which the
+        periods in num_days start (default 12:00:00).
+
+        period_length: str: Optional, length of the periods in num_days
+        (default '24 hours').
+
+        storage: str: Optional, where the subject data is written: sql
+        (default, the DB_NAME database) or parquet (a columnar dataset
+        partitioned by subject_num and num_days).
+
+        dataset_path: str: Optional, directory of the parquet dataset.
+
+        incremental: flag: Optional, only ingest the csv files that are new or
+        have changed since the subject was last ingested with this flag, and
+        allow adding to a subject already in the database (sql storage only).
+
+        cache_path: str: Optional, directory where pre-processed subjects are
+        cached. A subject whose csv files and options have not changed since
+        it was cached is read from the cache instead of being pre-processed
+        again (not with chunk_secs or incremental).
+
+        max_cache_bytes: int: Optional, largest size of the cache, the least
+        recently used subjects are removed beyond it (default 4 GiB).
+
+        invalidate_cache: flag: Optional, empty the cache first. Without a
+        subject_num, only the cache is emptied.
+
+        metrics_path: str: Optional, JSON file the measurements of each stage
+        (wall and CPU time, rows in and out, peak memory growth) and the
+        number of rejected files are written to.
+
+        profile: str: Optional, profile the run with cProfile and write the
+        profile to this file (pre_process_subject_data.prof if no file is
+        given). Every thread is profiled, including the stages of the
+        pipelined mode, but not the processes reading files ahead
+        (num_workers). The measurements of each stage and the functions that
+        took longest are printed.
     
 This scripts reads in the data for an *individual* subject (i.e., one subject 
 at a time) from a number of csv files, creates a pandas dataframe and adds the 
@@ -25,56 +92,573 @@ sleeposcope database. If so, it raises an exceptions and aborts  mission.
 
 # Import the following modules:
 
-from sleeposcope_modules.preprocessing_module import read_data, \
-    fill_missing_data, divide_to_24_hour_periods
+from sleeposcope_modules.preprocessing_module import \
+    divide_to_24_hour_periods, LOCAL_TIME_ZONE, read_data_in_chunks, \
+    fill_missing_data_in_chunks, divide_to_24_hour_periods_in_chunks, \
+    MAX_COPY_FILL_SECS, FILL_METHODS, DUPLICATE_POLICIES, DAY_BOUNDARY, \
+    PERIOD_LENGTH, compact_subject_data, read_preprocessed_data, \
+    invalidate_cache, MAX_CACHE_BYTES
+from sleeposcope_modules.pipeline_module import run_pipeline, \
+    PIPELINE_QUEUE_SIZE
 from sleeposcope_modules.sanity_check_module import \
-    check_if_subject_already_in_table, get_file_names_if_they_exist, \
+    get_file_names_if_they_exist, \
     check_if_subject_num_matches_subject_files_path
 
-from sleeposcope_modules.talk_to_sql_module import connect_to_sql_database
-from sleeposcope_modules.talk_to_sql_module import write_to_sql_database
+from sleeposcope_modules.preprocessing_module import read_data_file, \
+    hash_file, describe_data_file, index_by_seconds, fill_missing_seconds
+from sleeposcope_modules.talk_to_sql_module import connect_to_sql_database, \
+    read_manifest, write_manifest, delete_from_manifest, read_subject_rows, \
+    delete_subject_rows, get_subjects_table, select_table_columns, \
+    write_rows, initialize_database, write_registry_entry, \
+    summarize_subject_rows, write_summaries, write_status_intervals, \
+    read_status_intervals
+from sleeposcope_modules.summary_module import SummaryAccumulator, \
+    SUMMARY_LEVEL_SECS
+from sleeposcope_modules.status_interval_module import \
+    find_status_intervals, join_status_intervals, label_time_ranges
+from sleeposcope_modules.storage_backend_module import get_storage_backend, \
+    STORAGE_BACKENDS
+from sleeposcope_modules.instrumentation_module import PipelineMetrics, \
+    NoMetrics, ThreadProfiler
+import pandas as pd
 import argparse
+import os.path
+
+# global variables
+DB_NAME = 'sleeposcope40'
+DB_USER_NAME = 'baharsharafi'
+DB_PSWD = 'sleeposcope'
+TABLE_NAME = 'all_subjects_table'
+DATASET_PATH = '../data/all_subjects_dataset'
+PROFILE_PATH = 'pre_process_subject_data.prof'
+
+
+def get_argument_parser():
+    """ Creates the parser for the command line options that control how
+    subject data is pre-processed and where it is stored (all but the
+    subject itself).
+
+        Args: None
+        Returns:
+            parser: argparse.ArgumentParser
+    """
 
-def main():
-    
-    # global variables
-    DB_NAME = 'sleeposcope40'
-    DB_USER_NAME = 'baharsharafi'
-    DB_PSWD = 'sleeposcope'
-    TABLE_NAME = 'all_subjects_table'
-    
     parser = argparse.ArgumentParser()
-    parser.add_argument("--subject_num", type=int)
-    parser.add_argument("--subject_files_path", type=str)
-    args = parser.parse_args()
-    subject_num = args.subject_num
-    subject_files_path = args.subject_files_path
+    parser.add_argument("--time_zone", type=str, default=LOCAL_TIME_ZONE)
+    parser.add_argument("--num_workers", type=int, default=1)
+    parser.add_argument("--chunk_secs", type=int, default=None)
+    parser.add_argument("--pipelined", action='store_true')
+    parser.add_argument("--queue_size", type=int, default=PIPELINE_QUEUE_SIZE)
+    parser.add_argument("--max_gap_secs", type=int,
+                        default=MAX_COPY_FILL_SECS)
+    parser.add_argument("--fill_method", type=str, default='copy_previous',
+                        choices=FILL_METHODS)
+    parser.add_argument("--duplicates", type=str, default='first',
+                        choices=DUPLICATE_POLICIES)
+    parser.add_argument("--day_boundary", type=str, default=DAY_BOUNDARY)
+    parser.add_argument("--period_length", type=str, default=PERIOD_LENGTH)
+    parser.add_argument("--storage", type=str, default='sql',
+                        choices=STORAGE_BACKENDS)
+    parser.add_argument("--dataset_path", type=str, default=DATASET_PATH)
+    parser.add_argument("--incremental", action='store_true')
+    parser.add_argument("--cache_path", type=str, default=None)
+    parser.add_argument("--max_cache_bytes", type=int, default=MAX_CACHE_BYTES)
+    parser.add_argument("--invalidate_cache", action='store_true')
+
+    return parser
+
+
+def check_arguments(parser, args):
+    """ Checks that the options parsed with get_argument_parser can be used
+    together, and exits with a usage error if not.
+
+        Args:
+            parser: argparse.ArgumentParser: as created by get_argument_parser
+            args: argparse.Namespace: Parsed command line options
+        Returns: Nothing
+    """
+
+    if args.incremental and args.storage != 'sql':
+        parser.error("--incremental requires --storage sql")
+    if args.pipelined and (args.chunk_secs is None or args.incremental):
+        parser.error("--pipelined requires --chunk_secs, without "
+                     "--incremental")
+    if args.invalidate_cache and args.cache_path is None:
+        parser.error("--invalidate_cache requires --cache_path")
+
+
+def connect_to_storage(args, pool_size=None):
+    """ Creates the storage backend selected on the command line, connecting
+    to (and if needed creating) the DB_NAME database for the sql backend.
+
+        Args:
+            args: argparse.Namespace: Parsed command line options
+            pool_size: int: Optional, number of pooled database connections
+        Returns:
+            storage_backend: see storage_backend_module
+    """
+
+    if args.storage == 'sql':
+        # Create connection to PostgresSQL database:
+        (engine, database_already_existed) = connect_to_sql_database(
+                DB_USER_NAME, DB_PSWD, DB_NAME, pool_size)
+        # Create the subjects table, its index and the subject registry:
+        initialize_database(engine, TABLE_NAME)
+    else:
+        (engine, database_already_existed) = (None, False)
+
+    return get_storage_backend(args.storage, engine, TABLE_NAME,
+                               database_already_existed, args.dataset_path)
+
+
+def pre_process_subject(subject_num, subject_files_path, storage_backend,
+                        args, metrics=None):
+    """ Reads in, pre-processes and stores the data of one subject.
+
+        Args:
+            subject_num: int: Current subject number
+            subject_files_path: str: Directory were subject files are stored
+            storage_backend: see storage_backend_module
+            args: argparse.Namespace: Parsed command line options
+            metrics: PipelineMetrics: Optional, each stage is measured in it
+            (see instrumentation_module)
+        Returns:
+            num_rows: int: Number of rows stored
+    """
+
+    if metrics is None:
+        metrics = NoMetrics()
+
+    if args.incremental:
+        return pre_process_subject_incrementally(
+            subject_num, subject_files_path, storage_backend, args, metrics)
 
     # Check if subject_files_path ends in subject_num (it should!):
     check_if_subject_num_matches_subject_files_path(subject_num,
                                                     subject_files_path)
 
-    # Create connection to PostgresSQL database:
-    (engine, database_already_existed) = connect_to_sql_database(
-            DB_USER_NAME, DB_PSWD, DB_NAME)
-    
     # Check if subject is already in table (and if so abort):
-    if database_already_existed:
-        check_if_subject_already_in_table(subject_num, TABLE_NAME, engine)
-
-    # Read in subject data:
-    subject_data = read_data(subject_files_path)
-    # Fill in missing data:
-    subject_data = fill_missing_data(subject_data)
-    # Divide the data to 'days' of recording:
-    subject_data = divide_to_24_hour_periods(subject_data)
-    
-    # Add subject num and drop date_time:
-    del subject_data['date_time']
-    subject_data['subject_num'] = subject_num
-    
-    # Add subject data to all_subject_table in sleeposcope database:
-    write_to_sql_database(subject_data, engine, TABLE_NAME)
+    storage_backend.check_if_subject_already_stored(subject_num)
+
+    if args.pipelined:
+        return pre_process_subject_in_pipeline(
+            subject_num, subject_files_path, storage_backend, args, metrics)
+
+    if args.chunk_secs is None:
+        # Read in subject data, fill in missing data and divide the data to
+        # 'days' of recording (or read the result from the cache):
+        subject_data = read_preprocessed_data(
+            subject_files_path, args.time_zone, args.num_workers,
+            args.max_gap_secs, args.fill_method, args.duplicates,
+            args.day_boundary, args.period_length, args.cache_path,
+            args.max_cache_bytes, metrics)
+        subject_chunks = [subject_data]
+    else:
+        # Same steps, one block of time at a time:
+        subject_chunks = metrics.measure_chunks('read_data', read_data_in_chunks(
+            subject_files_path, args.chunk_secs, args.time_zone, metrics,
+            args.num_workers))
+        subject_chunks = metrics.measure_chunks(
+            'fill_missing_data', fill_missing_data_in_chunks(
+                metrics.count_rows_in(subject_chunks), args.max_gap_secs,
+                args.fill_method, args.duplicates))
+        subject_chunks = metrics.measure_chunks(
+            'divide_to_24_hour_periods', divide_to_24_hour_periods_in_chunks(
+                metrics.count_rows_in(subject_chunks), args.day_boundary,
+                args.period_length, args.time_zone))
+
+    # Add the subject data and its registry entry to all_subject_table in
+    # sleeposcope database (or to the selected storage) in a single
+    # transaction, so a failure in any block stores nothing:
+    with metrics.stage('write') as run:
+        run.rows_out = storage_backend.write_subject(
+            subject_num, compact_subject_chunks(subject_chunks, subject_num,
+                                                metrics))
+
+    return run.rows_out
+
+
+def compact_subject_chunks(subject_chunks, subject_num, metrics=None):
+    """ Adds the subject num to blocks of pre-processed subject data and
+    converts them to compact types. date_time is kept for the subject
+    registry, and is not written.
+
+        Args:
+            subject_chunks: iterable of pandas DataFrames as yielded by
+            divide_to_24_hour_periods_in_chunks
+            subject_num: int: Current subject number
+            metrics: PipelineMetrics: Optional, each block is measured in it
+        Yields:
+            subject_data: pandas DataFrame
+    """
+
+    if metrics is None:
+        metrics = NoMetrics()
+
+    for subject_data in subject_chunks:
+        with metrics.stage('compact_subject_data', len(subject_data)) as run:
+            subject_data['subject_num'] = subject_num
+            subject_data = compact_subject_data(subject_data)
+            run.rows_out = len(subject_data)
+        yield subject_data
+
+
+def pre_process_subject_in_pipeline(subject_num, subject_files_path,
+                                    storage_backend, args, metrics=None):
+    """ Reads in, pre-processes and stores the data of one subject one block
+    of time at a time, as pre_process_subject does with chunk_secs, but with
+    the steps running at the same time (see pipeline_module): blocks are read
+    in one thread, gap-filled in another, divided into periods in a third
+    and written in the current thread. The subject and its registry entry are
+    written in a single transaction.
+
+        Args:
+            subject_num: int: Current subject number
+            subject_files_path: str: Directory were subject files are stored
+            storage_backend: see storage_backend_module
+            args: argparse.Namespace: Parsed command line options
+            metrics: PipelineMetrics: Optional, each stage is measured in it
+            (see instrumentation_module). Stages wait for each other, and the
+            waiting is counted in their wall time.
+        Returns:
+            num_rows: int: Number of rows stored
+    """
+
+    if metrics is None:
+        metrics = NoMetrics()
+
+    def fill_missing_data_stage(subject_chunks):
+        return metrics.measure_chunks(
+            'fill_missing_data', fill_missing_data_in_chunks(
+                metrics.count_rows_in(subject_chunks), args.max_gap_secs,
+                args.fill_method, args.duplicates))
+
+    def divide_to_24_hour_periods_stage(full_subject_chunks):
+        subject_chunks = metrics.measure_chunks(
+            'divide_to_24_hour_periods', divide_to_24_hour_periods_in_chunks(
+                metrics.count_rows_in(full_subject_chunks), args.day_boundary,
+                args.period_length, args.time_zone))
+        return compact_subject_chunks(subject_chunks, subject_num, metrics)
+
+    def write_stage(subject_chunks):
+        with metrics.stage('write') as run:
+            run.rows_out = storage_backend.write_subject(subject_num,
+                                                         subject_chunks)
+        return run.rows_out
+
+    return run_pipeline(
+        metrics.measure_chunks('read_data', read_data_in_chunks(
+            subject_files_path, args.chunk_secs, args.time_zone, metrics,
+            args.num_workers)),
+        [fill_missing_data_stage, divide_to_24_hour_periods_stage],
+        write_stage, args.queue_size)
+
+
+def pre_process_subject_incrementally(subject_num, subject_files_path,
+                                      storage_backend, args, metrics=None):
+    """ Adds only the csv files of a subject that are new or have changed
+    since they were last ingested, using the table of ingested files (see
+    talk_to_sql_module.MANIFEST_TABLE_NAME). Rows from the first changed file
+    on are replaced; earlier rows are kept. Only the new and changed files
+    are read: the seconds they share with earlier files, and the last
+    recorded seconds before them (used to fill the gap up to them), are taken
+    from the stored rows. Earlier files are read in again only over the time
+    range of a changed or removed file, whose stored rows are out of date. If
+    the start of the recording changes, the whole subject is re-ingested.
+    Requires the sql storage backend.
+
+        Args:
+            subject_num: int: Current subject number
+            subject_files_path: str: Directory were subject files are stored
+            storage_backend: SqlStorageBackend, or a
+            ConcurrencyLimitedStorageBackend wrapping one
+            args: argparse.Namespace: Parsed command line options
+            metrics: PipelineMetrics: Optional, each stage is measured in it
+            (see instrumentation_module)
+        Returns:
+            num_rows: int: Number of rows stored
+    """
+
+    if metrics is None:
+        metrics = NoMetrics()
+    engine = storage_backend.engine
+
+    # Check if subject_files_path ends in subject_num (it should!):
+    check_if_subject_num_matches_subject_files_path(subject_num,
+                                                    subject_files_path)
+
+    manifest = read_manifest(engine, subject_num).set_index('file_path')
+    # A subject ingested without a manifest cannot be updated:
+    if len(manifest) == 0:
+        storage_backend.check_if_subject_already_stored(subject_num)
+
+    file_names = {os.path.abspath(file_name): file_name for file_name in
+                  get_file_names_if_they_exist(subject_files_path)}
+
+    # Files whose size and modification time have changed are hashed, and
+    # only those whose content has changed are read in again:
+    changed_files = []
+    for file_path, file_name in file_names.items():
+        if file_path in manifest.index:
+            entry = manifest.loc[file_path]
+            file_stat = os.stat(file_name)
+            if (file_stat.st_size == entry.file_size and
+                    file_stat.st_mtime == entry.file_mtime) or \
+                    hash_file(file_name) == entry.content_hash:
+                continue
+        changed_files.append(file_path)
+    removed_files = [file_path for file_path in manifest.index
+                     if file_path not in file_names]
+    if len(changed_files) + len(removed_files) == 0:
+        return 0
+
+    file_dfs = {}
+    new_entries = []
+    for file_path in changed_files:
+        with metrics.stage('read_data') as run:
+            file_df = read_data_file(file_names[file_path], args.time_zone)
+            if file_df is not None:
+                run.rows_out = len(file_df)
+        if file_df is None:
+            print("""{0} is incorrect and its contents will not be appended to 
+                the subject data.""".format(file_names[file_path]))
+            metrics.count('rejected_files')
+            continue
+        file_dfs[file_path] = file_df
+        new_entries.append(describe_data_file(file_names[file_path], file_df))
+    new_entries = pd.DataFrame(new_entries, columns=manifest.reset_index(
+        ).columns.drop('subject_num'))
+    new_entries['subject_num'] = subject_num
+
+    old_files = [file_path for file_path in changed_files + removed_files
+                 if file_path in manifest.index]
+    if len(new_entries) + len(old_files) == 0:
+        return 0
+
+    # Rows are replaced from the earliest time any new, changed or removed
+    # file starts:
+    replaced_from = min(list(new_entries.first_time) +
+                        list(manifest.loc[old_files, 'first_time']))
+    kept_files = manifest.drop(old_files)
+    new_start = min(list(kept_files.first_time) +
+                    list(new_entries.first_time), default=None)
+    stored_df = None
+    preceding_df = None
+    if new_start is None:
+        # Every file was removed:
+        recording_start = None
+        delete_from_secs = 0
+    elif new_start != manifest.first_time.min():
+        # The recording starts at another time and every second moves, so
+        # the kept files are read in again and the subject re-ingested:
+        recording_start = None
+        delete_from_secs = 0
+        for file_path in kept_files.index:
+            with metrics.stage('read_data') as run:
+                file_dfs[file_path] = read_data_file(file_names[file_path],
+                                                     args.time_zone)
+                run.rows_out = len(file_dfs[file_path])
+    else:
+        recording_start = new_start.tz_convert(args.time_zone)
+        replaced_secs = int((replaced_from - recording_start) //
+                            pd.Timedelta(seconds=1))
+        # Rows are replaced from the second after the last recorded second
+        # before replaced_from, so the gap leading up to it is filled again:
+        intervals = read_status_intervals(engine, [subject_num],
+                                          to_secs=replaced_secs)
+        delete_from_secs = min(replaced_secs,
+                               int(intervals['end_secs'].max())) \
+            if len(intervals) > 0 else 0
+
+        # The stored rows of changed or removed files are out of date. Over
+        # their time ranges the kept files that overlap them are read in
+        # again; everywhere else the stored recorded rows are used:
+        old_ranges = manifest.loc[old_files, ['first_time', 'last_time']]
+        stored_df = read_recorded_rows(engine, storage_backend.TABLE_NAME,
+                                       subject_num, recording_start,
+                                       delete_from_secs - args.max_gap_secs)
+        out_of_date = pd.Series(False, index=stored_df.index)
+        for (first_time, last_time) in old_ranges.itertuples(index=False):
+            out_of_date |= stored_df['date_time'].between(first_time,
+                                                          last_time)
+            overlapping = (kept_files.first_time <= last_time) & \
+                (kept_files.last_time >= first_time)
+            for file_path in kept_files.index[overlapping]:
+                with metrics.stage('read_data') as run:
+                    file_df = read_data_file(file_names[file_path],
+                                             args.time_zone)
+                    file_df = file_df[file_df['date_time'].between(
+                        first_time, last_time)]
+                    run.rows_out = len(file_df)
+                file_dfs[(file_path, first_time)] = file_df
+        # Stored seconds the gap up to delete_from_secs is copied from:
+        preceding_df = stored_df.loc[:delete_from_secs - 1,
+                                     ['meas_sig_str', 'date_time']]
+        stored_df = stored_df[~out_of_date].loc[delete_from_secs:]
+
+    subject_data = pd.DataFrame()
+    # The stored rows come first, in place of the kept files they were
+    # recorded in:
+    subject_dfs = list(file_dfs.values())
+    if stored_df is not None:
+        subject_dfs.insert(0, stored_df.reset_index(drop=True))
+    if sum(len(subject_df) for subject_df in subject_dfs) > 0:
+        subject_df = pd.concat(subject_dfs, ignore_index=True)
+        subject_df = subject_df.sort_values('date_time', kind='mergesort')
+        if recording_start is None:
+            recording_start = subject_df['date_time'].min()
+
+        with metrics.stage('fill_missing_data', len(subject_df)) as run:
+            subject_df = index_by_seconds(subject_df, recording_start)
+            subject_data, gap_summary = fill_missing_seconds(
+                subject_df, recording_start, preceding_df, args.max_gap_secs,
+                args.fill_method, args.duplicates)
+            run.rows_out = len(subject_data)
+        with metrics.stage('divide_to_24_hour_periods',
+                           len(subject_data)) as run:
+            subject_data = divide_to_24_hour_periods(
+                subject_data, recording_start, args.day_boundary,
+                args.period_length, args.time_zone)
+            run.rows_out = len(subject_data)
+
+        # Add subject num, drop date_time and use compact types:
+        with metrics.stage('compact_subject_data', len(subject_data)) as run:
+            del subject_data['date_time']
+            subject_data['subject_num'] = subject_num
+            subject_data = compact_subject_data(subject_data)
+            run.rows_out = len(subject_data)
+
+    # The summaries are rebuilt from the start of the coarsest bin the
+    # replaced rows fall in, using the kept rows before them (labelled with
+    # the kept status intervals):
+    summaries_from_secs = delete_from_secs // SUMMARY_LEVEL_SECS[-1] * \
+        SUMMARY_LEVEL_SECS[-1]
+    kept_intervals = read_status_intervals(
+        engine, [subject_num], from_secs=summaries_from_secs,
+        to_secs=delete_from_secs)
+    summaries = SummaryAccumulator()
+    if summaries_from_secs < delete_from_secs:
+        kept_rows = read_subject_rows(engine, storage_backend.TABLE_NAME,
+                                      subject_num, summaries_from_secs,
+                                      delete_from_secs)
+        kept_rows['status'] = label_time_ranges(
+            kept_intervals, pd.DataFrame({'subject_num': subject_num,
+                                          'start_secs': kept_rows.index},
+                                         index=kept_rows.index))['status']
+        summaries.add(kept_rows)
+    summaries.add(subject_data)
+
+    # The status intervals are rebuilt from the start of the first kept
+    # interval that reaches the replaced rows, cut off where they start:
+    kept_intervals['end_secs'] = kept_intervals['end_secs'].clip(
+        upper=delete_from_secs)
+    status_intervals = join_status_intervals(pd.concat(
+        [kept_intervals] + ([find_status_intervals(subject_data)]
+                            if len(subject_data) > 0 else []),
+        ignore_index=True))
+    intervals_from_secs = int(min([delete_from_secs] +
+                                  list(kept_intervals['start_secs'])))
+
+    # Replace the rows, the manifest entries, the summaries, the status
+    # intervals and the registry entry in a single transaction:
+    table = get_subjects_table(storage_backend.TABLE_NAME)
+    table.create(engine, checkfirst=True)
+    with metrics.stage('write', len(subject_data)) as run, \
+            storage_backend.begin() as connection:
+        run.rows_out = len(subject_data)
+        delete_subject_rows(connection, storage_backend.TABLE_NAME,
+                            subject_num, delete_from_secs)
+        if len(subject_data) > 0:
+            write_rows(select_table_columns(subject_data), connection, table)
+        delete_from_manifest(connection, subject_num, old_files)
+        write_manifest(new_entries, connection)
+        write_summaries(connection, subject_num,
+                        summaries.pop(subject_num), summaries_from_secs)
+        write_status_intervals(connection, subject_num, status_intervals,
+                               intervals_from_secs)
+
+        (num_rows, last_secs, num_days) = summarize_subject_rows(
+            connection, storage_backend.TABLE_NAME, subject_num)
+        if num_rows > 0:
+            end_time = recording_start + pd.Timedelta(seconds=last_secs)
+        else:
+            end_time = None
+        write_registry_entry(connection, subject_num, num_rows,
+                             recording_start, end_time, num_days)
+
+    return len(subject_data)
+
+
+def read_recorded_rows(engine, TABLE_NAME, subject_num, recording_start,
+                       from_secs):
+    """ Reads the stored rows of a subject that were recorded (not filled in
+    because of a gap) from a second to the end of the recording, with their
+    status and time stamp. The recorded seconds are the ones covered by the
+    status intervals of the subject.
+
+        Args:
+            engine: sqlalchemy.engine.base.Engine: Database connection
+            TABLE_NAME: str
+            subject_num: int
+            recording_start: pandas Timestamp: The time of second 0
+            from_secs: int: First second read
+        Returns:
+            recorded_df: pandas DataFrame indexed by secs, with the columns
+            meas_sig_str, status and date_time
+    """
+
+    from_secs = max(from_secs, 0)
+    recorded_df = read_subject_rows(engine, TABLE_NAME, subject_num,
+                                    from_secs)[['meas_sig_str']]
+    recorded_df['status'] = label_time_ranges(
+        read_status_intervals(engine, [subject_num], from_secs=from_secs),
+        pd.DataFrame({'subject_num': subject_num,
+                      'start_secs': recorded_df.index},
+                     index=recorded_df.index))['status']
+    recorded_df = recorded_df[recorded_df['status'].notna()]
+    recorded_df['date_time'] = recording_start + pd.to_timedelta(
+        recorded_df.index, unit='s')
+
+    return recorded_df
+
+
+def main():
+
+    parser = get_argument_parser()
+    parser.add_argument("--subject_num", type=int)
+    parser.add_argument("--subject_files_path", type=str)
+    parser.add_argument("--metrics_path", type=str, default=None)
+    parser.add_argument("--profile", type=str, nargs='?', default=None,
+                        const=PROFILE_PATH)
+    args = parser.parse_args()
+    check_arguments(parser, args)
+
+    if args.invalidate_cache:
+        print("{0} cached subjects removed".format(
+            invalidate_cache(args.cache_path)))
+        # The cache can be emptied without adding a subject:
+        if args.subject_num is None:
+            return
+
+    metrics = PipelineMetrics(subject_num=args.subject_num)
+    if args.profile is not None:
+        profiler = ThreadProfiler()
+        profiler.enable()
+
+    with metrics.stage('connect_to_storage'):
+        storage_backend = connect_to_storage(args)
+
+    pre_process_subject(args.subject_num, args.subject_files_path,
+                        storage_backend, args, metrics)
+
+    if args.profile is not None:
+        profiler.disable()
+        profile_stats = profiler.get_stats()
+        profile_stats.dump_stats(args.profile)
+        metrics.print_summary()
+        profile_stats.sort_stats('cumulative').print_stats(20)
+    if args.metrics_path is not None:
+        metrics.write_json(args.metrics_path)
 
     
 if __name__ == '__main__':
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run this script from command line, for example to accept live recordings on
+port 9750:
+
+    'python serve_live_streams.py --port 9750'
+    Args:
+        host: str: Optional, address the server listens on (default
+        127.0.0.1).
+
+        port: int: Optional, port the server listens on (default 9750).
+
+        max_delay_secs: int: Optional, seconds a sample may arrive after newer
+        samples and still be put in place (default 5). Rows are written
+        max_delay_secs after their second at the earliest.
+
+        batch_rows: int: Optional, number of waiting rows (of all subjects)
+        that starts a write (default 50000).
+
+        flush_secs: float: Optional, longest time rows wait to be written
+        (default 5).
+
+        The pre-processing and storage options of pre_process_subject_data.py
+        (time_zone, max_gap_secs, fill_method, duplicates, day_boundary,
+        period_length, storage, dataset_path) apply to every subject.
+
+This script pre-processes live 1 Hz recordings as they arrive. Each recording
+is a TCP connection that sends the subject number on its first line, then
+the lines of the recording in the format of the csv files (name, time,
+meas_sig_str, status), and an END line when the recording ends. The rows are
+pre-processed one sample at a time (see online_processing_module) and the
+rows of all connected subjects are written together every flush_secs. When a
+recording ends, the subject is recorded in the subject registry and a summary
+line is printed. A connection that closes before the END line is treated as
+dropped: its rows so far are written and the subject may connect again to
+continue the recording.
+"""
+
+# Import the following modules:
+
+from pre_process_subject_data import get_argument_parser, check_arguments, \
+    connect_to_storage
+from sleeposcope_modules.online_processing_module import process_stream, \
+    MicroBatchWriter, MAX_DELAY_SECS, BATCH_ROWS, FLUSH_SECS, END_OF_STREAM
+import asyncio
+import signal
+
+# global variables
+# Connections waiting to be accepted, many recordings may (re)connect at once:
+LISTEN_BACKLOG = 4096
+
+
+async def read_lines(reader):
+    """ Yields the lines sent on a connection until it is closed.
+
+        Args:
+            reader: asyncio.StreamReader
+        Yields:
+            line: str
+    """
+
+    async for line in reader:
+        yield line.decode(errors='replace')
+
+
+async def handle_connection(reader, writer, batch_writer, storage_backend,
+                            args):
+    """ Pre-processes the recording sent on one connection, or continues
+    it if an earlier connection of the subject was dropped.
+
+        Args:
+            reader, writer: asyncio.StreamReader and StreamWriter
+            batch_writer: MicroBatchWriter
+            storage_backend: see storage_backend_module
+            args: argparse.Namespace: Parsed command line options
+        Returns: Nothing
+    """
+
+    subject_num = None
+    reserved = False
+    try:
+        subject_num = int((await reader.readline()).decode().strip())
+        # Nothing is awaited between checking and reserving the subject:
+        processor = batch_writer.reserve_subject(subject_num)
+        reserved = True
+        if processor is None:
+            await asyncio.to_thread(
+                storage_backend.check_if_subject_already_stored, subject_num)
+
+        processor = await process_stream(
+            subject_num, read_lines(reader), batch_writer, processor,
+            time_zone=args.time_zone, max_gap_secs=args.max_gap_secs,
+            fill_method=args.fill_method, duplicates=args.duplicates,
+            day_boundary=args.day_boundary,
+            period_length=args.period_length,
+            max_delay_secs=args.max_delay_secs)
+        if processor.closed:
+            print('subject {0:>5}  OK     {1:>10} rows  {2}'.format(
+                subject_num, processor.num_rows_total, processor.counters),
+                flush=True)
+        else:
+            print('subject {0:>5}  DROPPED {1:>9} rows  no {2} line, waiting '
+                  'for it to reconnect'.format(
+                      subject_num, processor.num_rows_total, END_OF_STREAM),
+                  flush=True)
+    except Exception as error:
+        print('subject {0!s:>5}  FAILED {1}: {2}'.format(
+            subject_num, type(error).__name__, error), flush=True)
+    finally:
+        if reserved:
+            batch_writer.release_subject(subject_num)
+        writer.close()
+
+
+async def serve(args):
+    """ Accepts recordings until the process is stopped (Ctrl-C or SIGTERM),
+    then writes the rows still waiting.
+
+        Args:
+            args: argparse.Namespace: Parsed command line options
+        Returns: Nothing
+    """
+
+    storage_backend = connect_to_storage(args)
+    batch_writer = MicroBatchWriter(storage_backend, args.batch_rows,
+                                    args.flush_secs)
+
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopped.set)
+
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(
+            reader, writer, batch_writer, storage_backend, args),
+        args.host, args.port, backlog=LISTEN_BACKLOG)
+    async with server:
+        await batch_writer.run(stopped)
+    await batch_writer.flush()
+
+
+def main():
+
+    parser = get_argument_parser()
+    parser.add_argument("--host", type=str, default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=9750)
+    parser.add_argument("--max_delay_secs", type=int, default=MAX_DELAY_SECS)
+    parser.add_argument("--batch_rows", type=int, default=BATCH_ROWS)
+    parser.add_argument("--flush_secs", type=float, default=FLUSH_SECS)
+    args = parser.parse_args()
+    check_arguments(parser, args)
+
+    asyncio.run(serve(args))
+
+
+if __name__ == '__main__':
+    main()
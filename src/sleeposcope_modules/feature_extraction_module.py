@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module computes the features the sleep/wake classification is trained
+on, for every epoch (a fixed number of seconds, 30 by default) of the
+pre-processed signal. The epochs of a period start at the first second of the
+period, so the epochs of every subject line up with the day boundary.
+
+Each period is reshaped into a 2-D array with one epoch per row, and every
+feature is computed along the rows at once; there is no Python loop over the
+epochs. Only recorded samples are used: seconds that were filled in (or left
+empty) because of a gap are masked out using the gap mask of the signal (see
+signal_store_module.GAP_MASK_VALUES), and the features of an epoch with less
+than MIN_RECORDED_FRACTION of its seconds recorded are missing.
+
+The features of an epoch are:
+    num_secs: the seconds of the epoch in the period (the last epoch of a
+    period may be shorter)
+    recorded_fraction: the part of num_secs that was recorded
+    mean, variance: of the recorded samples
+    activity_count: the number of seconds the signal changed by more than
+    ACTIVITY_THRESHOLD since the previous second
+    zero_crossings: the number of times the signal crossed the epoch mean
+    power_low, power_mid, power_high: the variance of the signal in each of
+    FREQUENCY_BANDS, from its spectrum; they add up to the variance
+"""
+
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from sleeposcope_modules.signal_store_module import open_signal_file, \
+    get_gap_mask, GAP_MASK_VALUES
+from sleeposcope_modules.talk_to_sql_module import write_features
+
+# Epoch lengths (in seconds) the features are computed for:
+EPOCH_SECS = (30, 60)
+# Epochs with fewer recorded seconds than this fraction have no features:
+MIN_RECORDED_FRACTION = 0.5
+# Change of meas_sig_str from one second to the next counted as activity:
+ACTIVITY_THRESHOLD = 50.0
+# Frequency bands (in Hz, lower edge included, upper edge excluded) of the
+# band powers, covering the spectrum up to the Nyquist frequency:
+FREQUENCY_BANDS = {'power_low': (0.0, 0.05),
+                   'power_mid': (0.05, 0.15),
+                   'power_high': (0.15, np.inf)}
+
+# Columns of the features of each epoch, after subject_num:
+FEATURE_COLUMNS = ['num_days', 'epoch_secs', 'start_secs', 'num_secs',
+                   'recorded_fraction', 'mean', 'variance', 'activity_count',
+                   'zero_crossings'] + list(FREQUENCY_BANDS)
+
+
+def get_epoch_features(signal, recorded, epoch_length, sample_rate=1):
+    """ Computes the features of the epochs of one period.
+
+        Args:
+            signal: numpy array: The samples of the period
+            recorded: numpy array of bool: True where the sample was recorded
+            epoch_length: int: Samples per epoch
+            sample_rate: int: Samples per second
+        Returns:
+            features: dict of numpy arrays, one value per epoch, with the
+            keys num_secs, recorded_fraction and the features
+    """
+
+    # Pad the last epoch with masked samples and put one epoch per row:
+    num_epochs = -(-len(signal) // epoch_length)
+    padding = num_epochs * epoch_length - len(signal)
+    values = np.pad(np.asarray(signal, dtype=np.float64), (0, padding))
+    valid = np.pad(np.asarray(recorded, dtype=bool), (0, padding))
+    valid &= ~np.isnan(values)
+    values = np.where(valid, values, 0.0).reshape(num_epochs, epoch_length)
+    valid = valid.reshape(num_epochs, epoch_length)
+
+    num_samples = np.full(num_epochs, epoch_length)
+    if num_epochs > 0:
+        num_samples[-1] -= padding
+    num_valid = valid.sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = values.sum(axis=1) / num_valid
+        centered = np.where(valid, values - mean[:, np.newaxis], 0.0)
+        variance = np.square(centered).sum(axis=1) / num_valid
+
+        # Only pairs of consecutive recorded samples are compared:
+        both_valid = valid[:, 1:] & valid[:, :-1]
+        activity_count = (both_valid & (np.abs(np.diff(values, axis=1)) >
+                                        ACTIVITY_THRESHOLD)).sum(axis=1)
+        zero_crossings = (both_valid & (centered[:, 1:] * centered[:, :-1] <
+                                        0)).sum(axis=1)
+
+        # Masked samples are at the mean, so they add no power. Every bin
+        # but the first (and the last, for an even length) stands for a
+        # positive and a negative frequency:
+        spectrum = np.square(np.abs(np.fft.rfft(centered, axis=1)))
+        frequencies = np.fft.rfftfreq(epoch_length, d=1 / sample_rate)
+        weights = np.full(len(frequencies), 2.0)
+        weights[0] = 1.0
+        if epoch_length % 2 == 0:
+            weights[-1] = 1.0
+        band_powers = {}
+        for (band, (low, high)) in FREQUENCY_BANDS.items():
+            in_band = (frequencies >= low) & (frequencies < high)
+            band_powers[band] = spectrum[:, in_band] @ weights[in_band] / \
+                (epoch_length * num_valid)
+
+        recorded_fraction = num_valid / num_samples
+
+    features = {'num_secs': num_samples // sample_rate,
+                'recorded_fraction': recorded_fraction,
+                'mean': mean, 'variance': variance,
+                'activity_count': activity_count.astype(np.float64),
+                'zero_crossings': zero_crossings.astype(np.float64),
+                **band_powers}
+    too_few = recorded_fraction < MIN_RECORDED_FRACTION
+    for name in ['mean', 'variance', 'activity_count', 'zero_crossings'] + \
+            list(FREQUENCY_BANDS):
+        features[name][too_few] = np.nan
+
+    return features
+
+
+def extract_epoch_features(signal, gap_mask, day_start_secs,
+                           epoch_secs=EPOCH_SECS, sample_rate=1,
+                           include_filled=False):
+    """ Computes the features of every epoch of a pre-processed signal.
+
+        Args:
+            signal: numpy array: The signal, with no missing seconds
+
+            gap_mask: numpy array: One of GAP_MASK_VALUES per sample
+
+            day_start_secs: numpy array: First second of each period in
+            num_days (period 1 first)
+
+            epoch_secs: tuple of int: The epoch lengths, in seconds
+
+            sample_rate: int: Samples per second
+
+            include_filled: bool: If True the filled-in samples are used as if
+            they had been recorded
+        Returns:
+            features: pandas DataFrame with the columns in FEATURE_COLUMNS,
+            one row per epoch, ordered by epoch_secs, num_days and start_secs
+    """
+
+    recorded = gap_mask == GAP_MASK_VALUES['recorded']
+    if include_filled:
+        recorded |= gap_mask == GAP_MASK_VALUES['filled']
+    day_start_samples = np.asarray(day_start_secs, dtype=np.int64) * \
+        sample_rate
+    day_end_samples = np.append(day_start_samples[1:], len(signal))
+
+    period_features = []
+    for length_secs in epoch_secs:
+        for (num_days, (start, end)) in enumerate(
+                zip(day_start_samples, day_end_samples), start=1):
+            features = pd.DataFrame(get_epoch_features(
+                signal[start:end], recorded[start:end],
+                length_secs * sample_rate, sample_rate))
+            features.insert(0, 'num_days', num_days)
+            features.insert(1, 'epoch_secs', length_secs)
+            features.insert(2, 'start_secs', start // sample_rate +
+                            length_secs * np.arange(len(features)))
+            period_features.append(features)
+
+    if len(period_features) == 0:
+        return pd.DataFrame(columns=FEATURE_COLUMNS)
+
+    return set_feature_dtypes(pd.concat(period_features, ignore_index=True))
+
+
+def set_feature_dtypes(features):
+    """ Narrows the columns of the features to the types they are stored as.
+
+        Args:
+            features: pandas DataFrame with the columns in FEATURE_COLUMNS
+        Returns:
+            features: pandas DataFrame
+    """
+
+    return features.astype({'num_days': np.int16, 'epoch_secs': np.int16,
+                            'start_secs': np.int32, 'num_secs': np.int16,
+                            'recorded_fraction': np.float32,
+                            'mean': np.float32, 'variance': np.float32,
+                            'activity_count': 'Int16',
+                            'zero_crossings': 'Int16',
+                            **{band: np.float32 for band in FREQUENCY_BANDS}})
+
+
+def extract_features_from_subject_data(full_subject_df, gap_summary,
+                                       subject_num, epoch_secs=EPOCH_SECS,
+                                       include_filled=False):
+    """ Computes the epoch features of a subject right after
+    divide_to_24_hour_periods.
+
+        Args:
+            full_subject_df: A pandas DataFrame as returned by
+            divide_to_24_hour_periods: no missing seconds, indexed by seconds
+            and with the columns meas_sig_str and num_days
+
+            gap_summary: A pandas DataFrame: The gaps of full_subject_df (see
+            preprocessing_module.fill_missing_signal_values)
+
+            subject_num: int
+
+            epoch_secs, include_filled: see extract_epoch_features
+        Returns:
+            features: pandas DataFrame with the columns subject_num and
+            FEATURE_COLUMNS
+    """
+
+    signal = full_subject_df['meas_sig_str'].to_numpy(dtype=np.float64,
+                                                      na_value=np.nan)
+    first_sec = full_subject_df.index[0] if len(full_subject_df) > 0 else 0
+    gap_mask = get_gap_mask(gap_summary, first_sec, len(signal))
+    num_days = full_subject_df['num_days'].to_numpy()
+    day_start_secs = np.flatnonzero(np.diff(num_days, prepend=0) != 0)
+
+    features = extract_epoch_features(signal, gap_mask, day_start_secs,
+                                      epoch_secs,
+                                      include_filled=include_filled)
+    # Seconds are counted from the start of the recording, as in the
+    # subjects table:
+    features['start_secs'] += np.int32(first_sec)
+    features.insert(0, 'subject_num', np.int16(subject_num))
+
+    return features
+
+
+def extract_features_from_signal_file(file_path, subject_num,
+                                      epoch_secs=EPOCH_SECS,
+                                      include_filled=False):
+    """ Computes the epoch features of a subject from its signal file (see
+    signal_store_module). The file is memory-mapped, so only the pages being
+    worked on are held in memory.
+
+        Args:
+            file_path: str
+            subject_num: int
+            epoch_secs, include_filled: see extract_epoch_features
+        Returns:
+            features: pandas DataFrame with the columns subject_num and
+            FEATURE_COLUMNS
+    """
+
+    subject_signal = open_signal_file(file_path)
+    features = extract_epoch_features(
+        subject_signal.signal, subject_signal.gap_mask,
+        subject_signal.day_start_secs, epoch_secs,
+        subject_signal.sample_rate, include_filled)
+    features.insert(0, 'subject_num', np.int16(subject_num))
+
+    return features
+
+
+def write_features_to_sql_database(features, engine, subject_num):
+    """ Replaces the epoch features of a subject in the database, in a single
+    transaction.
+
+        Args:
+            features: pandas DataFrame as returned by
+            extract_features_from_signal_file
+            engine: sqlalchemy.engine.base.Engine: Database connection
+            subject_num: int
+        Returns: Nothing
+    """
+
+    with engine.begin() as connection:
+        write_features(connection, subject_num, features)
+
+
+def write_features_to_dataset(features, dataset_path, subject_num,
+                              compression='zstd'):
+    """ Replaces the epoch features of a subject in a parquet dataset
+    partitioned by subject_num and num_days. The subject is written next to
+    the dataset and moved into it once complete. Requires pyarrow.
+
+        Args:
+            features: pandas DataFrame as returned by
+            extract_features_from_signal_file
+            dataset_path: str: Directory of the dataset, created if needed
+            subject_num: int
+            compression: str: Compression codec of the parquet files
+        Returns: Nothing
+    """
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    subject_directory = 'subject_num={0}'.format(subject_num)
+    staging_path = os.path.join(dataset_path, '.staging_' + subject_directory)
+    subject_path = os.path.join(dataset_path, subject_directory)
+    shutil.rmtree(staging_path, ignore_errors=True)
+    try:
+        pq.write_to_dataset(pa.Table.from_pandas(features,
+                                                 preserve_index=False),
+                            staging_path,
+                            partition_cols=['subject_num', 'num_days'],
+                            compression=compression)
+        shutil.rmtree(subject_path, ignore_errors=True)
+        if os.path.exists(os.path.join(staging_path, subject_directory)):
+            os.replace(os.path.join(staging_path, subject_directory),
+                       subject_path)
+    finally:
+        shutil.rmtree(staging_path, ignore_errors=True)
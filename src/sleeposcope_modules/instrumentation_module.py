@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module measures the stages of the pipeline (reading, gap filling,
+dividing into periods, writing...). For each stage it records the wall time,
+the CPU time, the number of rows in and out and how much the peak memory of
+the process grew, and it counts events such as rejected files. The
+measurements are cheap enough to be always on, and are written as JSON.
+
+A stage run inside another one (e.g. when blocks of time are read on demand
+by the gap filling) is not counted in the time of the outer stage, so the
+times of the stages add up to the time of the run. Stages can be measured in
+several threads at once (see pipeline_module): the CPU time is that of the
+thread the stage ran in, and the times of stages that ran at the same time
+add up to more than the time of the run.
+
+For a closer look, ThreadProfiler profiles a run with cProfile in every
+thread it starts.
+"""
+
+import cProfile
+import json
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory is then not measured:
+    resource = None
+
+
+class StageRecord(object):
+    """ The measurements of one stage, added up over all its runs. """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.calls = 0
+        self.wall_secs = 0.0
+        self.cpu_secs = 0.0
+        self.rows_in = 0
+        self.rows_out = 0
+        self.peak_memory_delta_bytes = 0
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class StageRun(object):
+    """ One run of a stage, see PipelineMetrics.stage.
+
+        Attributes:
+            rows_out: int: To be set by the stage
+    """
+
+    def __init__(self, rows_in):
+        self.rows_in = rows_in
+        self.rows_out = 0
+        self.inner_wall_secs = 0.0
+        self.inner_cpu_secs = 0.0
+        self.inner_memory_bytes = 0
+
+
+class PipelineMetrics(object):
+    """ Collects the measurements of the stages of a run.
+
+        Args:
+            labels: dict: Optional, added to the JSON output (e.g. the
+            subject_num)
+    """
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self.records = {}
+        self.counters = {}
+        # Stages running in each thread, innermost last:
+        self.running = threading.local()
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, stage, rows_in=0):
+        """ Measures a run of a stage:
+
+            with metrics.stage('fill_missing_data', len(subject_df)) as run:
+                full_subject_df = fill_missing_data(subject_df)
+                run.rows_out = len(full_subject_df)
+
+            Args:
+                stage: str: Name of the stage
+                rows_in: int: Number of rows the stage is given
+            Yields:
+                run: StageRun
+        """
+
+        run = StageRun(rows_in)
+        running = self.get_running_stages()
+        running.append(run)
+        start_memory = get_peak_memory_bytes()
+        (start_wall, start_cpu) = (time.perf_counter(), time.thread_time())
+        try:
+            yield run
+        finally:
+            wall_secs = time.perf_counter() - start_wall
+            cpu_secs = time.thread_time() - start_cpu
+            memory_bytes = get_peak_memory_bytes() - start_memory
+            running.pop()
+            # The stage it ran in does not include this stage:
+            if len(running) > 0:
+                running[-1].inner_wall_secs += wall_secs
+                running[-1].inner_cpu_secs += cpu_secs
+                running[-1].inner_memory_bytes += memory_bytes
+
+            with self.lock:
+                record = self.records.setdefault(stage, StageRecord(stage))
+                record.calls += 1
+                record.wall_secs += wall_secs - run.inner_wall_secs
+                record.cpu_secs += cpu_secs - run.inner_cpu_secs
+                record.rows_in += run.rows_in
+                record.rows_out += run.rows_out
+                record.peak_memory_delta_bytes += \
+                    memory_bytes - run.inner_memory_bytes
+
+    def get_running_stages(self):
+        """ Finds the stages running in the current thread.
+
+            Args: None
+            Returns:
+                running: list of StageRun, innermost last
+        """
+
+        if not hasattr(self.running, 'stages'):
+            self.running.stages = []
+        return self.running.stages
+
+    def measure_chunks(self, stage, chunks):
+        """ Measures a stage that yields blocks of rows one at a time (e.g.
+        preprocessing_module.fill_missing_data_in_chunks), each block as a
+        run of the stage. The rows the stage takes are counted if its input
+        is wrapped in count_rows_in:
+
+            subject_chunks = metrics.measure_chunks(
+                'fill_missing_data', fill_missing_data_in_chunks(
+                    metrics.count_rows_in(subject_chunks)))
+
+            Args:
+                stage: str: Name of the stage
+                chunks: iterator of pandas DataFrames
+            Yields:
+                chunk: pandas DataFrame
+        """
+
+        chunks = iter(chunks)
+        while True:
+            with self.stage(stage) as run:
+                chunk = next(chunks, None)
+                if chunk is not None:
+                    run.rows_out = len(chunk)
+            if chunk is None:
+                return
+            yield chunk
+
+    def count_rows_in(self, chunks):
+        """ Counts the rows of the blocks a stage takes in the run of the
+        stage that takes them (see measure_chunks).
+
+            Args:
+                chunks: iterator of pandas DataFrames (None is passed on
+                and not counted)
+            Yields:
+                chunk: pandas DataFrame
+        """
+
+        for chunk in chunks:
+            running = self.get_running_stages()
+            if chunk is not None and len(running) > 0:
+                running[-1].rows_in += len(chunk)
+            yield chunk
+
+    def count(self, counter, number=1):
+        """ Counts events, e.g. rejected files.
+
+            Args:
+                counter: str: Name of the counter
+                number: int
+            Returns: Nothing
+        """
+
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + number
+
+    def to_dict(self):
+        return {'labels': self.labels,
+                'total_wall_secs': time.perf_counter() - self.start,
+                'stages': [record.to_dict() for record in
+                           self.records.values()],
+                'counters': self.counters}
+
+    def write_json(self, file_name):
+        """ Writes the measurements to a JSON file.
+
+            Args:
+                file_name: str
+            Returns: Nothing
+        """
+
+        with open(file_name, 'w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    def print_summary(self):
+        """ Prints one line per stage. """
+
+        print("{0:<28} {1:>6} {2:>10} {3:>10} {4:>10} {5:>10} {6:>10}".format(
+            'stage', 'calls', 'wall s', 'cpu s', 'rows in', 'rows out',
+            'mem MiB'))
+        for record in self.records.values():
+            print("{0:<28} {1:>6} {2:>10.3f} {3:>10.3f} {4:>10} {5:>10} "
+                  "{6:>10.1f}".format(record.stage, record.calls,
+                                      record.wall_secs, record.cpu_secs,
+                                      record.rows_in, record.rows_out,
+                                      record.peak_memory_delta_bytes /
+                                      2 ** 20))
+        for (counter, number) in self.counters.items():
+            print("{0}: {1}".format(counter, number))
+
+
+class NoMetrics(PipelineMetrics):
+    """ Metrics that measure nothing, for callers that do not want any. """
+
+    @contextmanager
+    def stage(self, stage, rows_in=0):
+        yield StageRun(rows_in)
+
+    def measure_chunks(self, stage, chunks):
+        return chunks
+
+    def count_rows_in(self, chunks):
+        return chunks
+
+    def count(self, counter, number=1):
+        pass
+
+
+def get_peak_memory_bytes():
+    """ Finds the peak memory (resident set size) of the process so far.
+
+        Args: None
+        Returns:
+            peak_bytes: int, 0 where it cannot be measured
+    """
+
+    if resource is None:
+        return 0
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux:
+    if sys.platform == 'darwin':
+        return peak_rss
+    return peak_rss * 1024
+
+
+class ThreadProfiler(object):
+    """ Profiles the calling thread and every thread started while it is
+    enabled (e.g. the stages of pipeline_module) with cProfile, one profiler
+    per thread. Used as cProfile.Profile is:
+
+        profiler = ThreadProfiler()
+        profiler.enable()
+        ...
+        profiler.disable()
+        profiler.get_stats().sort_stats('cumulative').print_stats(20)
+
+    The times of functions that ran in several threads at once add up.
+    Processes (e.g. the workers reading files ahead) are not profiled.
+    """
+
+    def __init__(self):
+        self.profilers = [cProfile.Profile()]
+        self.lock = threading.Lock()
+
+    def enable(self):
+        threading.setprofile(self.profile_new_thread)
+        self.profilers[0].enable()
+
+    def disable(self):
+        self.profilers[0].disable()
+        threading.setprofile(None)
+
+    def profile_new_thread(self, frame, event, arg):
+        """ Called once at the start of each new thread, replaces itself with
+        a profiler of the thread.
+        """
+
+        sys.setprofile(None)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # From Python 3.12 on, only one profiler can be enabled, and the
+            # one of the calling thread already sees every thread:
+            return
+        with self.lock:
+            self.profilers.append(profiler)
+
+    def get_stats(self):
+        """ Combines the profiles of all threads.
+
+            Args: None
+            Returns:
+                stats: pstats.Stats
+        """
+
+        with self.lock:
+            return pstats.Stats(*self.profilers)
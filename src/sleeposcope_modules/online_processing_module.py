@@ -0,0 +1,510 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module pre-processes live 1 Hz recordings one sample at a time, as they
+arrive, instead of from complete csv files. OnlineSubjectProcessor gives the
+same rows as read_data, fill_missing_data and divide_to_24_hour_periods (see
+preprocessing_module) would give for the same samples, while holding a fixed
+amount of state per subject:
+    the last max_gap_secs seconds of the signal, the source of copy_previous
+    gap filling (a ring buffer)
+    the samples of the last max_delay_secs seconds, which are not final yet
+    so that samples arriving out of order or more than once are put in place
+    the onset of the next period
+A gap is filled once the sample that closes it arrives. Samples that arrive
+more than max_delay_secs after newer ones are dropped and counted.
+
+MicroBatchWriter collects the rows of many subjects and writes them together,
+every flush_secs or once batch_rows rows are waiting, so that thousands of
+subjects can be streamed from one asyncio process (see process_stream). A
+feed ends with an END_OF_STREAM line; a feed that stops without it (e.g. a
+dropped connection) keeps the state of its subject in the MicroBatchWriter,
+so that the subject can reconnect and continue where it stopped.
+"""
+
+import asyncio
+import time
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from sleeposcope_modules.preprocessing_module import LOCAL_TIME_ZONE, \
+    MAX_COPY_FILL_SECS, FILL_METHODS, DUPLICATE_POLICIES, DAY_BOUNDARY, \
+    PERIOD_LENGTH, get_period_onsets, compact_subject_data
+from sleeposcope_modules.sanity_check_module import FillMethodIsUnknownError, \
+    DuplicatePolicyIsUnknownError
+
+# Seconds a sample may arrive after newer samples and still be put in place:
+MAX_DELAY_SECS = 5
+# Rows written together by MicroBatchWriter, and how often (in seconds) the
+# rows waiting are written:
+BATCH_ROWS = 50000
+FLUSH_SECS = 5.0
+# Line that ends the live csv feed of a subject:
+END_OF_STREAM = 'END'
+
+
+class OnlineSubjectProcessor(object):
+    """ Pre-processes the samples of one subject as they arrive.
+
+        processor = OnlineSubjectProcessor()
+        for line in live_csv_lines:
+            processor.add_line(line)
+            subject_data = processor.take_rows()
+        processor.close()
+
+        Args:
+            time_zone: str: Time zone the time-stamps are converted to
+            max_gap_secs: int: Longest gap in the signal that is filled
+            fill_method: str: How gaps in the signal are filled, one of
+            FILL_METHODS
+            duplicates: str: How seconds recorded more than once are
+            combined, one of DUPLICATE_POLICIES
+            day_boundary: str: Time of day (hh:mm:ss) at which periods start
+            period_length: str or pandas Timedelta: Length of each period, a
+            whole number of seconds
+            max_delay_secs: int: Seconds a sample may arrive after newer
+            samples and still be put in place. Rows are final, and given out
+            by take_rows, max_delay_secs after their second.
+    """
+
+    def __init__(self, time_zone=LOCAL_TIME_ZONE,
+                 max_gap_secs=MAX_COPY_FILL_SECS,
+                 fill_method='copy_previous', duplicates='first',
+                 day_boundary=DAY_BOUNDARY, period_length=PERIOD_LENGTH,
+                 max_delay_secs=MAX_DELAY_SECS):
+        if fill_method not in FILL_METHODS:
+            raise FillMethodIsUnknownError("fill_method must be one of "
+                                           "{0}".format(FILL_METHODS))
+        if duplicates not in DUPLICATE_POLICIES:
+            raise DuplicatePolicyIsUnknownError(
+                "duplicates must be one of {0}".format(DUPLICATE_POLICIES))
+
+        self.time_zone = time_zone
+        self.max_gap_secs = max_gap_secs
+        self.fill_method = fill_method
+        self.duplicates = duplicates
+        self.day_boundary = day_boundary
+        self.period_secs = int(pd.Timedelta(period_length).total_seconds())
+        self.max_delay_secs = max_delay_secs
+
+        # Samples not final yet: [sum of meas_sig_str, status, count] by
+        # second (seconds are UTC epoch seconds until recording_start is
+        # known):
+        self.pending = {}
+        self.newest_sec = None
+        # Last final second, and its signal:
+        self.last_sec = None
+        self.last_value = np.nan
+        # Signal of the last max_gap_secs final seconds, NaN where it was
+        # missing, at position second % max_gap_secs:
+        self.recent_signal = np.full(max(max_gap_secs, 1), np.nan)
+
+        self.recording_start = None
+        self.num_days = 1
+        self.next_onset_sec = None
+
+        # Final rows not taken yet:
+        self.rows = {'secs': [], 'meas_sig_str': [], 'status': [],
+                     'num_days': []}
+        self.num_rows = 0
+        self.num_rows_total = 0
+        self.closed = False
+        self.counters = {'garbage_lines': 0, 'defective_lines': 0,
+                         'late_samples': 0, 'duplicate_samples': 0}
+
+    def add_line(self, line):
+        """ Adds a line of a live csv feed, with the columns name, time,
+        meas_sig_str and status. Garbage lines that repeat the column headers
+        and lines that cannot be read are counted and skipped.
+
+            Args:
+                line: str
+            Returns: Nothing
+        """
+
+        fields = line.strip().split(',')
+        if len(fields) != 4:
+            self.counters['defective_lines'] += 1
+            return
+        if fields[1] == 'time':
+            self.counters['garbage_lines'] += 1
+            return
+
+        try:
+            epoch_sec = parse_time_stamp(fields[1])
+            meas_sig_str = float(fields[2])
+        except ValueError:
+            self.counters['defective_lines'] += 1
+            return
+        if np.isnan(meas_sig_str):
+            self.counters['defective_lines'] += 1
+            return
+
+        self.add_sample(epoch_sec, meas_sig_str, fields[3])
+
+    def add_sample(self, epoch_sec, meas_sig_str, status):
+        """ Adds a sample. Seconds that no sample can still arrive for in
+        time are made final.
+
+            Args:
+                epoch_sec: int: Time of the sample in seconds since the epoch
+                (UTC)
+                meas_sig_str: float
+                status: str
+            Returns: Nothing
+        """
+
+        if self.recording_start is not None:
+            epoch_sec -= self.recording_start
+        if self.last_sec is not None and epoch_sec <= self.last_sec:
+            self.counters['late_samples'] += 1
+            return
+
+        sample = self.pending.get(epoch_sec)
+        if sample is None:
+            self.pending[epoch_sec] = [meas_sig_str, status, 1]
+        else:
+            self.counters['duplicate_samples'] += 1
+            if self.duplicates == 'last':
+                self.pending[epoch_sec] = [meas_sig_str, status, 1]
+            elif self.duplicates == 'mean':
+                sample[0] += meas_sig_str
+                sample[2] += 1
+
+        if self.newest_sec is None or epoch_sec > self.newest_sec:
+            self.newest_sec = epoch_sec
+        self.finalize(self.newest_sec - self.max_delay_secs)
+
+    def close(self):
+        """ Makes every second final, at the end of the recording.
+
+            Args: None
+            Returns: Nothing
+        """
+
+        if self.newest_sec is not None:
+            self.finalize(self.newest_sec)
+        self.closed = True
+
+    def finalize(self, until_sec):
+        """ Makes the seconds up to until_sec final, filling the gaps before
+        them.
+
+            Args:
+                until_sec: int
+            Returns: Nothing
+        """
+
+        final_secs = sorted(sec for sec in self.pending if sec <= until_sec)
+        if len(final_secs) == 0:
+            return
+        if self.recording_start is None:
+            # The recording starts with its first final second, seconds are
+            # counted from it from now on:
+            self.start_recording(final_secs[0])
+            final_secs = [sec - self.recording_start for sec in final_secs]
+            self.newest_sec -= self.recording_start
+            self.pending = {sec - self.recording_start: sample for
+                            (sec, sample) in self.pending.items()}
+
+        for sec in final_secs:
+            (meas_sig_str, status, count) = self.pending.pop(sec)
+            meas_sig_str = meas_sig_str / count
+            if self.last_sec is not None and sec > self.last_sec + 1:
+                self.fill_gap(self.last_sec + 1, sec, meas_sig_str)
+            self.add_row(sec, meas_sig_str, status)
+
+    def start_recording(self, epoch_sec):
+        """ Sets the beginning of the recording and the onset of the second
+        period.
+
+            Args:
+                epoch_sec: int: First second of the recording
+            Returns: Nothing
+        """
+
+        self.recording_start = epoch_sec
+        recording_start = pd.Timestamp(epoch_sec, unit='s', tz='UTC')
+        first_onset = get_period_onsets(
+            recording_start, recording_start + pd.Timedelta(
+                seconds=self.period_secs), self.day_boundary,
+            pd.Timedelta(seconds=self.period_secs), self.time_zone)[0]
+        self.next_onset_sec = int(
+            (first_onset - recording_start) // pd.Timedelta(seconds=1))
+
+    def fill_gap(self, gap_start, gap_end, next_value):
+        """ Adds the rows of a gap once the sample after it has arrived,
+        filled as fill_missing_signal_values does.
+
+            Args:
+                gap_start: int: First missing second
+                gap_end: int: Second of the sample after the gap
+                next_value: float: Its signal
+            Returns: Nothing
+        """
+
+        gap_length = gap_end - gap_start
+        if gap_length > self.max_gap_secs or self.fill_method == 'leave_nan':
+            fill_values = np.full(gap_length, np.nan)
+        elif self.fill_method == 'copy_previous':
+            # The segment of the same length just before the gap, NaN before
+            # the beginning of the recording:
+            source_secs = np.arange(gap_start - gap_length, gap_start)
+            fill_values = np.where(source_secs >= 0, self.recent_signal[
+                source_secs % len(self.recent_signal)], np.nan)
+        else:
+            fill_values = np.interp(np.arange(1, gap_length + 1),
+                                    [0, gap_length + 1],
+                                    [self.last_value, next_value])
+
+        for (offset, value) in enumerate(fill_values):
+            self.add_row(gap_start + offset, value, np.nan, recorded=False)
+
+    def add_row(self, sec, meas_sig_str, status, recorded=True):
+        """ Adds a final row, with the period it belongs to.
+
+            Args:
+                sec: int: Seconds from the beginning of the recording
+                meas_sig_str: float
+                status: str (NaN in gaps)
+                recorded: bool: False for the seconds of a gap
+            Returns: Nothing
+        """
+
+        while sec >= self.next_onset_sec:
+            self.num_days += 1
+            self.next_onset_sec += self.period_secs
+
+        # Filled seconds are not a source for filling later gaps:
+        self.recent_signal[sec % len(self.recent_signal)] = \
+            meas_sig_str if recorded else np.nan
+        self.last_sec = sec
+        if recorded:
+            self.last_value = meas_sig_str
+
+        self.rows['secs'].append(sec)
+        self.rows['meas_sig_str'].append(meas_sig_str)
+        self.rows['status'].append(status)
+        self.rows['num_days'].append(self.num_days)
+        self.num_rows += 1
+        self.num_rows_total += 1
+
+    def take_rows(self):
+        """ Gives out the final rows added since the last call.
+
+            Args: None
+            Returns:
+                full_subject_df: A pandas DataFrame indexed by seconds from
+                the beginning of the recording, with the columns
+                meas_sig_str, status, date_time and num_days, as returned by
+                divide_to_24_hour_periods
+        """
+
+        rows = self.rows
+        self.rows = {column: [] for column in rows}
+        self.num_rows = 0
+
+        secs = np.asarray(rows['secs'], dtype=np.int64)
+        start = 0 if self.recording_start is None else self.recording_start
+        date_time = pd.DatetimeIndex((secs + start).astype(
+            'datetime64[s]')).tz_localize('UTC').tz_convert(self.time_zone)
+
+        return pd.DataFrame({'meas_sig_str': np.asarray(
+                                 rows['meas_sig_str'], dtype=float),
+                             'status': rows['status'],
+                             'date_time': date_time,
+                             'num_days': np.asarray(rows['num_days'],
+                                                    dtype=np.int32)},
+                            index=pd.Index(secs, name='secs'))
+
+
+    def get_registry_entry(self):
+        """ Describes the final rows so far for the subject registry (see
+        talk_to_sql_module.write_registry_entry).
+
+            Args: None
+            Returns:
+                registry_entry: dict with the keys num_rows, start_time,
+                end_time and num_days
+        """
+
+        if self.num_rows_total == 0:
+            return {'num_rows': 0, 'start_time': None, 'end_time': None,
+                    'num_days': 0}
+
+        start_time = pd.Timestamp(self.recording_start, unit='s',
+                                  tz='UTC').tz_convert(self.time_zone)
+        return {'num_rows': self.num_rows_total, 'start_time': start_time,
+                'end_time': start_time + pd.Timedelta(seconds=self.last_sec),
+                'num_days': self.num_days}
+
+
+def parse_time_stamp(time_stamp):
+    """ Parses a time-stamp of the form yyyy-mm-ddThh:mm:ssZ (or any form the
+    flexible pandas parser understands). A time-stamp without a time zone is
+    in UTC, as in preprocessing_module.convert_to_local_time.
+
+        Args:
+            time_stamp: str
+        Returns:
+            epoch_sec: int: Seconds since the epoch (UTC)
+    """
+
+    try:
+        parsed = datetime.fromisoformat(time_stamp.replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return int(parsed.timestamp())
+    except ValueError:
+        parsed = pd.Timestamp(time_stamp)
+        if parsed is pd.NaT:
+            raise ValueError("Defective time-stamp {0}".format(time_stamp))
+        if parsed.tzinfo is None:
+            parsed = parsed.tz_localize('UTC')
+        return int(parsed.timestamp())
+
+
+class MicroBatchWriter(object):
+    """ Writes the rows of many online subjects together, so that the storage
+    is written to once per batch instead of once per sample or per subject.
+
+        Args:
+            storage_backend: see storage_backend_module, written to in a
+            worker thread
+            batch_rows: int: Number of waiting rows that starts a write
+            flush_secs: float: Longest time rows wait to be written
+    """
+
+    def __init__(self, storage_backend, batch_rows=BATCH_ROWS,
+                 flush_secs=FLUSH_SECS):
+        self.storage_backend = storage_backend
+        self.batch_rows = batch_rows
+        self.flush_secs = flush_secs
+        # Processors of the subjects that have not ended, streaming or
+        # waiting to reconnect:
+        self.processors = {}
+        # Subjects a feed is being read for:
+        self.streaming = set()
+        self.flush_lock = asyncio.Lock()
+        self.last_flush = time.monotonic()
+        # Rows of all subjects waiting to be written:
+        self.num_rows_waiting = 0
+        self.num_rows_written = 0
+
+    def reserve_subject(self, subject_num):
+        """ Marks a subject as streaming. Called before anything is awaited,
+        so that two feeds of the same subject cannot both start.
+
+            Args:
+                subject_num: int
+            Returns:
+                processor: OnlineSubjectProcessor of an earlier feed of the
+                subject that stopped without END_OF_STREAM, or None
+        """
+
+        if subject_num in self.streaming:
+            raise ValueError("subject {0} is already streaming".format(
+                subject_num))
+        self.streaming.add(subject_num)
+
+        return self.processors.get(subject_num)
+
+    def release_subject(self, subject_num):
+        self.streaming.discard(subject_num)
+
+    def add_subject(self, subject_num, processor):
+        self.processors[subject_num] = processor
+
+    def remove_subject(self, subject_num):
+        self.processors.pop(subject_num, None)
+
+    def is_due(self):
+        return self.num_rows_waiting >= self.batch_rows or \
+            time.monotonic() - self.last_flush >= self.flush_secs
+
+    async def flush(self):
+        """ Writes the rows of every subject waiting to be written.
+
+            Args: None
+            Returns: Nothing
+        """
+
+        async with self.flush_lock:
+            self.last_flush = time.monotonic()
+            batches = []
+            for (subject_num, processor) in list(self.processors.items()):
+                if processor.num_rows > 0:
+                    subject_data = processor.take_rows().reset_index()
+                    subject_data['subject_num'] = subject_num
+                    batches.append(subject_data)
+            self.num_rows_waiting = 0
+            if len(batches) == 0:
+                return
+
+            subject_data = compact_subject_data(
+                pd.concat(batches, ignore_index=True))
+            await asyncio.to_thread(self.storage_backend.write, subject_data)
+            self.num_rows_written += len(subject_data)
+
+    async def run(self, stopped):
+        """ Writes the waiting rows every flush_secs until stopped.
+
+            Args:
+                stopped: asyncio.Event
+            Returns: Nothing
+        """
+
+        while not stopped.is_set():
+            try:
+                await asyncio.wait_for(stopped.wait(), self.flush_secs)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+
+async def process_stream(subject_num, lines, writer, processor=None,
+                         **options):
+    """ Pre-processes the live csv feed of a subject, with its rows written by
+    a MicroBatchWriter shared with other subjects. Once the END_OF_STREAM
+    line arrives, the subject is recorded in the subject registry. If the
+    feed stops before it, or fails, the final rows are written and the
+    processor is kept in the writer, to be continued by the next feed of the
+    subject (see MicroBatchWriter.reserve_subject).
+
+        Args:
+            subject_num: int
+            lines: async iterator of str: The lines of the feed
+            writer: MicroBatchWriter
+            processor: OnlineSubjectProcessor: Optional, the processor of an
+            earlier feed of the subject to continue
+            options: passed on to OnlineSubjectProcessor
+        Returns:
+            processor: OnlineSubjectProcessor, with its counters, closed if
+            the feed ended
+    """
+
+    if processor is None:
+        processor = OnlineSubjectProcessor(**options)
+        writer.add_subject(subject_num, processor)
+    try:
+        async for line in lines:
+            num_rows = processor.num_rows
+            if line.strip() == END_OF_STREAM:
+                processor.close()
+            else:
+                processor.add_line(line)
+            writer.num_rows_waiting += processor.num_rows - num_rows
+            if processor.closed:
+                break
+            if writer.is_due():
+                await writer.flush()
+    finally:
+        # Rows that are final are not lost if the feed failed:
+        await writer.flush()
+
+    if processor.closed:
+        writer.remove_subject(subject_num)
+        await asyncio.to_thread(writer.storage_backend.register_subject,
+                                subject_num, **processor.get_registry_entry())
+
+    return processor
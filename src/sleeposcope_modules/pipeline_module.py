@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module runs the stages of the pipeline at the same time, each in its
+own thread, passing blocks of subject data from one stage to the next through
+bounded queues. While the database is busy writing a block, the next blocks
+are being read and gap-filled, so the time of a run approaches the time of
+its slowest stage instead of the sum of all stages. A stage that gets ahead
+waits when the queue to the next stage is full (backpressure), so at most
+queue_size blocks are held between two stages.
+
+If any stage fails, every other stage is stopped and the error of the stage
+that failed is raised by run_pipeline.
+"""
+
+import queue
+import threading
+from sleeposcope_modules.sanity_check_module import PipelineWasCancelledError
+
+# Number of blocks held between two stages:
+PIPELINE_QUEUE_SIZE = 4
+# How often (in seconds) a stage waiting on a queue checks if the pipeline
+# was cancelled:
+CANCEL_CHECK_SECS = 0.1
+
+# Put on a queue after the last block:
+END_OF_BLOCKS = object()
+
+
+class Pipeline(object):
+    """ The queues and the cancellation state shared by the stages of a run
+    of run_pipeline.
+
+        Args:
+            queue_size: int: Number of blocks held between two stages
+    """
+
+    def __init__(self, queue_size=PIPELINE_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.cancelled = threading.Event()
+        self.errors = []
+        self.errors_lock = threading.Lock()
+
+    def cancel(self, error=None):
+        """ Stops every stage, recording the error that caused it.
+
+            Args:
+                error: Exception: Optional
+            Returns: Nothing
+        """
+
+        if error is not None and \
+                not isinstance(error, PipelineWasCancelledError):
+            with self.errors_lock:
+                self.errors.append(error)
+        self.cancelled.set()
+
+    def put(self, blocks_queue, block):
+        """ Puts a block on a queue, waiting while the queue is full.
+
+            Args:
+                blocks_queue: queue.Queue
+                block: a block of subject data or END_OF_BLOCKS
+            Returns: Nothing
+        """
+
+        while True:
+            if self.cancelled.is_set():
+                raise PipelineWasCancelledError("The pipeline was cancelled")
+            try:
+                blocks_queue.put(block, timeout=CANCEL_CHECK_SECS)
+                return
+            except queue.Full:
+                continue
+
+    def iterate_queue(self, blocks_queue):
+        """ Yields the blocks put on a queue until END_OF_BLOCKS.
+
+            Args:
+                blocks_queue: queue.Queue
+            Yields:
+                block: a block of subject data
+        """
+
+        while True:
+            if self.cancelled.is_set():
+                raise PipelineWasCancelledError("The pipeline was cancelled")
+            try:
+                block = blocks_queue.get(timeout=CANCEL_CHECK_SECS)
+            except queue.Empty:
+                continue
+            if block is END_OF_BLOCKS:
+                return
+            yield block
+
+    def run_stage(self, blocks, blocks_queue):
+        """ Puts the blocks yielded by a stage on a queue, in a thread of its
+        own.
+
+            Args:
+                blocks: iterable of blocks of subject data
+                blocks_queue: queue.Queue
+            Returns: Nothing
+        """
+
+        try:
+            for block in blocks:
+                self.put(blocks_queue, block)
+            self.put(blocks_queue, END_OF_BLOCKS)
+        except BaseException as error:
+            self.cancel(error)
+
+
+def run_pipeline(blocks, stages, consume, queue_size=PIPELINE_QUEUE_SIZE):
+    """ Runs the stages of a pipeline at the same time:
+
+        num_rows = run_pipeline(
+            read_data_in_chunks(subject_folder_path, chunk_secs),
+            [fill_missing_data_in_chunks, divide_to_24_hour_periods_in_chunks],
+            storage_backend.write_subject)
+
+        Args:
+            blocks: iterable of blocks of subject data (e.g. a generator
+            reading them), iterated in a thread of its own
+
+            stages: list of functions, each taking an iterator of the blocks
+            of the previous stage and returning an iterator of blocks, each
+            run in a thread of its own
+
+            consume: function taking an iterator of the blocks of the last
+            stage, run in the calling thread (e.g. to write them to the
+            database in a single transaction)
+
+            queue_size: int: Number of blocks held between two stages
+        Returns:
+            what consume returns
+    """
+
+    pipeline = Pipeline(queue_size)
+    threads = []
+    for stage in [None] + list(stages):
+        blocks_queue = queue.Queue(maxsize=pipeline.queue_size)
+        if stage is not None:
+            blocks = stage(pipeline.iterate_queue(blocks))
+        threads.append(threading.Thread(
+            target=pipeline.run_stage, args=(blocks, blocks_queue),
+            daemon=True))
+        blocks = blocks_queue
+
+    for thread in threads:
+        thread.start()
+    try:
+        result = consume(pipeline.iterate_queue(blocks))
+    except BaseException as error:
+        pipeline.cancel(error)
+    finally:
+        # A stage stops at the next block it reads or writes:
+        pipeline.cancelled.set()
+        for thread in threads:
+            thread.join()
+
+    if len(pipeline.errors) > 0:
+        raise pipeline.errors[0]
+
+    return result
@@ -7,65 +7,231 @@ This module contains all functions to be used in the sleeposcope project.
 
 import pandas as pd
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+from functools import partial
+import hashlib
+import json
+import os
+import pickle
 from sleeposcope_modules.sanity_check_module import check_file_df_content
 from sleeposcope_modules.sanity_check_module import get_file_names_if_they_exist
 from sleeposcope_modules.sanity_check_module import FileIsNotCorrectDataFileError
 from sleeposcope_modules.sanity_check_module import check_if_data_frame_is_valid
 from sleeposcope_modules.sanity_check_module import DateTimeColumnIsDefectiveError
-from sleeposcope_modules.sanity_check_module import DataFrameContainsNans
+from sleeposcope_modules.sanity_check_module import \
+    DataFileOrFolderDoesNotExistError
+from sleeposcope_modules.sanity_check_module import FillMethodIsUnknownError
+from sleeposcope_modules.sanity_check_module import \
+    DuplicatePolicyIsUnknownError
+from sleeposcope_modules.sanity_check_module import ValueOutOfRangeError
+from sleeposcope_modules.validation_module import describe_file_quality, \
+    describe_file_content, describe_rejected_file, check_file_quality, \
+    describe_subject_quality
+from sleeposcope_modules.instrumentation_module import NoMetrics
 
-def read_data(subject_folder_path):
+# Time zone the recordings are converted to and format of the time-stamps in
+# the csv files:
+LOCAL_TIME_ZONE = 'US/Pacific'
+TIME_STAMP_PATTERN = b'0000-00-00T00:00:00Z'
+
+# Longest gap in the signal (in seconds) that is filled by copying the
+# preceding segment:
+MAX_COPY_FILL_SECS = 5 * 60
+# Ways gaps in the signal can be filled (see fill_missing_signal_values):
+FILL_METHODS = ('copy_previous', 'interpolate', 'leave_nan')
+# Ways seconds recorded more than once are combined (see
+# drop_duplicate_seconds):
+DUPLICATE_POLICIES = ('first', 'last', 'mean')
+
+# Time of day at which the periods the recording is divided into start, and
+# their length (see divide_to_24_hour_periods):
+DAY_BOUNDARY = '12:00:00'
+PERIOD_LENGTH = '24 hours'
+
+# Compact types of the pre-processed subject data (see compact_subject_data).
+# meas_sig_str is stored in the smallest nullable integer type its values fit
+# in (unfilled gaps are masked, not NaN), or float32 if it has fractional
+# values, and status as a categorical:
+SUBJECT_DATA_DTYPES = {'subject_num': 'int16',
+                       'num_days': 'int16',
+                       'secs': 'int32',
+                       'status': 'category'}
+SIGNAL_INTEGER_DTYPES = ('Int16', 'Int32')
+
+# Cache of pre-processed subjects (see read_preprocessed_data): largest total
+# size of the cache files, and version of the pre-processing, to be increased
+# whenever a change to the pipeline changes its results:
+MAX_CACHE_BYTES = 4 * 2 ** 30
+CACHE_VERSION = 1
+CACHE_FILE_SUFFIX = '.pkl'
+
+def read_data(subject_folder_path, time_zone=LOCAL_TIME_ZONE, num_workers=1,
+              return_quality_report=False):
     """ Reads in a number of csv files and returns a DataFrame containing the 
-    concatenated data.
+    concatenated data. With more than one worker the files are read, checked,
+    cleaned up and converted to local time in a pool of processes, one file
+    per task.
     
         Args: 
             subject_folder_path: str: Full or relative path to the csv data
             files
+
+            time_zone: str: Time zone the time-stamps are converted to
+
+            num_workers: int: Number of processes reading files in parallel,
+            1 reads them one at a time in the current process
+
+            return_quality_report: bool: Also return the quality report
         Returns:
             subject_df: pandas DataFrame containing all data from current 
-            subject, with garbage rows and unnecessary columns removed. The
-            columns in this are:
+            subject, with garbage rows and unnecessary columns removed and
+            sorted by time. The columns in this are:
                 meas_sig_str: signal strength values (no units given, likely in
                 mV) measured at 1 Hz
                 date_time: time in local time
                 secs: number of seconds passed from the beginning of the
                 recording.
+
+            quality_report: dict, only if return_quality_report is True (see
+            validation_module.describe_subject_quality)
     """
     # Get the file paths:
     file_names = get_file_names_if_they_exist(subject_folder_path)
 
+    read_one_file = partial(read_data_file, time_zone=time_zone,
+                            return_quality_report=True)
+    if num_workers > 1:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            file_results = list(executor.map(read_one_file, file_names))
+    else:
+        file_results = map(read_one_file, file_names)
+
     # Create a list of DataFrames from each file to be concatenated into a
-    # single DataFrame, subject_df:
-    file_dfs = []
-    for file_name in file_names:
-        file_df = pd.read_csv(file_name)
-        # If file content is incorrect, do not append to list. If the file was
-        # not imported then raise the exception:
-        try:
-            check_file_df_content(file_df)
-            file_dfs.append(file_df)
-        except FileIsNotCorrectDataFileError:
+    # single DataFrame, subject_df. Files with incorrect content were not
+    # read in:
+    correct_file_dfs = []
+    file_reports = []
+    for file_name, (file_df, file_report) in zip(file_names, file_results):
+        file_reports.append(file_report)
+        if file_df is None:
             print("""{0} is incorrect and its contents will not be appended to 
                 the subject data.""".format(file_name))
+        else:
+            correct_file_dfs.append(file_df)
+
+    subject_df = pd.concat(correct_file_dfs, ignore_index=True)
+    # Files are not necessarily in time order:
+    subject_df = subject_df.sort_values('date_time', kind='mergesort')
+    subject_df = subject_df.reset_index(drop=True)
+
+    # Fail this step is subject_df is None or empty (every file has already
+    # been checked for NaNs):
+    check_if_data_frame_is_valid(subject_df, check_nans=False)
+
+    if return_quality_report:
+        return subject_df, describe_subject_quality(file_reports, subject_df)
+    else:
+        return subject_df
+
+
+def read_data_file(file_name, time_zone=LOCAL_TIME_ZONE,
+                   return_quality_report=False):
+    """ Reads in a single csv file, discards its garbage rows and columns and
+    converts its time-stamps to local time. The file is checked once, and
+    fails if it contains NaNs (see validation_module).
+
+        Args:
+            file_name: str: Full or relative path to the csv data file
+
+            time_zone: str: Time zone the time-stamps are converted to
+
+            return_quality_report: bool: Also return the quality report of
+            the file
+        Returns:
+            file_df: pandas DataFrame with the columns meas_sig_str, status
+            and date_time, or None if the file content is incorrect
+
+            file_report: dict, only if return_quality_report is True (see
+            validation_module.describe_file_quality)
+    """
 
-    subject_df = pd.concat(file_dfs, ignore_index=True)
-    check_if_data_frame_is_valid(subject_df)
+    file_df = pd.read_csv(file_name)
+    num_raw_rows = len(file_df)
+    # If file content is incorrect, do not return its contents:
+    try:
+        check_file_df_content(file_df)
+    except FileIsNotCorrectDataFileError:
+        if return_quality_report:
+            return None, describe_rejected_file(file_name, num_raw_rows)
+        else:
+            return None
 
+    # Check the file once, fail this step if it contains NaNs:
+    file_report = describe_file_quality(file_name, file_df)
+    check_file_quality(file_report)
 
     # Discard garbage rows and columns:
-    subject_df = clean_up(subject_df)
+    file_df = clean_up(file_df)
     # Convert date and time to pandas datetime in local time:
-    subject_df['date_time'] = convert_to_local_time(subject_df.time)
-    del subject_df['time']
+    file_df['date_time'] = convert_to_local_time(file_df.time, time_zone)
+    del file_df['time']
 
     # Convert signal strength (meas_sig_str):
-    subject_df.loc[:, 'meas_sig_str'] = pd.to_numeric(
-        subject_df['meas_sig_str'])
+    file_df['meas_sig_str'] = pd.to_numeric(file_df['meas_sig_str'])
+    # Complete the report with the time order and the signal values:
+    describe_file_content(file_report, file_df)
 
-    # Fail this step is subject_df is None, empty, or contains NaNs
-    check_if_data_frame_is_valid(subject_df)
+    if return_quality_report:
+        return file_df, file_report
+    else:
+        return file_df
 
-    return subject_df
+
+def describe_data_file(file_name, file_df=None):
+    """ Describes a csv file, so that it can be recognized when it has not
+    changed since it was ingested.
+
+        Args:
+            file_name: str: Full or relative path to the csv data file
+
+            file_df: pandas DataFrame: Optional, the file content as returned
+            by read_data_file, used for the time range of the file
+        Returns:
+            file_description: dict with the keys file_path, file_size,
+            file_mtime, content_hash and, if file_df is given, first_time and
+            last_time
+    """
+
+    file_stat = os.stat(file_name)
+    file_description = {'file_path': os.path.abspath(file_name),
+                        'file_size': file_stat.st_size,
+                        'file_mtime': file_stat.st_mtime,
+                        'content_hash': hash_file(file_name)}
+    if file_df is not None:
+        file_description['first_time'] = file_df['date_time'].min()
+        file_description['last_time'] = file_df['date_time'].max()
+
+    return file_description
+
+
+def hash_file(file_name, block_size=2 ** 20):
+    """ Computes the SHA-256 hash of a file's content.
+
+        Args:
+            file_name: str: Full or relative path to the file
+
+            block_size: int: Number of bytes read at a time
+        Returns:
+            content_hash: str: hexadecimal digest
+    """
+
+    content_hash = hashlib.sha256()
+    with open(file_name, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            content_hash.update(block)
+
+    return content_hash.hexdigest()
 
 
 def clean_up(subject_df):
@@ -88,108 +254,314 @@ def clean_up(subject_df):
     mask = subject_df['time'] != 'time'
     subject_df = subject_df[mask]
 
-    # Fail this step is subject_df is None, empty, or contains NaNs
-    check_if_data_frame_is_valid(subject_df)
+    # Fail this step is subject_df is None or empty (NaNs are counted in the
+    # quality report):
+    check_if_data_frame_is_valid(subject_df, check_nans=False)
 
     return subject_df
 
 
-def convert_to_local_time(time_stamps):
+def parse_fixed_format_time_stamps(time_stamps):
+    """Parses time-stamps of the form yyyy-mm-ddThh:mm:ssZ as one array
+    operation on their bytes. Rows that are not exactly in that form are
+    returned as NaT rather than raising an exception.
+
+        Args:
+            time_stamps: a Pandas series containing time-stamps that are
+            character strings of the form: yyyy-mm-ddThh:mm:ssZ
+        Returns:
+            date_time: a Pandas series containing pandas datetime objects in
+            UTC, with NaT for the rows that do not match the format
+    """
+
+    date_time = pd.Series(pd.NaT, index=time_stamps.index,
+                          dtype='datetime64[s, UTC]')
+    try:
+        # One extra byte so that strings longer than the format are caught:
+        stamp_bytes = np.asarray(time_stamps, dtype='S{0}'.format(
+            len(TIME_STAMP_PATTERN) + 1))
+    except UnicodeEncodeError:
+        return date_time
+    stamp_bytes = stamp_bytes.view(np.uint8).reshape(len(stamp_bytes), -1)
+
+    # Digits where the pattern has '0' and the exact separators elsewhere:
+    pattern = np.frombuffer(TIME_STAMP_PATTERN + b'\0', dtype=np.uint8)
+    is_digit = pattern == ord('0')
+    digits = stamp_bytes[:, is_digit]
+    matches_format = ((digits >= ord('0')) & (digits <= ord('9'))).all(
+        axis=1) & (stamp_bytes[:, ~is_digit] == pattern[~is_digit]).all(axis=1)
+
+    # numpy parses 'yyyy-mm-ddThh:mm:ss' natively once the 'Z' is dropped:
+    iso_stamps = np.ascontiguousarray(
+        stamp_bytes[matches_format, :len(TIME_STAMP_PATTERN) - 1]).view(
+        'S{0}'.format(len(TIME_STAMP_PATTERN) - 1)).ravel()
+    try:
+        parsed = iso_stamps.astype('datetime64[s]')
+    except ValueError:
+        # Well formed but impossible dates (e.g. month 13), leave all of them
+        # to the flexible parser:
+        return date_time
+    date_time[matches_format] = pd.DatetimeIndex(parsed).tz_localize('UTC')
+
+    return date_time
+
+
+def convert_to_local_time(time_stamps, time_zone=LOCAL_TIME_ZONE):
     """Convert time-stamps from csv files to pandas datetimes in local time.
+    The time-stamps are parsed as one array operation using the known fixed
+    format. Only the rows that do not match that format are handed to the
+    (much slower) flexible pandas parser, and only the rows that neither
+    parser understands are reported as defective.
 
         Args: 
             time_stamps: a Pandas series containing time-stamps that are 
             character strings of the form: yyyy-mm-ddThh:mm:ssZ, for instance 
             2017-05-25T23:59:59Z
+
+            time_zone: str: Time zone to convert the UTC time-stamps to
         Returns:
             date_time: a Pandas series containing pandas datetime objects in 
             local time     
     """
 
-    # Remove letters Z and T:
-    date_time = time_stamps.apply(
-        lambda x: x.replace('Z', '').replace('T', ' '))
-    # Convert to pandas timestamp:
-    try:
-        date_time = pd.to_datetime(date_time, utc=True)
-    except ValueError:
-        raise DateTimeColumnIsDefectiveError("The date time format in csv file "
-                                             "is incorrect")
-    # Localize to UTC time zone:
-    date_time = date_time.apply(lambda x: x.tz_localize('UTC'))
-    # Convert time zone:
-    date_time = date_time.apply(lambda x: x.tz_convert('US/Pacific'))
+    # Parse the fixed format in one pass, malformed rows become NaT:
+    date_time = parse_fixed_format_time_stamps(time_stamps)
+
+    # Give the rows that did not match the fixed format a second chance with
+    # the flexible parser:
+    not_parsed = date_time.isnull()
+    if not_parsed.any():
+        # The fixed format has whole seconds, the others may have fractions.
+        # Each row is parsed on its own, as the rows may differ in format:
+        date_time = date_time.dt.as_unit('ns')
+        date_time[not_parsed] = pd.to_datetime(
+            time_stamps[not_parsed], utc=True, errors='coerce',
+            format='mixed').dt.as_unit('ns')
 
+    defective = date_time.isnull()
+    if defective.any():
+        raise DateTimeColumnIsDefectiveError(
+            "The date time format in csv file is incorrect in {0} rows, for "
+            "instance: {1}".format(defective.sum(),
+                                   list(time_stamps[defective][:3])))
+
+    # Convert time zone:
+    date_time = date_time.dt.tz_convert(time_zone)
 
     return date_time
 
 
-def num_seconds(pandas_time_stamp):
+def num_seconds(pandas_time_stamp, start_time=None):
     """Creates a series containing number of seconds for each record relative
     to the first time stamp recorded (in pandas_time_stamp)
     
         Args:
             pandas_time_stamp: Pandas series containing Pandas
+
+            start_time: pandas Timestamp: Optional, the time the seconds are
+            counted from, by default the first time stamp in pandas_time_stamp
         Returns:
             secs: Pandas series containing integers
     """
 
-    secs = pandas_time_stamp - min(pandas_time_stamp)
-    secs = secs.apply(lambda x: int(x.total_seconds()))
+    if start_time is None:
+        start_time = pandas_time_stamp.min()
+    secs = (pandas_time_stamp - start_time) // pd.Timedelta(seconds=1)
 
-    return secs
+    return secs.astype(np.int64)
 
 
-def fill_missing_data(subject_df):
+def fill_missing_data(subject_df, recording_start=None,
+                      max_gap_secs=MAX_COPY_FILL_SECS,
+                      fill_method='copy_previous', duplicates='first',
+                      return_gap_summary=False, quality_report=None):
     """ Adds in missing seconds by re-indexing to continuous seconds. Fills in
     time stamps and signal strength for those missing seconds 
          
          Args:
              subject_df: A Pandas DataFrame: It includes missing seconds 
              ('date_time' is discontinuous).
+
+             recording_start: pandas Timestamp: Optional, the beginning of
+             the recording, by default the first time stamp in subject_df
+
+             max_gap_secs: int: Longest gap in the signal that is filled
+
+             fill_method: str: How gaps in the signal are filled, one of
+             FILL_METHODS (see fill_missing_signal_values)
+
+             duplicates: str: How seconds recorded more than once (e.g. in
+             overlapping csv files) are combined, one of DUPLICATE_POLICIES
+             (see drop_duplicate_seconds)
+
+             return_gap_summary: bool: Also return the per-gap summary
+
+             quality_report: dict: Optional, the quality report of subject_df
+             returned by read_data, used to skip checks it has already made
          Returns:
              full_subject_df: A pandas DataFrame: It has no missing seconds and
              is indexed by seconds from the beginning of the recording.
+
+             gap_summary: A pandas DataFrame, only if return_gap_summary is
+             True (see fill_missing_signal_values)
     """
 
+    if recording_start is None:
+        recording_start = subject_df['date_time'].min()
+
     # Set indices to seconds from the beginning of time (data is at Hz so there
     # is a record or row per second)
-    secs = num_seconds(subject_df['date_time'])
-    subject_df['secs'] = secs
-    subject_df = subject_df.set_index('secs')
+    subject_df = index_by_seconds(subject_df, recording_start)
+
+    full_subject_df, gap_summary = fill_missing_seconds(
+        subject_df, recording_start, max_gap_secs=max_gap_secs,
+        fill_method=fill_method, duplicates=duplicates,
+        quality_report=quality_report)
+
+    if return_gap_summary:
+        return full_subject_df, gap_summary
+    else:
+        return full_subject_df
+
+
+def index_by_seconds(subject_df, recording_start):
+    """ Indexes a DataFrame by the number of seconds from the beginning of the
+    recording.
+
+        Args:
+            subject_df: A Pandas DataFrame with a 'date_time' column
+
+            recording_start: pandas Timestamp: The beginning of the recording
+        Returns:
+            subject_df: A Pandas DataFrame indexed by 'secs'
+    """
+
+    subject_df = subject_df.copy()
+    subject_df['secs'] = num_seconds(subject_df['date_time'], recording_start)
+
+    return subject_df.set_index('secs')
+
+
+def fill_missing_seconds(subject_df, recording_start, preceding_df=None,
+                         max_gap_secs=MAX_COPY_FILL_SECS,
+                         fill_method='copy_previous', duplicates='first',
+                         quality_report=None):
+    """ Re-indexes a DataFrame indexed by seconds to continuous seconds and
+    fills in time stamps and signal strength for the missing seconds.
+
+         Args:
+             subject_df: A Pandas DataFrame indexed by seconds from the
+             beginning of the recording ('secs' is discontinuous).
+
+             recording_start: pandas Timestamp: The beginning of the recording
+
+             preceding_df: A Pandas DataFrame: Optional, the recorded rows
+             (indexed by seconds) just before subject_df. They are only used
+             as the source for filling gaps at the start of subject_df and are
+             not part of the returned DataFrame.
+
+             max_gap_secs: int: Longest gap in the signal that is filled
+
+             fill_method: str: How gaps in the signal are filled, one of
+             FILL_METHODS
+
+             duplicates: str: How seconds recorded more than once are
+             combined, one of DUPLICATE_POLICIES
+
+             quality_report: dict: Optional, the quality report of subject_df
+             (see read_data). If it shows subject_df is sorted and records
+             every second once, duplicates are not looked for again.
+         Returns:
+             full_subject_df: A pandas DataFrame: It has no missing seconds
+             between the first and the last second of subject_df.
+
+             gap_summary: A pandas DataFrame with one row per gap in
+             full_subject_df (see fill_missing_signal_values)
+    """
+
+    if preceding_df is not None and len(preceding_df) > 0:
+        first_sec = preceding_df.index.max() + 1
+        subject_df = pd.concat([preceding_df, subject_df])
+    else:
+        first_sec = subject_df.index.min()
+
+    # Overlapping csv files record some seconds more than once:
+    if preceding_df is not None or quality_report is None or \
+            not quality_report['is_time_sorted'] or \
+            quality_report['num_duplicate_times'] > 0:
+        subject_df = drop_duplicate_seconds(subject_df, duplicates)
 
     # Continuous seconds from the begining to the end of the recording:     
-    continuous_secs = set(range(0, max(subject_df.index)))
+    secs = subject_df.index.to_numpy(dtype=np.int64)
+    start_sec = secs.min()
+    continuous_secs = pd.RangeIndex(start_sec, secs.max() + 1, name='secs')
+    # These are the seconds missing from the data:
+    recorded = np.zeros(len(continuous_secs), dtype=bool)
+    recorded[secs - start_sec] = True
+    missing_secs = np.flatnonzero(~recorded) + start_sec
+
     # Re-index the DataFrame, this adds in a row for each missing second and 
     # fills it with NaNs:
     full_subject_df = subject_df.reindex(continuous_secs)
-    # These are the seconds missing from the data:
-    missing_secs = continuous_secs - set(secs)
 
-    if len(missing_secs) == 0:
-        full_subject_df = subject_df
-    else:
-        missing_secs = np.array(list(missing_secs)).astype(int)
+    if len(missing_secs) > 0:
         # Fill missing time_stamps:
-        full_subject_df = fill_missing_time_stamps(full_subject_df, missing_secs)
+        full_subject_df = fill_missing_time_stamps(full_subject_df,
+                                                   missing_secs,
+                                                   recording_start)
 
-        # Fill missing signal (If missing signal length is less than 5 minute
-        # copies from the previous segment, else leaves it as NaNs.) :
-        full_subject_df = fill_missing_signal_values(full_subject_df, missing_secs)
+    # Fill missing signal (By default, if missing signal length is less than
+    # 5 minute copies from the previous segment, else leaves it as NaNs.) :
+    full_subject_df, gap_summary = fill_missing_signal_values(
+        full_subject_df, missing_secs, max_gap_secs, fill_method)
+
+    full_subject_df = full_subject_df.loc[first_sec:]
+    gap_summary = gap_summary[gap_summary.start_secs >= first_sec]
 
     # Abort here if full_subject_df is None or empty:
-    try:
-        check_if_data_frame_is_valid(full_subject_df)
-    except DataFrameContainsNans:
-        pass
+    check_if_data_frame_is_valid(full_subject_df, check_nans=False)
 
-    return full_subject_df
+    return full_subject_df, gap_summary
+
+
+def drop_duplicate_seconds(subject_df, duplicates='first'):
+    """ Keeps one row per second in a DataFrame indexed by seconds and sorts it
+    by seconds. The policies for seconds recorded more than once are:
+        'first': keeps the first record
+        'last': keeps the last record
+        'mean': averages meas_sig_str, other columns are taken from the first
+        record
+
+        Args:
+            subject_df: A Pandas DataFrame indexed by seconds from the
+            beginning of the recording
 
+            duplicates: str: One of DUPLICATE_POLICIES
+        Returns:
+            subject_df: A Pandas DataFrame with a unique, sorted index
+    """
+
+    if duplicates not in DUPLICATE_POLICIES:
+        raise DuplicatePolicyIsUnknownError("duplicates must be one of "
+                                            "{0}".format(DUPLICATE_POLICIES))
 
-def fill_missing_time_stamps(full_subject_df, missing_secs):
+    if not subject_df.index.is_unique:
+        if duplicates == 'mean':
+            seconds = subject_df.groupby(level=0, sort=False)
+            meas_sig_str = seconds['meas_sig_str'].mean()
+            subject_df = seconds.first()
+            subject_df['meas_sig_str'] = meas_sig_str
+        else:
+            subject_df = subject_df[
+                ~subject_df.index.duplicated(keep=duplicates)]
 
+    if not subject_df.index.is_monotonic_increasing:
+        subject_df = subject_df.sort_index(kind='mergesort')
+
+    return subject_df
 
 
+def fill_missing_time_stamps(full_subject_df, missing_secs, recording_start):
     """ Creates time stamps for the missing seconds and writes those into the 
     DataFrame in place of NaNs.
     
@@ -200,23 +572,30 @@ def fill_missing_time_stamps(full_subject_df, missing_secs):
             
             missing_secs: A numpy array containing the seconds were signal was 
             dropped. 
+
+            recording_start: pandas Timestamp: The time of second 0
         Returns: 
             full_subject_df: A pandas DataFrame, the date_time for the 
             missing_secs has been filled with the correct time. 
     """
 
-    convert_secs_to_time_stamp_vectorized = np.vectorize(
-        lambda x: pd.Timedelta(x, unit='s'))
-    missing_times = min(full_subject_df.date_time) + \
-                    convert_secs_to_time_stamp_vectorized(missing_secs)
+    missing_times = recording_start + pd.to_timedelta(missing_secs, unit='s')
     full_subject_df.loc[missing_secs, 'date_time'] = missing_times
 
     return full_subject_df
 
 
-def fill_missing_signal_values(full_subject_df, missing_secs):
-    """If missing signal length is less than 5 minute copies from the previous 
-    segment, else leaves it as NaNs.
+def fill_missing_signal_values(full_subject_df, missing_secs,
+                               max_gap_secs=MAX_COPY_FILL_SECS,
+                               fill_method='copy_previous'):
+    """Fills the gaps in the signal that are no longer than max_gap_secs,
+    longer gaps are left as NaNs. The gaps are found as runs of missing
+    seconds and all of them are filled at once. The fill methods are:
+        'copy_previous': copies the segment of the same length just before
+        the gap
+        'interpolate': linear interpolation between the recorded seconds on
+        either side of the gap
+        'leave_nan': no gap is filled
     
         Args: 
             full_subject_df: A Pandas DataFrame: The indices are continious 
@@ -225,83 +604,684 @@ def fill_missing_signal_values(full_subject_df, missing_secs):
             
             missing_secs: A numpy array containing the seconds were signal was 
             dropped
+
+            max_gap_secs: int: Longest gap in the signal that is filled
+
+            fill_method: str: One of FILL_METHODS
         Returns: 
             full_subject_df: A pandas DataFrame: The meas_sig_str for the 
-            missing_secs has been filled with copied values. 
+            missing_secs has been filled.
+
+            gap_summary: A pandas DataFrame with one row per gap and the
+            columns:
+                start_secs: first missing second of the gap
+                length_secs: number of missing seconds in the gap
+                filled: whether the gap was filled
     """
 
-    # Create a new DataFrame, sig_str_df, to be used for identifying missing
-    # blocks of signal and copying from previous blocks of recorded signal:
-    sig_str_df = full_subject_df['meas_sig_str'].to_frame()
-    # find blocks with missing signal:
-    sig_str_df['newcol'] = 0
-    sig_str_df.loc[missing_secs, 'newcol'] = -1000
-    sig_str_df['block'] = (sig_str_df.newcol.shift(1) != sig_str_df.newcol). \
-        astype(int).cumsum()
-
-    block_groups = sig_str_df.groupby(['block', 'newcol'], axis=0)
-
-    missing_seg_length = []
-    sig_str_df['block_length'] = 0
-    sig_str_df['copy_sig'] = np.NaN
-    for (i, j), group in block_groups:
-        if j == -1000:
-            missing_seg_length = missing_seg_length + [group.shape[0]]
-            missing_block_inds = group.index
-            sig_str_df.loc[missing_block_inds, 'block_length'] = group.shape[0]
-            if group.shape[0] <= 5 * 60:
-                shape_filler_ind = missing_block_inds - len(missing_block_inds)
-                filler = np.array(sig_str_df.loc[shape_filler_ind, \
-                                                 'meas_sig_str'])
-                sig_str_df.loc[missing_block_inds, 'copy_sig'] = filler
-
-                full_subject_df.loc[missing_secs, 'meas_sig_str'] = \
-                    sig_str_df.loc[missing_secs, 'copy_sig']
+    if fill_method not in FILL_METHODS:
+        raise FillMethodIsUnknownError("fill_method must be one of "
+                                       "{0}".format(FILL_METHODS))
 
-    return full_subject_df
+    # Positions of the missing seconds in the DataFrame:
+    first_sec = full_subject_df.index[0]
+    missing = np.zeros(len(full_subject_df), dtype=bool)
+    missing[np.asarray(missing_secs, dtype=int) - first_sec] = True
+
+    gap_starts, gap_lengths = find_runs(missing)
+    filled = gap_lengths <= max_gap_secs
+    if fill_method == 'leave_nan':
+        filled[:] = False
+
+    gap_summary = pd.DataFrame({'start_secs': gap_starts + first_sec,
+                                'length_secs': gap_lengths,
+                                'filled': filled})
+
+    if filled.any():
+        signal = full_subject_df['meas_sig_str'].to_numpy(dtype=float,
+                                                         copy=True)
+        fill_starts = gap_starts[filled]
+        fill_lengths = gap_lengths[filled]
+        # Positions of every second in the gaps that are filled:
+        fill_positions = np.repeat(fill_starts - np.cumsum(fill_lengths) +
+                                   fill_lengths, fill_lengths) + \
+            np.arange(fill_lengths.sum())
+
+        if fill_method == 'copy_previous':
+            source_positions = fill_positions - np.repeat(fill_lengths,
+                                                          fill_lengths)
+            fill_values = np.full(len(fill_positions), np.nan)
+            has_source = source_positions >= 0
+            fill_values[has_source] = signal[source_positions[has_source]]
+        else:
+            recorded_positions = np.flatnonzero(~missing)
+            fill_values = np.interp(fill_positions, recorded_positions,
+                                    signal[recorded_positions])
+
+        signal[fill_positions] = fill_values
+        full_subject_df['meas_sig_str'] = signal
+
+    return full_subject_df, gap_summary
+
+
+def find_runs(mask):
+    """Finds the runs of consecutive True values in a boolean array.
+
+        Args:
+            mask: numpy array of booleans
+        Returns:
+            run_starts: numpy array containing the position of the first
+            value of each run
+
+            run_lengths: numpy array containing the length of each run
+    """
+
+    edges = np.diff(np.concatenate(([0], mask.astype(np.int8), [0])))
+    run_starts = np.flatnonzero(edges == 1)
+    run_lengths = np.flatnonzero(edges == -1) - run_starts
+
+    return run_starts, run_lengths
 
 
-def divide_to_24_hour_periods(full_subject_df):
+def divide_to_24_hour_periods(full_subject_df, recording_start=None,
+                              day_boundary=DAY_BOUNDARY,
+                              period_length=PERIOD_LENGTH,
+                              time_zone=LOCAL_TIME_ZONE):
     """ Divides up the time to 24 hour periods. The signal is continously
     recorded for several days and nights. 24 hour periods from noon to the
-    following noon are appropriate chunks to seperate the data.
+    following noon are appropriate chunks to seperate the data. Other periods
+    (e.g. clock nights or shifts) can be used by changing day_boundary and
+    period_length.
 
         Args:
             full_subject_df: A pandas dataframe: It has no missing seconds and
             is indexed by seconds from the beginning of the recording.
+
+            recording_start: pandas Timestamp: Optional, the beginning of the
+            recording, by default the first date_time in full_subject_df
+
+            day_boundary: str: Time of day (hh:mm:ss) at which periods start
+
+            period_length: str or pandas Timedelta: Length of each period
+
+            time_zone: str: Time zone of the clock day_boundary refers to
         returns:
-            full_subject_df: It has one additional column compared to the
-            original DataDrame, 'day_nums', that specifies the 24 hour period from the start
-            of the recording.  Each 24 hour period starts at noon. If the
-            recoding starts at a time different that noon, the period 1 is
-            shorter and ends at the following noon. Similarly, the last period
-            may be truncated.
+            full_subject_df: It has one additional integer column compared to
+            the original DataDrame, 'num_days', that specifies the period from
+            the start of the recording, starting at 1.  Each period starts at
+            day_boundary. If the recoding starts at a time different than
+            day_boundary, the period 1 is shorter and ends at the following
+            day_boundary. The last period ends with the recording and may be
+            truncated. A record exactly at the start of a period belongs to
+            that period, not to the previous one.
     """
-    date_time = full_subject_df.date_time
-    # Initialize day_nums:
-    day_nums = pd.Series(index=date_time.index)
+    date_time = full_subject_df['date_time']
+
+    if recording_start is None:
+        recording_start = date_time.iloc[0]
+
+    # Find the onsets of each period after the first:
+    period_onsets = get_period_onsets(recording_start, date_time.iloc[-1],
+                                      day_boundary, period_length, time_zone)
+
+    # Assign records to each period, the number of onsets at or before a
+    # record is its period number minus 1:
+    num_days = period_onsets.searchsorted(date_time, side='right') + 1
+
+    full_subject_df['num_days'] = num_days.astype(np.int32)
+
+    return full_subject_df
 
-    # Find the onsets of each 24 hour period:
-    day_onsets = [date_time[0]]
-    end_of_time = date_time[len(date_time) - 1]
 
-    if date_time.loc[0].hour < 12:
-        next_day_onset = pd.to_datetime(str(date_time[0].date()) + ' 12:00:00')
+def get_period_onsets(recording_start, end_of_time, day_boundary=DAY_BOUNDARY,
+                      period_length=PERIOD_LENGTH, time_zone=LOCAL_TIME_ZONE):
+    """ Finds the onsets of the periods (after the first one, which starts
+    with the recording) from the beginning to the end of a recording.
+
+        Args:
+            recording_start: pandas Timestamp: The beginning of the recording
+
+            end_of_time: pandas Timestamp: The end of the recording
+
+            day_boundary: str: Time of day (hh:mm:ss) at which periods start
+
+            period_length: str or pandas Timedelta: Length of each period
+
+            time_zone: str: Time zone of the clock day_boundary refers to
+        Returns:
+            period_onsets: pandas DatetimeIndex: The sorted onsets after
+            recording_start and up to and including end_of_time
+    """
+
+    period_length = pd.Timedelta(period_length)
+    recording_start = recording_start.tz_convert(time_zone)
+
+    # The first onset is the first day_boundary, or a whole number of periods
+    # from it, after the start of the recording:
+    boundary_today = pd.Timestamp('{0} {1}'.format(
+        recording_start.date(), day_boundary)).tz_localize(time_zone)
+    first_onset = boundary_today + period_length * (
+        (recording_start - boundary_today) // period_length + 1)
+
+    if end_of_time < first_onset:
+        num_onsets = 0
     else:
-        next_day_onset = pd.to_datetime(
-            str(date_time[0].date()) + ' 12:00:00') + pd.Timedelta('24 hours')
-    next_day_onset = next_day_onset.tz_localize('US/Pacific')
+        num_onsets = (end_of_time - first_onset) // period_length + 1
+
+    return pd.date_range(first_onset, periods=num_onsets, freq=period_length)
+
+
+def read_data_in_chunks(subject_folder_path, chunk_secs,
+                        time_zone=LOCAL_TIME_ZONE, metrics=None,
+                        num_workers=1):
+    """ Reads in a number of csv files and yields their concatenated data in
+    fixed-size blocks of time, so that only one file and one block are held in
+    memory at a time. The files are read in the order of their first time
+    stamp and a block is only yielded once no file still to be read can
+    contain data for it.
+
+        Args:
+            subject_folder_path: str: Full or relative path to the csv data
+            files
+
+            chunk_secs: int: Length of each block of time in seconds
+
+            time_zone: str: Time zone the time-stamps are converted to
+
+            metrics: PipelineMetrics: Optional, rejected files and the rows
+            read from the files are counted in it (see instrumentation_module)
+
+            num_workers: int: Number of processes reading files ahead in
+            parallel, 1 reads them one at a time in the current process
+        Yields:
+            subject_df: pandas DataFrame with the same columns as the one
+            returned by read_data, containing the records of one block of
+            time sorted by time. Blocks with no records are skipped.
+    """
+    if metrics is None:
+        metrics = NoMetrics()
+    metrics.count('rejected_files', 0)
+
+    # Get the file paths:
+    file_names = get_file_names_if_they_exist(subject_folder_path)
+
+    # Find where each file starts, so files can be read in time order:
+    file_starts = []
+    for file_name in file_names:
+        file_start = get_file_start_time(file_name, time_zone)
+        if file_start is None:
+            print("""{0} is incorrect and its contents will not be appended to 
+                the subject data.""".format(file_name))
+            metrics.count('rejected_files')
+        else:
+            file_starts.append((file_start, file_name))
+    if len(file_starts) == 0:
+        raise DataFileOrFolderDoesNotExistError(
+            "There are no correct data files in this folder")
+    file_starts.sort()
+
+    recording_start = file_starts[0][0]
+    chunk_length = pd.Timedelta(chunk_secs, unit='s')
+    chunk_start = recording_start
+    subject_df = None
+    file_dfs = metrics.count_rows_in(read_data_files_ahead(
+        [file_name for (file_start, file_name) in file_starts], time_zone,
+        num_workers))
+    for f, file_df in enumerate(file_dfs):
+        subject_df = pd.concat([subject_df, file_df], ignore_index=True)
+        subject_df = subject_df.sort_values('date_time', kind='mergesort')
+
+        # Data before the start of the next file is complete:
+        if f + 1 < len(file_starts):
+            complete_until = file_starts[f + 1][0]
+        else:
+            complete_until = None
+
+        while len(subject_df) > 0:
+            # Skip blocks that have no records:
+            first_time = subject_df['date_time'].iloc[0]
+            chunk_start = chunk_start + chunk_length * (
+                (first_time - chunk_start) // chunk_length)
+            chunk_end = chunk_start + chunk_length
+            if complete_until is not None and chunk_end > complete_until:
+                break
+            in_chunk = subject_df['date_time'] < chunk_end
+            yield subject_df[in_chunk].reset_index(drop=True)
+            subject_df = subject_df[~in_chunk]
+            chunk_start = chunk_end
+
+
+def read_data_files_ahead(file_names, time_zone=LOCAL_TIME_ZONE,
+                          num_workers=1):
+    """ Reads in csv files one after the other, as read_data_file does. With
+    more than one worker, the next files are read in a pool of processes
+    while the current one is being used, at most num_workers files ahead.
+
+        Args:
+            file_names: list of str: Full or relative paths to the csv data
+            files
+
+            time_zone: str: Time zone the time-stamps are converted to
+
+            num_workers: int: Number of processes reading files in parallel
+        Yields:
+            file_df: pandas DataFrame (or None) as returned by read_data_file,
+            in the order of file_names
+    """
+
+    if num_workers <= 1:
+        for file_name in file_names:
+            yield read_data_file(file_name, time_zone)
+        return
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        file_reads = deque()
+        for file_name in file_names:
+            file_reads.append(executor.submit(read_data_file, file_name,
+                                              time_zone))
+            if len(file_reads) == num_workers:
+                yield file_reads.popleft().result()
+        while len(file_reads) > 0:
+            yield file_reads.popleft().result()
+
+
+def get_file_start_time(file_name, time_zone=LOCAL_TIME_ZONE):
+    """ Finds the earliest time stamp in a csv file, reading only its time
+    column.
+
+        Args:
+            file_name: str: Full or relative path to the csv data file
+
+            time_zone: str: Time zone the time-stamps are converted to
+        Returns:
+            file_start: pandas Timestamp in local time, or None if the file
+            content is incorrect
+    """
+
+    columns = pd.read_csv(file_name, nrows=0).columns
+    if list(columns) != ['name', 'time', 'meas_sig_str', 'status']:
+        return None
+
+    time_stamps = pd.read_csv(file_name, usecols=['time'])['time']
+    # Discard garbage rows that repeat the column headers:
+    time_stamps = time_stamps[time_stamps != 'time']
+
+    return convert_to_local_time(time_stamps, time_zone).min()
+
+
+def fill_missing_data_in_chunks(subject_chunks,
+                                max_gap_secs=MAX_COPY_FILL_SECS,
+                                fill_method='copy_previous',
+                                duplicates='first',
+                                return_gap_summary=False):
+    """ Fills in missing seconds in consecutive blocks of time, as
+    fill_missing_data does for a whole recording. The last recorded seconds
+    of each block are carried over as the source for gaps at the start of the
+    next block, so gaps across block boundaries are filled as they would be
+    if the recording was processed at once.
+
+        Args:
+            subject_chunks: iterable of Pandas DataFrames: Consecutive,
+            non-overlapping blocks of time of the recording in time order, as
+            yielded by read_data_in_chunks
+
+            max_gap_secs: int: Longest gap in the signal that is filled
+
+            fill_method: str: How gaps in the signal are filled, one of
+            FILL_METHODS
+
+            duplicates: str: How seconds recorded more than once are
+            combined, one of DUPLICATE_POLICIES
+
+            return_gap_summary: bool: Also yield the per-gap summary of each
+            block
+        Yields:
+            full_subject_df: A pandas DataFrame: It has no missing seconds and
+            is indexed by seconds from the beginning of the recording. If
+            return_gap_summary is True, (full_subject_df, gap_summary) tuples
+            are yielded instead.
+    """
+
+    recording_start = None
+    preceding_df = None
+    for subject_df in subject_chunks:
+        if recording_start is None:
+            recording_start = subject_df['date_time'].min()
+        subject_df = index_by_seconds(subject_df, recording_start)
+
+        full_subject_df, gap_summary = fill_missing_seconds(
+            subject_df, recording_start, preceding_df, max_gap_secs,
+            fill_method, duplicates)
+        if return_gap_summary:
+            yield full_subject_df, gap_summary
+        else:
+            yield full_subject_df
+
+        # Keep the recorded seconds a gap at the start of the next block could
+        # be copied from. A short or sparse block does not hold all of them,
+        # so the seconds kept from the blocks before it are carried over:
+        last_sec = subject_df.index.max()
+        preceding_df = pd.concat([preceding_df, subject_df]).loc[
+            last_sec - max_gap_secs + 1:]
+
+
+def divide_to_24_hour_periods_in_chunks(full_subject_chunks,
+                                        day_boundary=DAY_BOUNDARY,
+                                        period_length=PERIOD_LENGTH,
+                                        time_zone=LOCAL_TIME_ZONE):
+    """ Divides consecutive blocks of time into periods, as
+    divide_to_24_hour_periods does for a whole recording. The periods are
+    counted from the beginning of the first block.
+
+        Args:
+            full_subject_chunks: iterable of Pandas DataFrames: Consecutive
+            blocks of time of the recording in time order, as yielded by
+            fill_missing_data_in_chunks
+
+            day_boundary: str: Time of day (hh:mm:ss) at which periods start
+
+            period_length: str or pandas Timedelta: Length of each period
+
+            time_zone: str: Time zone of the clock day_boundary refers to
+        Yields:
+            full_subject_df: A pandas DataFrame with the additional column
+            'num_days'
+    """
+
+    recording_start = None
+    for full_subject_df in full_subject_chunks:
+        if recording_start is None:
+            recording_start = full_subject_df['date_time'].iloc[0]
+
+        yield divide_to_24_hour_periods(full_subject_df, recording_start,
+                                        day_boundary, period_length, time_zone)
+
+
+def compact_subject_data(subject_data):
+    """ Converts pre-processed subject data to the compact types in
+    SUBJECT_DATA_DTYPES, at the end of the pipeline.
+
+        Args:
+            subject_data: pandas DataFrame: Any of the columns in
+            SUBJECT_DATA_DTYPES and meas_sig_str
+        Returns:
+            subject_data: pandas DataFrame with compact column types
+    """
+
+    # Integers that do not fit in their compact type would wrap around
+    # silently (e.g. a subject_num above 32767):
+    for (column, dtype) in SUBJECT_DATA_DTYPES.items():
+        if column in subject_data.columns and dtype != 'category' and \
+                len(subject_data) > 0:
+            limits = np.iinfo(dtype)
+            if subject_data[column].min() < limits.min or \
+                    subject_data[column].max() > limits.max:
+                raise ValueOutOfRangeError(
+                    "{0} must be between {1} and {2} to be stored as "
+                    "{3}".format(column, limits.min, limits.max, dtype))
+
+    subject_data = subject_data.astype(
+        {column: dtype for (column, dtype) in SUBJECT_DATA_DTYPES.items()
+         if column in subject_data.columns})
+
+    if 'meas_sig_str' in subject_data.columns:
+        subject_data['meas_sig_str'] = compact_signal(
+            subject_data['meas_sig_str'])
+
+    return subject_data
+
+
+def compact_signal(meas_sig_str):
+    """ Converts the signal to the smallest nullable integer type its values
+    fit in, or to float32 if some of its values are not whole numbers (e.g.
+    interpolated gaps).
+
+        Args:
+            meas_sig_str: pandas Series
+        Returns:
+            meas_sig_str: pandas Series, NaNs become missing values
+    """
+
+    values = meas_sig_str.to_numpy(dtype=np.float64, na_value=np.nan)
+    recorded = values[~np.isnan(values)]
+
+    if np.array_equal(recorded, np.round(recorded)):
+        for dtype in SIGNAL_INTEGER_DTYPES:
+            limits = np.iinfo(dtype.lower())
+            if len(recorded) == 0 or (recorded.min() >= limits.min and
+                                      recorded.max() <= limits.max):
+                return meas_sig_str.astype(dtype)
+
+    return meas_sig_str.astype(np.float32)
+
+
+def bytes_per_row(subject_data):
+    """ Measures the memory taken by a DataFrame, including its index and the
+    contents of object columns, per row.
+
+        Args:
+            subject_data: pandas DataFrame
+        Returns:
+            bytes_per_row: float
+    """
+
+    return subject_data.memory_usage(index=True, deep=True).sum() / max(
+        len(subject_data), 1)
+
+
+def read_preprocessed_data(subject_folder_path, time_zone=LOCAL_TIME_ZONE,
+                           num_workers=1, max_gap_secs=MAX_COPY_FILL_SECS,
+                           fill_method='copy_previous', duplicates='first',
+                           day_boundary=DAY_BOUNDARY,
+                           period_length=PERIOD_LENGTH, cache_path=None,
+                           max_cache_bytes=MAX_CACHE_BYTES, metrics=None):
+    """ Reads in the csv files of a subject, fills in missing data and divides
+    it into periods (read_data, fill_missing_data and
+    divide_to_24_hour_periods). With a cache_path, the result is cached on
+    disk under a hash of the content of the csv files and of the parameters,
+    and is read back from the cache as long as neither has changed.
+
+        Args:
+            subject_folder_path: str: Full or relative path to the csv data
+            files
+
+            time_zone, num_workers: see read_data
 
-    while next_day_onset < end_of_time:
-        day_onsets.append(next_day_onset)
-        next_day_onset = next_day_onset + pd.Timedelta('24 hours')
+            max_gap_secs, fill_method, duplicates: see fill_missing_data
 
-    # Assign records to each day:
-    for d in range(len(day_onsets)):
-        tomorrow = day_onsets[d+1] if (d + 1 < len(day_onsets) - 1) else next_day_onset
-        day_mask = (date_time >= day_onsets[d]) & (date_time < tomorrow)
-        day_nums[day_mask] = d + 1
+            day_boundary, period_length: see divide_to_24_hour_periods
 
-    full_subject_df['num_days'] = np.asarray(day_nums)
+            cache_path: str: Optional, directory of the cache, created if
+            needed. By default nothing is cached.
+
+            max_cache_bytes: int: Largest total size of the cache files, the
+            least recently used ones are removed beyond it
+
+            metrics: PipelineMetrics: Optional, each stage is measured in it
+            (see instrumentation_module)
+        Returns:
+            full_subject_df: A pandas DataFrame as returned by
+            divide_to_24_hour_periods
+    """
+
+    if metrics is None:
+        metrics = NoMetrics()
+
+    parameters = {'time_zone': time_zone, 'max_gap_secs': max_gap_secs,
+                  'fill_method': fill_method, 'duplicates': duplicates,
+                  'day_boundary': day_boundary,
+                  'period_length': str(pd.Timedelta(period_length))}
+    if cache_path is not None:
+        with metrics.stage('read_cache') as run:
+            cache_key = get_cache_key(subject_folder_path, parameters)
+            full_subject_df = read_from_cache(cache_path, cache_key)
+            if full_subject_df is not None:
+                run.rows_out = len(full_subject_df)
+        if full_subject_df is not None:
+            metrics.count('cache_hits')
+            return full_subject_df
+
+    with metrics.stage('read_data') as run:
+        subject_df, quality_report = read_data(subject_folder_path, time_zone,
+                                               num_workers,
+                                               return_quality_report=True)
+        run.rows_in = quality_report['num_rows']
+        run.rows_out = len(subject_df)
+    metrics.count('rejected_files', quality_report['num_rejected_files'])
+
+    with metrics.stage('fill_missing_data', len(subject_df)) as run:
+        full_subject_df = fill_missing_data(subject_df,
+                                            max_gap_secs=max_gap_secs,
+                                            fill_method=fill_method,
+                                            duplicates=duplicates,
+                                            quality_report=quality_report)
+        run.rows_out = len(full_subject_df)
+
+    with metrics.stage('divide_to_24_hour_periods',
+                       len(full_subject_df)) as run:
+        full_subject_df = divide_to_24_hour_periods(
+            full_subject_df, day_boundary=day_boundary,
+            period_length=period_length, time_zone=time_zone)
+        run.rows_out = len(full_subject_df)
+
+    if cache_path is not None:
+        with metrics.stage('write_cache', len(full_subject_df)):
+            write_to_cache(cache_path, cache_key, full_subject_df,
+                           max_cache_bytes)
 
     return full_subject_df
+
+
+def get_cache_key(subject_folder_path, parameters):
+    """ Computes the key a pre-processed subject is cached under: a hash of
+    the content of its csv files (not of their names or times) and of the
+    pre-processing parameters and CACHE_VERSION.
+
+        Args:
+            subject_folder_path: str: Full or relative path to the csv data
+            files
+
+            parameters: dict: The pre-processing parameters
+        Returns:
+            cache_key: str: hexadecimal digest
+    """
+
+    file_hashes = sorted(hash_file(file_name) for file_name in
+                         get_file_names_if_they_exist(subject_folder_path))
+    key_content = json.dumps({'version': CACHE_VERSION,
+                              'parameters': parameters,
+                              'files': file_hashes}, sort_keys=True)
+
+    return hashlib.sha256(key_content.encode()).hexdigest()
+
+
+def read_from_cache(cache_path, cache_key):
+    """ Reads a cached DataFrame and marks it as recently used.
+
+        Args:
+            cache_path: str: Directory of the cache
+            cache_key: str
+        Returns:
+            cached_df: pandas DataFrame, or None if nothing is cached under
+            cache_key
+    """
+
+    cache_file = os.path.join(cache_path, cache_key + CACHE_FILE_SUFFIX)
+    try:
+        with open(cache_file, 'rb') as file:
+            cached_df = pickle.load(file)
+        # The modification time of a cache file is when it was last used:
+        os.utime(cache_file)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+    return cached_df
+
+
+def write_to_cache(cache_path, cache_key, cached_df,
+                   max_cache_bytes=MAX_CACHE_BYTES):
+    """ Caches a DataFrame, then removes the least recently used cache files
+    until the cache is no larger than max_cache_bytes.
+
+        Args:
+            cache_path: str: Directory of the cache, created if needed
+            cache_key: str
+            cached_df: pandas DataFrame
+            max_cache_bytes: int: Largest total size of the cache files
+        Returns: Nothing
+    """
+
+    os.makedirs(cache_path, exist_ok=True)
+    cache_file = os.path.join(cache_path, cache_key + CACHE_FILE_SUFFIX)
+
+    # Write to a temporary file first, so that a reader never sees a partly
+    # written cache file:
+    temporary_file = '{0}.{1}.tmp'.format(cache_file, os.getpid())
+    with open(temporary_file, 'wb') as file:
+        pickle.dump(cached_df, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_file, cache_file)
+
+    evict_from_cache(cache_path, max_cache_bytes)
+
+
+def evict_from_cache(cache_path, max_cache_bytes=MAX_CACHE_BYTES):
+    """ Removes the least recently used cache files until the cache is no
+    larger than max_cache_bytes.
+
+        Args:
+            cache_path: str: Directory of the cache
+            max_cache_bytes: int: Largest total size of the cache files
+        Returns: Nothing
+    """
+
+    # Files may be removed by another process at the same time:
+    cache_files = []
+    for file_name in os.listdir(cache_path):
+        if file_name.endswith(CACHE_FILE_SUFFIX):
+            try:
+                file_stat = os.stat(os.path.join(cache_path, file_name))
+            except FileNotFoundError:
+                continue
+            cache_files.append((file_stat.st_mtime, file_stat.st_size,
+                                file_name))
+
+    cache_bytes = sum(file_size for (_, file_size, _) in cache_files)
+    for (_, file_size, file_name) in sorted(cache_files):
+        if cache_bytes <= max_cache_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_path, file_name))
+        except FileNotFoundError:
+            pass
+        cache_bytes -= file_size
+
+
+def invalidate_cache(cache_path, cache_key=None):
+    """ Removes one or all entries of the cache.
+
+        Args:
+            cache_path: str: Directory of the cache
+            cache_key: str: Optional, the entry removed, by default all
+            entries are removed
+        Returns:
+            num_removed: int: Number of cache files removed
+    """
+
+    if not os.path.isdir(cache_path):
+        return 0
+
+    if cache_key is None:
+        file_names = [file_name for file_name in os.listdir(cache_path)
+                      if file_name.endswith(CACHE_FILE_SUFFIX)]
+    else:
+        file_names = [cache_key + CACHE_FILE_SUFFIX]
+
+    num_removed = 0
+    for file_name in file_names:
+        try:
+            os.remove(os.path.join(cache_path, file_name))
+            num_removed += 1
+        except FileNotFoundError:
+            pass
+
+    return num_removed
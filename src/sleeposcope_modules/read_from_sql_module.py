@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module reads the subject data back from the subjects table (see
+talk_to_sql_module) a block of rows at a time, so that analyses can go
+through a subject, a day or the whole cohort in constant memory. The subject,
+day and time filters are applied by the database, using the index on
+(subject_num, num_days, secs), and the rows are streamed from a server-side
+cursor (on PostgreSQL) fetch_size rows at a time. The status of each second
+is not stored with the rows; it is looked up in the status intervals (see
+status_interval_module) of the rows read.
+"""
+
+import pandas as pd
+from sqlalchemy import select
+from sleeposcope_modules.talk_to_sql_module import get_subjects_table, \
+    read_registry, read_status_intervals
+from sleeposcope_modules.status_interval_module import label_time_ranges
+
+# Number of rows fetched from the database and yielded at a time:
+FETCH_SIZE = 50000
+
+# Types of the columns in the blocks read (as stored in the table, see
+# talk_to_sql_module.TABLE_COLUMNS). Missing statuses are read as NaN:
+BLOCK_DTYPES = {'subject_num': 'int16', 'num_days': 'int16', 'secs': 'int32',
+                'meas_sig_str': 'float32', 'status': 'object'}
+# Columns read when no columns are given:
+BLOCK_COLUMNS = ['subject_num', 'num_days', 'secs', 'meas_sig_str', 'status']
+
+
+def iterate_rows(engine, TABLE_NAME, subject_nums=None, num_days=None,
+                 from_secs=None, to_secs=None, columns=None,
+                 fetch_size=FETCH_SIZE, as_numpy=False):
+    """ Reads the rows of the subjects table that match the filters, in
+    blocks of fetch_size rows, ordered by subject_num, num_days and secs.
+
+        Args:
+            engine: sqlalchemy.engine.base.Engine: Database connection
+            TABLE_NAME: str
+            subject_nums: list of int: Optional, by default all subjects
+            num_days: list of int: Optional, by default all days
+            from_secs: int: Optional, first second read
+            to_secs: int: Optional, second after the last second read
+            columns: list of str: Optional, columns read, by default
+            BLOCK_COLUMNS. status is read as text, from the status intervals.
+            fetch_size: int: Number of rows read at a time
+            as_numpy: bool: Yield numpy record arrays instead of DataFrames
+        Yields:
+            block: pandas DataFrame (or numpy record array) of up to
+            fetch_size rows
+    """
+
+    if columns is None:
+        columns = BLOCK_COLUMNS
+    columns = list(columns)
+    read_columns = [column for column in columns if column != 'status']
+    if 'status' in columns:
+        # The rows are labelled with the intervals of the seconds read:
+        intervals = read_status_intervals(engine, subject_nums,
+                                          from_secs=from_secs,
+                                          to_secs=to_secs)
+        read_columns += [column for column in ['subject_num', 'secs']
+                         if column not in read_columns]
+    querry = get_rows_querry(TABLE_NAME, subject_nums, num_days, from_secs,
+                             to_secs, read_columns)
+
+    with engine.connect() as connection:
+        result = connection.execution_options(
+            stream_results=True, yield_per=fetch_size).execute(querry)
+        keys = list(result.keys())
+        for partition in result.partitions(fetch_size):
+            block = pd.DataFrame.from_records(
+                partition, columns=keys, coerce_float=True).astype(
+                    {key: BLOCK_DTYPES[key] for key in keys})
+            if 'status' in columns:
+                block['status'] = label_time_ranges(
+                    intervals, block.rename(columns={'secs': 'start_secs'})
+                    )['status']
+                block = block[columns]
+            if as_numpy:
+                yield block.to_records(index=False)
+            else:
+                yield block
+
+
+def get_rows_querry(TABLE_NAME, subject_nums=None, num_days=None,
+                    from_secs=None, to_secs=None, columns=None):
+    """ Builds the query of iterate_rows.
+
+        Args: see iterate_rows, columns are columns of the subjects table
+        Returns:
+            querry: sqlalchemy Select
+    """
+
+    table = get_subjects_table(TABLE_NAME)
+    if columns is None:
+        columns = table.columns.keys()
+
+    querry = select(*[table.c[column] for column in columns])
+
+    if subject_nums is not None:
+        querry = querry.where(table.c.subject_num.in_(
+            [int(subject_num) for subject_num in subject_nums]))
+    if num_days is not None:
+        querry = querry.where(table.c.num_days.in_(
+            [int(day) for day in num_days]))
+    if from_secs is not None:
+        querry = querry.where(table.c.secs >= int(from_secs))
+    if to_secs is not None:
+        querry = querry.where(table.c.secs < int(to_secs))
+
+    return querry.order_by(table.c.subject_num, table.c.num_days,
+                           table.c.secs)
+
+
+def iterate_subject_day(engine, TABLE_NAME, subject_num, num_days,
+                        columns=None, fetch_size=FETCH_SIZE, as_numpy=False):
+    """ Reads one period of one subject, a block of rows at a time.
+
+        Args:
+            engine: sqlalchemy.engine.base.Engine: Database connection
+            TABLE_NAME: str
+            subject_num: int
+            num_days: int: The period (see
+            preprocessing_module.divide_to_24_hour_periods)
+            columns, fetch_size, as_numpy: see iterate_rows
+        Yields:
+            block: see iterate_rows
+    """
+
+    return iterate_rows(engine, TABLE_NAME, [subject_num], [num_days],
+                        columns=columns, fetch_size=fetch_size,
+                        as_numpy=as_numpy)
+
+
+def iterate_time_range(engine, TABLE_NAME, start_time, end_time,
+                       subject_nums=None, columns=None,
+                       fetch_size=FETCH_SIZE, as_numpy=False):
+    """ Reads the rows of every subject recorded in a range of time, one
+    subject after the other. The subject registry gives the start of each
+    recording, so each subject is read as a range of its seconds.
+
+        Args:
+            engine: sqlalchemy.engine.base.Engine: Database connection
+            TABLE_NAME: str
+            start_time: pandas Timestamp: First time read (time zone aware)
+            end_time: pandas Timestamp: Time after the last time read
+            subject_nums: list of int: Optional, by default all subjects in
+            the registry
+            columns, fetch_size, as_numpy: see iterate_rows
+        Yields:
+            block: see iterate_rows, with the rows of a single subject
+    """
+
+    registry = read_registry(engine)
+    if subject_nums is not None:
+        registry = registry[registry.index.isin(list(subject_nums))]
+    # Subjects recorded at some time in the range:
+    registry = registry[(registry.start_time < end_time) &
+                        (registry.end_time >= start_time)]
+
+    for subject_num, entry in registry.iterrows():
+        from_secs = max(0, -(-(start_time - entry.start_time) //
+                             pd.Timedelta(seconds=1)))
+        to_secs = -(-(end_time - entry.start_time) // pd.Timedelta(seconds=1))
+        for block in iterate_rows(engine, TABLE_NAME, [subject_num],
+                                  from_secs=from_secs, to_secs=to_secs,
+                                  columns=columns, fetch_size=fetch_size,
+                                  as_numpy=as_numpy):
+            yield block
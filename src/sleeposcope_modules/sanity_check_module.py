@@ -7,7 +7,14 @@ This module contains all functions to be used in the sleeposcope project.
 # Libraries and modules to import:
 import pandas as pd
 from glob import glob
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import SQLAlchemyError
 import os.path
+import re
+
+
+# Table with one row per subject in the database:
+REGISTRY_TABLE_NAME = 'subjects_registry_table'
 
 
 class DateTimeColumnIsDefectiveError(Exception): pass
@@ -46,6 +53,24 @@ class DataFrameContainsNans(Exception): pass
 class Subject_num_does_not_match_subject_files_path(Exception): pass
 
 
+class FillMethodIsUnknownError(Exception): pass
+
+
+class DuplicatePolicyIsUnknownError(Exception): pass
+
+
+class StorageBackendIsUnknownError(Exception): pass
+
+
+class SignalFileIsDefectiveError(Exception): pass
+
+
+class PipelineWasCancelledError(Exception): pass
+
+
+class ValueOutOfRangeError(Exception): pass
+
+
 def check_if_subject_num_matches_subject_files_path(subject_num,
                                                     subject_files_path):
     """Checks if subject_files_path matches subject_num are inconsistent.
@@ -64,10 +89,34 @@ def check_if_subject_num_matches_subject_files_path(subject_num,
                                                             "subject folder")
 
 
+def infer_subject_num_from_subject_files_path(subject_files_path):
+    """Infers the subject number from the directory the subject files are
+    stored in, which must end in subject_num (see
+    check_if_subject_num_matches_subject_files_path), e.g. ../data/Subject12
+    is subject 12.
+
+    Args:
+        subject_files_path: character string, full or relative path
+    Returns:
+        subject_num: int
+    """
+
+    subject_num_str = re.search(r'(\d*)$',
+                                subject_files_path.rstrip('/')).group(1)
+    if subject_num_str == '':
+        raise Subject_num_does_not_match_subject_files_path("subject folder "
+                                                            "does not end in "
+                                                            "a subject_num")
+
+    return int(subject_num_str)
+
+
 def check_file_df_content(file_df):
     """Checks if the content of DataFrame read from the csv data file
-    consistent with the expected format (i.e., it is mostly full, has no NaNs,
-    it has the following column headers), if not, then it raises an exception.
+    consistent with the expected format (i.e., it is mostly full, it has the
+    following column headers), if not, then it raises an exception. NaNs are
+    counted in the quality report of the file instead (see
+    validation_module.check_file_quality).
     Expected column headers:
         'name', 'time', 'meas_sig_str', 'status'
 
@@ -76,24 +125,24 @@ def check_file_df_content(file_df):
     Returns: Nothing
     """
     try:
-        check_if_data_frame_is_valid(file_df)
+        check_if_data_frame_is_valid(file_df, check_nans=False)
     except DataFrameIsNone:
         raise FailedToReadCSVError("csv file content was not imported")
     except DataFrameIsEmpty:
         raise DataFileIsDefectiveError("csv file contains nothing")
-    except DataFrameContainsNans:
-        raise DataFileIsDefectiveError("csv file contains NaNs")
 
     if list(file_df.columns) != ['name', 'time', 'meas_sig_str', 'status']:
         raise FileIsNotCorrectDataFileError("""File content does not match 
             expected format""")
 
 
-def check_if_data_frame_is_valid(df):
+def check_if_data_frame_is_valid(df, check_nans=True):
     """Checks if a DataFrame is None, empty, or contains NaNs and throws an
     exception in each case.
         Args:
             df: Pandas DataFrame
+            check_nans: bool: Whether to scan the DataFrame for NaNs, not
+            needed when a quality report has already counted them
         Returns: Nothing
     """
 
@@ -101,7 +150,7 @@ def check_if_data_frame_is_valid(df):
         raise DataFrameIsNone("DataFrame is None")
     elif len(df) == 0:
         raise DataFrameIsEmpty("DataFrame is empty")
-    elif df.isnull().values.any():
+    elif check_nans and df.isnull().values.any():
         raise DataFrameContainsNans("DataFrame contains NaNs")
 
 
@@ -148,7 +197,10 @@ def check_engine(engine):
 
 
 def check_if_subject_already_in_table(subject_num, TABLE_NAME, engine):
-    """ Throws an exception if current subject data is already in the table
+    """ Throws an exception if current subject data is already in the table.
+    The subject registry is checked first; subjects added before the registry
+    existed are looked up in the (indexed) table itself. Both are
+    parameterized single-row lookups.
     
         Args: 
             subject_num: int
@@ -159,18 +211,20 @@ def check_if_subject_already_in_table(subject_num, TABLE_NAME, engine):
             None 
     """
 
-    
-    subject_exists_querry = """SELECT * FROM all_subjects_table WHERE 
-    subject_num =""" + str(subject_num) + ' limit 1;'
-    
-    if does_table_exist_in_db(TABLE_NAME, engine):
-        current_subject_data_in_db = pd.read_sql_query(
-                subject_exists_querry,engine)
-        
-        if (current_subject_data_in_db is not None) and \
-                len(current_subject_data_in_db) > 0:
-            raise SubjectExistsInDBError(
-                "This subject has already been added to the database!")
+    for table_name in [REGISTRY_TABLE_NAME, TABLE_NAME]:
+        if does_table_exist_in_db(table_name, engine):
+            subject_exists_querry = text(
+                'SELECT 1 FROM {0} WHERE subject_num = :subject_num '
+                'LIMIT 1'.format(
+                    engine.dialect.identifier_preparer.quote(table_name)))
+            with engine.connect() as connection:
+                current_subject_data_in_db = connection.execute(
+                    subject_exists_querry,
+                    {'subject_num': int(subject_num)}).first()
+
+            if current_subject_data_in_db is not None:
+                raise SubjectExistsInDBError(
+                    "This subject has already been added to the database!")
           
             
 def does_table_exist_in_db(TABLE_NAME, engine):
@@ -182,22 +236,9 @@ def does_table_exist_in_db(TABLE_NAME, engine):
         Returns:
             table_exists: Bool
     """
-    
-    table_exists_querry = """
-    SELECT EXISTS (
-       SELECT 1
-       FROM   information_schema.tables 
-       WHERE  table_schema = 'public'
-       AND    table_name = 'all_subjects_table'
-       );
-    """    
-            
-    table_exists = pd.read_sql_query(table_exists_querry, engine)
-    
-    if table_exists is None:
+
+    try:
+        return inspect(engine).has_table(TABLE_NAME)
+    except SQLAlchemyError:
         raise QuerryFailedError("""Could not check whether data table exists in 
                                 database""")
-    else:
-        return table_exists.iloc[0,0]
-    
-    
\ No newline at end of file
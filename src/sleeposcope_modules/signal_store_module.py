@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module stores the pre-processed signal of each subject in a binary file
+that is read by memory-mapping it. Since the signal has one sample per second
+once the missing seconds are filled in, a subject is one dense array plus the
+time of its first sample, and any range of time is a slice of that array.
+
+A signal file is laid out as:
+    SIGNAL_FILE_MAGIC and the length of the header (little-endian uint32)
+    the header: JSON with the start time, sample rate, number of samples,
+    first second of every period in num_days, and offsets of the arrays
+    the gap mask: one uint8 per sample, one of GAP_MASK_VALUES
+    the signal: one float32 per sample, NaN where a gap was not filled
+Both arrays start at a multiple of SIGNAL_FILE_ALIGNMENT bytes.
+"""
+
+import json
+import os
+import struct
+import numpy as np
+import pandas as pd
+from sleeposcope_modules.preprocessing_module import read_data, \
+    fill_missing_data, divide_to_24_hour_periods, LOCAL_TIME_ZONE, \
+    MAX_COPY_FILL_SECS, DAY_BOUNDARY, PERIOD_LENGTH
+from sleeposcope_modules.sanity_check_module import \
+    SignalFileIsDefectiveError
+
+SIGNAL_FILE_MAGIC = b'SLPSIG01'
+SIGNAL_FILE_PREFIX = struct.Struct('<8sI')
+SIGNAL_FILE_ALIGNMENT = 64
+SIGNAL_DTYPE = np.float32
+
+# Values of the gap mask:
+GAP_MASK_VALUES = {'recorded': 0, 'filled': 1, 'not_filled': 2}
+
+
+class SubjectSignal(object):
+    """ The memory-mapped signal of one subject (see open_signal_file). The
+    arrays are read-only views of the file; slicing them does not copy or
+    read anything until the values are used.
+
+        Attributes:
+            header: dict: The header of the signal file
+            start_time: pandas Timestamp: Time of the first sample
+            sample_rate: int: Samples per second
+            day_start_secs: numpy array: First second of each period in
+            num_days (period 1 first)
+            gap_mask: numpy array of uint8, one of GAP_MASK_VALUES per sample
+            signal: numpy array of float32
+    """
+
+    def __init__(self, file_path):
+        with open(file_path, 'rb') as file:
+            (magic, header_length) = SIGNAL_FILE_PREFIX.unpack(
+                file.read(SIGNAL_FILE_PREFIX.size))
+            if magic != SIGNAL_FILE_MAGIC:
+                raise SignalFileIsDefectiveError(
+                    "{0} is not a signal file".format(file_path))
+            self.header = json.loads(file.read(header_length).decode())
+
+        num_samples = self.header['num_samples']
+        self.start_time = None
+        if self.header['start_time'] is not None:
+            self.start_time = pd.Timestamp(
+                self.header['start_time']).tz_convert(self.header['time_zone'])
+        self.sample_rate = self.header['sample_rate']
+        self.day_start_secs = np.asarray(self.header['day_start_secs'],
+                                         dtype=np.int64)
+        if num_samples == 0:
+            self.gap_mask = np.zeros(0, dtype=np.uint8)
+            self.signal = np.zeros(0, dtype=SIGNAL_DTYPE)
+        else:
+            self.gap_mask = np.memmap(file_path, dtype=np.uint8, mode='r',
+                                      offset=self.header['gap_mask_offset'],
+                                      shape=(num_samples,))
+            self.signal = np.memmap(file_path, dtype=SIGNAL_DTYPE, mode='r',
+                                    offset=self.header['signal_offset'],
+                                    shape=(num_samples,))
+
+    def __len__(self):
+        return len(self.signal)
+
+    def to_sample(self, time):
+        """ Converts a time to the number of the sample at or after it.
+
+            Args:
+                time: pandas Timestamp, or int: seconds from the start
+            Returns:
+                sample: int, clipped to the samples in the file
+        """
+
+        if isinstance(time, pd.Timestamp):
+            secs = (time - self.start_time) / pd.Timedelta(seconds=1)
+            sample = int(np.ceil(secs * self.sample_rate))
+        else:
+            sample = int(time) * self.sample_rate
+
+        return min(max(sample, 0), len(self))
+
+    def get_time_range(self, start, end):
+        """ Selects the samples from start up to (not including) end.
+
+            Args:
+                start, end: pandas Timestamps, or ints: seconds from the start
+            Returns:
+                signal: numpy array: view of the signal
+                gap_mask: numpy array: view of the gap mask
+        """
+
+        (first, last) = (self.to_sample(start), self.to_sample(end))
+
+        return self.signal[first:last], self.gap_mask[first:last]
+
+    def get_day(self, num_days):
+        """ Selects the samples of one period of the recording.
+
+            Args:
+                num_days: int: The period, starting at 1 (see
+                preprocessing_module.divide_to_24_hour_periods)
+            Returns:
+                signal: numpy array: view of the signal
+                gap_mask: numpy array: view of the gap mask
+        """
+
+        if num_days < 1 or num_days > len(self.day_start_secs):
+            return self.get_time_range(0, 0)
+        start = self.day_start_secs[num_days - 1]
+        if num_days < len(self.day_start_secs):
+            end = self.day_start_secs[num_days]
+        else:
+            end = len(self) // self.sample_rate
+
+        return self.get_time_range(start, end)
+
+
+def open_signal_file(file_path):
+    """ Memory-maps a signal file.
+
+        Args:
+            file_path: str
+        Returns:
+            subject_signal: SubjectSignal
+    """
+
+    return SubjectSignal(file_path)
+
+
+def get_signal_file_path(store_path, subject_num):
+    """ Finds the signal file of a subject in a store directory.
+
+        Args:
+            store_path: str: Directory of the signal files
+            subject_num: int
+        Returns:
+            file_path: str
+    """
+
+    return os.path.join(store_path, 'subject_{0}.sig'.format(subject_num))
+
+
+def write_signal_file(full_subject_df, gap_summary, file_path,
+                      time_zone=LOCAL_TIME_ZONE):
+    """ Writes the pre-processed signal of a subject to a signal file. The
+    file is written next to its final path and then moved there, so readers
+    never see a partly written file.
+
+        Args:
+            full_subject_df: A pandas DataFrame as returned by
+            divide_to_24_hour_periods: no missing seconds, indexed by seconds
+            and with the columns meas_sig_str, date_time and num_days
+
+            gap_summary: A pandas DataFrame: The gaps of full_subject_df (see
+            preprocessing_module.fill_missing_signal_values)
+
+            file_path: str
+
+            time_zone: str: Time zone the start time is shown in
+        Returns: Nothing
+    """
+
+    signal = full_subject_df['meas_sig_str'].to_numpy(dtype=SIGNAL_DTYPE,
+                                                      na_value=np.nan)
+    first_sec = full_subject_df.index[0] if len(full_subject_df) > 0 else 0
+    gap_mask = get_gap_mask(gap_summary, first_sec, len(signal))
+
+    # Periods start where num_days changes:
+    num_days = full_subject_df['num_days'].to_numpy()
+    day_start_secs = np.flatnonzero(np.diff(num_days, prepend=0) != 0)
+
+    header = {'version': 1,
+              'start_time': (full_subject_df['date_time'].iloc[0].isoformat()
+                             if len(full_subject_df) > 0 else None),
+              'time_zone': time_zone,
+              'sample_rate': 1,
+              'num_samples': len(signal),
+              'signal_dtype': np.dtype(SIGNAL_DTYPE).str,
+              'day_start_secs': day_start_secs.tolist()}
+    # The offsets are part of the header, so grow the header until they do
+    # not change its length:
+    (header['gap_mask_offset'], header['signal_offset']) = (0, 0)
+    while True:
+        header_length = len(json.dumps(header).encode())
+        gap_mask_offset = align(SIGNAL_FILE_PREFIX.size + header_length)
+        signal_offset = align(gap_mask_offset + gap_mask.nbytes)
+        if (gap_mask_offset, signal_offset) == (header['gap_mask_offset'],
+                                                header['signal_offset']):
+            break
+        (header['gap_mask_offset'], header['signal_offset']) = (
+            gap_mask_offset, signal_offset)
+    header_bytes = json.dumps(header).encode()
+
+    temporary_path = '{0}.{1}.tmp'.format(file_path, os.getpid())
+    with open(temporary_path, 'wb') as file:
+        file.write(SIGNAL_FILE_PREFIX.pack(SIGNAL_FILE_MAGIC,
+                                           len(header_bytes)))
+        file.write(header_bytes)
+        file.write(b'\0' * (gap_mask_offset - file.tell()))
+        gap_mask.tofile(file)
+        file.write(b'\0' * (signal_offset - file.tell()))
+        signal.tofile(file)
+    os.replace(temporary_path, file_path)
+
+
+def get_gap_mask(gap_summary, first_sec, num_samples):
+    """ Marks the seconds of each gap, filled or not.
+
+        Args:
+            gap_summary: A pandas DataFrame: The gaps of the signal (see
+            preprocessing_module.fill_missing_signal_values)
+
+            first_sec: int: Second of the first sample
+
+            num_samples: int
+        Returns:
+            gap_mask: numpy array of uint8, one of GAP_MASK_VALUES per sample
+    """
+
+    gap_mask = np.zeros(num_samples, dtype=np.uint8)
+    gap_starts = gap_summary['start_secs'].to_numpy(dtype=np.int64) - \
+        first_sec
+    gap_lengths = gap_summary['length_secs'].to_numpy(dtype=np.int64)
+    gap_positions = np.repeat(gap_starts - np.cumsum(gap_lengths) +
+                              gap_lengths, gap_lengths) + \
+        np.arange(gap_lengths.sum())
+    gap_mask[gap_positions] = np.repeat(np.where(
+        gap_summary['filled'].to_numpy(dtype=bool),
+        GAP_MASK_VALUES['filled'], GAP_MASK_VALUES['not_filled']),
+        gap_lengths)
+
+    return gap_mask
+
+
+def align(offset):
+    """ Rounds an offset up to a multiple of SIGNAL_FILE_ALIGNMENT. """
+
+    return -(-offset // SIGNAL_FILE_ALIGNMENT) * SIGNAL_FILE_ALIGNMENT
+
+
+def build_signal_file(subject_df, file_path, max_gap_secs=MAX_COPY_FILL_SECS,
+                      fill_method='copy_previous', duplicates='first',
+                      day_boundary=DAY_BOUNDARY, period_length=PERIOD_LENGTH,
+                      time_zone=LOCAL_TIME_ZONE, quality_report=None):
+    """ Fills in missing data, divides the recording into periods and writes
+    it to a signal file.
+
+        Args:
+            subject_df: pandas DataFrame as returned by read_data
+
+            file_path: str
+
+            max_gap_secs, fill_method, duplicates, quality_report: see
+            preprocessing_module.fill_missing_data
+
+            day_boundary, period_length, time_zone: see
+            preprocessing_module.divide_to_24_hour_periods
+        Returns: Nothing
+    """
+
+    full_subject_df, gap_summary = fill_missing_data(
+        subject_df, max_gap_secs=max_gap_secs, fill_method=fill_method,
+        duplicates=duplicates, return_gap_summary=True,
+        quality_report=quality_report)
+    full_subject_df = divide_to_24_hour_periods(
+        full_subject_df, day_boundary=day_boundary,
+        period_length=period_length, time_zone=time_zone)
+
+    write_signal_file(full_subject_df, gap_summary, file_path, time_zone)
+
+
+def build_signal_store(subject_num, subject_folder_path, store_path,
+                       time_zone=LOCAL_TIME_ZONE, num_workers=1, **options):
+    """ Reads in the csv files of a subject and writes its signal file to a
+    store directory.
+
+        Args:
+            subject_num: int
+
+            subject_folder_path: str: Full or relative path to the csv data
+            files
+
+            store_path: str: Directory of the signal files, created if needed
+
+            time_zone, num_workers: see preprocessing_module.read_data
+
+            options: passed to build_signal_file
+        Returns:
+            file_path: str: The signal file written
+    """
+
+    os.makedirs(store_path, exist_ok=True)
+    file_path = get_signal_file_path(store_path, subject_num)
+
+    subject_df, quality_report = read_data(subject_folder_path, time_zone,
+                                           num_workers,
+                                           return_quality_report=True)
+    build_signal_file(subject_df, file_path, time_zone=time_zone,
+                      quality_report=quality_report, **options)
+
+    return file_path
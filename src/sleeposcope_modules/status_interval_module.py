@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module stores the status of the csv files (the recorded state of the
+subject) as intervals instead of on every second. The status changes a few
+times a night, so a subject is a few hundred intervals
+
+    (subject_num, start_secs, end_secs, status)
+
+each covering the seconds from start_secs up to (not including) end_secs.
+An interval is a run of consecutive recorded seconds with the same status;
+seconds without a status (the gaps, filled or not) are not covered by any
+interval.
+
+The intervals are found as the rows are written, a block at a time, by
+looking for the rows where the status, the subject or the continuity of the
+seconds changes. Intervals that continue from one block into the next are
+joined when the subject is complete.
+
+label_time_ranges labels any seconds, epochs or ranges of time with the
+statuses of the intervals, all at once.
+"""
+
+import threading
+import numpy as np
+import pandas as pd
+
+# Intervals of a subject are joined once there are this many blocks of them:
+MAX_INTERVAL_PARTS = 64
+
+# Columns of the intervals and their types:
+INTERVAL_DTYPES = {'subject_num': np.int16, 'start_secs': np.int32,
+                   'end_secs': np.int32, 'status': object}
+
+
+def get_empty_intervals():
+    """ Creates a DataFrame of intervals with no rows.
+
+        Args: None
+        Returns:
+            intervals: pandas DataFrame with the columns in INTERVAL_DTYPES
+    """
+
+    return pd.DataFrame({column: pd.Series(dtype=dtype) for
+                         (column, dtype) in INTERVAL_DTYPES.items()})
+
+
+def find_status_intervals(subject_data):
+    """ Collapses the status of every second of a block of rows into
+    intervals.
+
+        Args:
+            subject_data: pandas DataFrame with a secs index or column and the
+            columns subject_num and status (missing in the seconds that were
+            not recorded), ordered by subject_num and secs
+        Returns:
+            intervals: pandas DataFrame with the columns in INTERVAL_DTYPES,
+            ordered by subject_num and start_secs
+    """
+
+    if len(subject_data) == 0:
+        return get_empty_intervals()
+
+    if 'secs' in subject_data.columns:
+        secs = subject_data['secs'].to_numpy(dtype=np.int64)
+    else:
+        secs = subject_data.index.to_numpy(dtype=np.int64)
+    subject_nums = subject_data['subject_num'].to_numpy(dtype=np.int64)
+    status = subject_data['status'].astype('category')
+    # Missing statuses have code -1:
+    codes = status.cat.codes.to_numpy()
+
+    # A run starts at the first row and wherever the status or subject
+    # changes or a second is skipped:
+    starts_run = np.ones(len(secs), dtype=bool)
+    starts_run[1:] = (codes[1:] != codes[:-1]) | \
+        (subject_nums[1:] != subject_nums[:-1]) | (secs[1:] != secs[:-1] + 1)
+    run_starts = np.flatnonzero(starts_run)
+    run_ends = np.append(run_starts[1:], len(secs)) - 1
+    has_status = codes[run_starts] >= 0
+    (run_starts, run_ends) = (run_starts[has_status], run_ends[has_status])
+
+    return pd.DataFrame({
+        'subject_num': subject_nums[run_starts],
+        'start_secs': secs[run_starts],
+        'end_secs': secs[run_ends] + 1,
+        'status': np.asarray(status.cat.categories, dtype=object)[
+            codes[run_starts]]}).astype(INTERVAL_DTYPES)
+
+
+def join_status_intervals(intervals):
+    """ Joins the intervals of a subject that follow on from each other with
+    the same status, e.g. the parts of an interval found in two blocks.
+
+        Args:
+            intervals: pandas DataFrame with the columns in INTERVAL_DTYPES,
+            not overlapping
+        Returns:
+            intervals: pandas DataFrame, ordered by subject_num and start_secs
+    """
+
+    if len(intervals) == 0:
+        return get_empty_intervals()
+
+    intervals = intervals.sort_values(['subject_num', 'start_secs'],
+                                      kind='mergesort', ignore_index=True)
+    subject_nums = intervals['subject_num'].to_numpy()
+    start_secs = intervals['start_secs'].to_numpy()
+    end_secs = intervals['end_secs'].to_numpy()
+    status = intervals['status'].to_numpy()
+
+    continues = np.zeros(len(intervals), dtype=bool)
+    continues[1:] = (subject_nums[1:] == subject_nums[:-1]) & \
+        (start_secs[1:] == end_secs[:-1]) & (status[1:] == status[:-1])
+    firsts = np.flatnonzero(~continues)
+    lasts = np.append(firsts[1:], len(intervals)) - 1
+
+    return pd.DataFrame({'subject_num': subject_nums[firsts],
+                         'start_secs': start_secs[firsts],
+                         'end_secs': end_secs[lasts],
+                         'status': status[firsts]}).astype(INTERVAL_DTYPES)
+
+
+class StatusIntervalAccumulator(object):
+    """ Collects the status intervals of the blocks written for each subject,
+    until the subject is complete. Blocks may hold the rows of several
+    subjects, and may be added from several threads.
+    """
+
+    def __init__(self):
+        self.parts = {}
+        self.lock = threading.Lock()
+
+    def add(self, subject_data):
+        """ Finds the status intervals of a block of rows.
+
+            Args:
+                subject_data: pandas DataFrame: see find_status_intervals
+            Returns: Nothing
+        """
+
+        if len(subject_data) == 0:
+            return
+        intervals = find_status_intervals(subject_data)
+        for (subject_num, subject_part) in intervals.groupby(
+                'subject_num', sort=False):
+            with self.lock:
+                parts = self.parts.setdefault(int(subject_num), [])
+                parts.append(subject_part)
+                # Join the parts of a subject that is written in many small
+                # blocks (e.g. a live recording):
+                if len(parts) >= MAX_INTERVAL_PARTS:
+                    parts[:] = [join_status_intervals(pd.concat(parts))]
+
+    def pop(self, subject_num):
+        """ Joins the status intervals of a subject and forgets its blocks.
+
+            Args:
+                subject_num: int
+            Returns:
+                intervals: pandas DataFrame with the columns in
+                INTERVAL_DTYPES, empty if no rows of the subject were added
+        """
+
+        with self.lock:
+            parts = self.parts.pop(int(subject_num), [])
+        if len(parts) == 0:
+            return get_empty_intervals()
+
+        return join_status_intervals(pd.concat(parts, ignore_index=True))
+
+
+def get_interval_keys(subject_nums, secs):
+    """ Combines subject numbers and seconds into keys that sort by subject
+    first and second next, so the intervals of every subject can be searched
+    at once.
+
+        Args:
+            subject_nums, secs: numpy arrays of int
+        Returns:
+            keys: numpy array of int64
+    """
+
+    return (np.asarray(subject_nums, dtype=np.int64) << 32) + \
+        np.asarray(secs, dtype=np.int64)
+
+
+def label_time_ranges(intervals, ranges):
+    """ Labels ranges of seconds (single seconds, epochs or any range of
+    time) with the status that covers most of each range, e.g. to label the
+    epoch features:
+
+        features[['status', 'status_fraction']] = label_time_ranges(
+            intervals, features.assign(
+                end_secs=features.start_secs + features.num_secs))
+
+        Args:
+            intervals: pandas DataFrame with the columns in INTERVAL_DTYPES,
+            not overlapping
+
+            ranges: pandas DataFrame with the columns subject_num and
+            start_secs, and optionally end_secs (the second after the range;
+            by default each range is the single second start_secs)
+        Returns:
+            labels: pandas DataFrame with the index of ranges and the columns:
+                status: the status covering most of the range, missing if no
+                interval overlaps it (ties go to the earliest interval)
+                status_fraction: the part of the range that status covers
+    """
+
+    intervals = intervals.sort_values(['subject_num', 'start_secs'],
+                                      kind='mergesort', ignore_index=True)
+    interval_starts = get_interval_keys(intervals['subject_num'],
+                                        intervals['start_secs'])
+    interval_ends = get_interval_keys(intervals['subject_num'],
+                                      intervals['end_secs'])
+    range_starts = get_interval_keys(ranges['subject_num'],
+                                     ranges['start_secs'])
+    if 'end_secs' in ranges.columns:
+        range_ends = get_interval_keys(ranges['subject_num'],
+                                       ranges['end_secs'])
+    else:
+        range_ends = range_starts + 1
+
+    # The intervals overlapping each range are the ones from the first that
+    # ends after the range starts to the last that starts before it ends:
+    firsts = np.searchsorted(interval_ends, range_starts, side='right')
+    lasts = np.searchsorted(interval_starts, range_ends, side='left')
+    num_overlapping = np.maximum(lasts - firsts, 0)
+
+    # One row per (range, overlapping interval) pair:
+    pair_ranges = np.repeat(np.arange(len(range_starts)), num_overlapping)
+    pair_intervals = np.repeat(firsts - np.cumsum(num_overlapping) +
+                               num_overlapping, num_overlapping) + \
+        np.arange(num_overlapping.sum())
+    overlaps = np.minimum(range_ends[pair_ranges],
+                          interval_ends[pair_intervals]) - \
+        np.maximum(range_starts[pair_ranges], interval_starts[pair_intervals])
+
+    pairs = pd.DataFrame({
+        'range': pair_ranges,
+        'status': intervals['status'].to_numpy()[pair_intervals],
+        'overlap': overlaps})
+    # Add up the overlap of each status, then keep the largest per range:
+    pairs = pairs.groupby(['range', 'status'], sort=False,
+                          as_index=False)['overlap'].sum()
+    pairs = pairs.sort_values('overlap', ascending=False,
+                              kind='mergesort').drop_duplicates('range')
+
+    status = np.full(len(range_starts), np.nan, dtype=object)
+    status_fraction = np.zeros(len(range_starts))
+    status[pairs['range'].to_numpy()] = pairs['status'].to_numpy()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        status_fraction[pairs['range'].to_numpy()] = \
+            pairs['overlap'].to_numpy() / \
+            (range_ends - range_starts)[pairs['range'].to_numpy()]
+
+    return pd.DataFrame({'status': status,
+                         'status_fraction': status_fraction},
+                        index=ranges.index)
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module contains the storage backends the preprocessed subject data can be
+written to. Every backend has the same methods, so the scripts do not need
+to know where the data ends up:
+    check_if_subject_already_stored(subject_num): raises
+    SubjectExistsInDBError if the subject has already been written
+    write(subject_data): adds (a block of) subject data
+    register_subject(subject_num, num_rows, start_time, end_time, num_days):
+    records a subject once all of its data has been written, and stores the
+    summary levels of its signal (see summary_module) and its status
+    intervals (see status_interval_module)
+    write_subject(subject_num, subject_chunks): writes all the blocks of a
+    subject and records it, so that either all of it is stored or, if
+    anything fails, none of it
+    read_summaries(subject_num, level_secs, from_secs, to_secs): reads the
+    summaries of a subject at one level
+    read_status_intervals(subject_nums, statuses, from_secs, to_secs): reads
+    the status intervals that match the filters
+The status of every second is not stored with the subject data, only its
+intervals.
+"""
+
+import os.path
+import shutil
+from glob import glob
+import threading
+from contextlib import contextmanager
+import pandas as pd
+from sleeposcope_modules.sanity_check_module import \
+    check_if_subject_already_in_table, SubjectExistsInDBError, \
+    StorageBackendIsUnknownError
+from sleeposcope_modules.talk_to_sql_module import write_to_sql_database, \
+    select_table_columns, write_registry_entry, get_subjects_table, \
+    write_rows, write_summaries, read_summaries, write_status_intervals, \
+    read_status_intervals
+from sleeposcope_modules.summary_module import SummaryAccumulator, \
+    SUMMARY_DTYPES
+from sleeposcope_modules.status_interval_module import \
+    StatusIntervalAccumulator, get_empty_intervals
+
+# Names the backends are selected by:
+STORAGE_BACKENDS = ('sql', 'parquet')
+
+# Columns the parquet dataset is partitioned by:
+PARTITION_COLUMNS = ['subject_num', 'num_days']
+# Directories of the summaries and of the status intervals within the parquet
+# dataset, one file per subject. Directories starting with '_' are not part
+# of the dataset:
+SUMMARIES_DIRECTORY = '_summaries'
+STATUS_INTERVALS_DIRECTORY = '_status_intervals'
+
+
+class SqlStorageBackend(object):
+    """ Writes subject data to a table in a SQL database (see
+    talk_to_sql_module).
+
+        Args:
+            engine: sqlalchemy.engine.base.Engine: Database connection
+            TABLE_NAME: str
+            database_already_existed: bool: If False the subject cannot be in
+            the database yet
+    """
+
+    def __init__(self, engine, TABLE_NAME, database_already_existed=True):
+        self.engine = engine
+        self.TABLE_NAME = TABLE_NAME
+        self.database_already_existed = database_already_existed
+        self.summaries = SummaryAccumulator()
+        self.status_intervals = StatusIntervalAccumulator()
+
+    def check_if_subject_already_stored(self, subject_num):
+        if self.database_already_existed:
+            check_if_subject_already_in_table(subject_num, self.TABLE_NAME,
+                                              self.engine)
+
+    def begin(self):
+        # A transaction that writes to the database (see
+        # pre_process_subject_data.pre_process_subject_incrementally):
+        return self.engine.begin()
+
+    def write(self, subject_data):
+        write_to_sql_database(subject_data, self.engine, self.TABLE_NAME)
+        self.summaries.add(subject_data)
+        self.status_intervals.add(subject_data)
+
+    def register_subject(self, subject_num, num_rows, start_time, end_time,
+                         num_days):
+        summaries = self.summaries.pop(subject_num)
+        status_intervals = self.status_intervals.pop(subject_num)
+        with self.engine.begin() as connection:
+            write_summaries(connection, subject_num, summaries)
+            write_status_intervals(connection, subject_num, status_intervals)
+            write_registry_entry(connection, subject_num, num_rows,
+                                 start_time, end_time, num_days)
+
+    def write_subject(self, subject_num, subject_chunks):
+        table = get_subjects_table(self.TABLE_NAME)
+        table.create(self.engine, checkfirst=True)
+
+        registry_entry = get_empty_registry_entry()
+        summaries = SummaryAccumulator()
+        status_intervals = StatusIntervalAccumulator()
+        with self.engine.begin() as connection:
+            for subject_data in track_registry_entry(subject_chunks,
+                                                     registry_entry):
+                write_rows(select_table_columns(subject_data), connection,
+                           table)
+                summaries.add(subject_data)
+                status_intervals.add(subject_data)
+            write_summaries(connection, subject_num,
+                            summaries.pop(subject_num))
+            write_status_intervals(connection, subject_num,
+                                   status_intervals.pop(subject_num))
+            write_registry_entry(connection, subject_num, **registry_entry)
+
+        return registry_entry['num_rows']
+
+    def read_summaries(self, subject_num, level_secs, from_secs=0,
+                       to_secs=None):
+        return read_summaries(self.engine, subject_num, level_secs,
+                              from_secs, to_secs)
+
+    def read_status_intervals(self, subject_nums=None, statuses=None,
+                              from_secs=None, to_secs=None):
+        return read_status_intervals(self.engine, subject_nums, statuses,
+                                     from_secs, to_secs)
+
+
+class ParquetStorageBackend(object):
+    """ Writes subject data to a columnar (parquet) dataset on disk,
+    partitioned by subject_num and num_days, with typed, compressed columns.
+    Readers can skip partitions and columns they do not need (see
+    read_parquet_dataset). Requires pyarrow.
+
+        Args:
+            dataset_path: str: Directory of the dataset, created if needed
+            compression: str: Compression codec of the parquet files
+    """
+
+    def __init__(self, dataset_path, compression='zstd'):
+        self.dataset_path = dataset_path
+        self.compression = compression
+        self.summaries = SummaryAccumulator()
+        self.status_intervals = StatusIntervalAccumulator()
+
+    def check_if_subject_already_stored(self, subject_num):
+        subject_path = os.path.join(self.dataset_path,
+                                    'subject_num={0}'.format(subject_num))
+        if os.path.exists(subject_path):
+            raise SubjectExistsInDBError(
+                "This subject has already been added to the dataset!")
+
+    def write(self, subject_data):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        # The pandas types are left out: they can differ from block to block
+        # (see preprocessing_module.compact_signal), and the dataset is read
+        # with the types of get_parquet_schema:
+        table = pa.Table.from_pandas(select_table_columns(subject_data),
+                                     schema=get_parquet_schema(),
+                                     preserve_index=False
+                                     ).replace_schema_metadata()
+        pq.write_to_dataset(table, self.dataset_path,
+                            partition_cols=PARTITION_COLUMNS,
+                            compression=self.compression,
+                            existing_data_behavior='overwrite_or_ignore')
+        self.summaries.add(subject_data)
+        self.status_intervals.add(subject_data)
+
+    def register_subject(self, subject_num, num_rows, start_time, end_time,
+                         num_days):
+        # The partition directories already list the subjects and days:
+        self.write_subject_file(SUMMARIES_DIRECTORY, subject_num,
+                                self.summaries.pop(subject_num))
+        self.write_subject_file(STATUS_INTERVALS_DIRECTORY, subject_num,
+                                self.status_intervals.pop(subject_num))
+
+    def write_subject(self, subject_num, subject_chunks):
+        # The subject is written next to the dataset and moved into it once
+        # complete. Directories starting with '.' are not part of the
+        # dataset:
+        subject_directory = 'subject_num={0}'.format(subject_num)
+        staging_path = os.path.join(self.dataset_path,
+                                    '.staging_' + subject_directory)
+        shutil.rmtree(staging_path, ignore_errors=True)
+        staging_backend = ParquetStorageBackend(staging_path, self.compression)
+
+        registry_entry = get_empty_registry_entry()
+        try:
+            for subject_data in track_registry_entry(subject_chunks,
+                                                     registry_entry):
+                staging_backend.write(subject_data)
+            if registry_entry['num_rows'] > 0:
+                os.replace(os.path.join(staging_path, subject_directory),
+                           os.path.join(self.dataset_path, subject_directory))
+                self.write_subject_file(
+                    SUMMARIES_DIRECTORY, subject_num,
+                    staging_backend.summaries.pop(subject_num))
+                self.write_subject_file(
+                    STATUS_INTERVALS_DIRECTORY, subject_num,
+                    staging_backend.status_intervals.pop(subject_num))
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+
+        return registry_entry['num_rows']
+
+    def get_subject_file_path(self, directory, subject_num):
+        return os.path.join(self.dataset_path, directory,
+                            'subject_num={0}.parquet'.format(subject_num))
+
+    def write_subject_file(self, directory, subject_num, subject_frame):
+        # The file is replaced at once, readers never see it half written:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        file_path = self.get_subject_file_path(directory, subject_num)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        temporary_path = '{0}.{1}.tmp'.format(file_path, os.getpid())
+        pq.write_table(pa.Table.from_pandas(subject_frame,
+                                            preserve_index=False),
+                       temporary_path, compression=self.compression)
+        os.replace(temporary_path, file_path)
+
+    def read_summaries(self, subject_num, level_secs, from_secs=0,
+                       to_secs=None):
+        import pyarrow.parquet as pq
+
+        summaries_path = self.get_subject_file_path(SUMMARIES_DIRECTORY,
+                                                    subject_num)
+        if not os.path.exists(summaries_path):
+            return pd.DataFrame(columns=list(SUMMARY_DTYPES))
+        filters = [('level_secs', '=', level_secs),
+                   ('start_secs', '>', from_secs - level_secs)]
+        if to_secs is not None:
+            filters.append(('start_secs', '<', to_secs))
+
+        return pq.read_table(summaries_path, filters=filters).to_pandas(
+            ).sort_values(['start_secs', 'num_days'], ignore_index=True)
+
+    def read_status_intervals(self, subject_nums=None, statuses=None,
+                              from_secs=None, to_secs=None):
+        import pyarrow.dataset as ds
+
+        directory_path = os.path.join(self.dataset_path,
+                                      STATUS_INTERVALS_DIRECTORY)
+        if subject_nums is None:
+            file_paths = glob(os.path.join(directory_path, '*.parquet'))
+        else:
+            file_paths = [self.get_subject_file_path(
+                STATUS_INTERVALS_DIRECTORY, subject_num)
+                for subject_num in subject_nums]
+        file_paths = [file_path for file_path in file_paths
+                      if os.path.exists(file_path)]
+        if len(file_paths) == 0:
+            return get_empty_intervals()
+
+        conditions = []
+        if statuses is not None:
+            conditions.append(ds.field('status').isin(list(statuses)))
+        if from_secs is not None:
+            conditions.append(ds.field('end_secs') > from_secs)
+        if to_secs is not None:
+            conditions.append(ds.field('start_secs') < to_secs)
+        condition = None
+        for next_condition in conditions:
+            condition = next_condition if condition is None else \
+                condition & next_condition
+
+        return ds.dataset(file_paths).to_table(filter=condition).to_pandas(
+            ).sort_values(['subject_num', 'start_secs'], ignore_index=True)
+
+
+class ConcurrencyLimitedStorageBackend(object):
+    """ Wraps a storage backend shared by several threads so that at most
+    max_concurrent_writes of them write at the same time. The engine and
+    table of the sql backend are passed through, and begin opens a write
+    transaction within a write slot, for incremental ingests.
+
+        Args:
+            storage_backend: the backend that is wrapped
+            max_concurrent_writes: int
+    """
+
+    def __init__(self, storage_backend, max_concurrent_writes):
+        self.storage_backend = storage_backend
+        self.write_slots = threading.BoundedSemaphore(max_concurrent_writes)
+
+    # The database of the sql backend, read without a write slot:
+    @property
+    def engine(self):
+        return self.storage_backend.engine
+
+    @property
+    def TABLE_NAME(self):
+        return self.storage_backend.TABLE_NAME
+
+    @contextmanager
+    def begin(self):
+        with self.write_slots, self.storage_backend.begin() as connection:
+            yield connection
+
+    def check_if_subject_already_stored(self, subject_num):
+        self.storage_backend.check_if_subject_already_stored(subject_num)
+
+    def write(self, subject_data):
+        with self.write_slots:
+            self.storage_backend.write(subject_data)
+
+    def register_subject(self, subject_num, num_rows, start_time, end_time,
+                         num_days):
+        with self.write_slots:
+            self.storage_backend.register_subject(
+                subject_num, num_rows, start_time, end_time, num_days)
+
+    def write_subject(self, subject_num, subject_chunks):
+        # The write slot is held while a block is written, and from the last
+        # block until the subject is recorded. It is not held while the next
+        # block is read and pre-processed:
+        held_to_the_end = []
+
+        def hold_write_slot(subject_chunks):
+            for subject_data in subject_chunks:
+                with self.write_slots:
+                    yield subject_data
+            self.write_slots.acquire()
+            held_to_the_end.append(True)
+
+        subject_chunks = hold_write_slot(subject_chunks)
+        try:
+            return self.storage_backend.write_subject(subject_num,
+                                                      subject_chunks)
+        finally:
+            # Releases the slot of a block whose write failed:
+            subject_chunks.close()
+            if held_to_the_end:
+                self.write_slots.release()
+
+    def read_summaries(self, subject_num, level_secs, from_secs=0,
+                       to_secs=None):
+        return self.storage_backend.read_summaries(subject_num, level_secs,
+                                                   from_secs, to_secs)
+
+    def read_status_intervals(self, subject_nums=None, statuses=None,
+                              from_secs=None, to_secs=None):
+        return self.storage_backend.read_status_intervals(
+            subject_nums, statuses, from_secs, to_secs)
+
+
+def get_empty_registry_entry():
+    """ Creates the registry entry of a subject with no rows yet (see
+    talk_to_sql_module.write_registry_entry).
+
+        Args: None
+        Returns:
+            registry_entry: dict with the keys num_rows, start_time, end_time
+            and num_days
+    """
+
+    return {'num_rows': 0, 'start_time': None, 'end_time': None,
+            'num_days': 0}
+
+
+def track_registry_entry(subject_chunks, registry_entry):
+    """ Passes on blocks of subject data, updating the registry entry of the
+    subject with each of them.
+
+        Args:
+            subject_chunks: iterable of pandas DataFrames in time order, with
+            the columns date_time and num_days
+            registry_entry: dict: see get_empty_registry_entry
+        Yields:
+            subject_data: pandas DataFrame
+    """
+
+    for subject_data in subject_chunks:
+        if len(subject_data) > 0:
+            date_time = subject_data['date_time']
+            if registry_entry['start_time'] is None:
+                registry_entry['start_time'] = date_time.iloc[0]
+            registry_entry['end_time'] = date_time.iloc[-1]
+            num_days = int(subject_data['num_days'].max())
+            registry_entry['num_days'] = max(registry_entry['num_days'],
+                                             num_days)
+            registry_entry['num_rows'] += len(subject_data)
+        yield subject_data
+
+
+def get_parquet_schema():
+    """ Describes the columns of the parquet dataset and their types.
+
+        Args: None
+        Returns:
+            schema: pyarrow Schema
+    """
+    import pyarrow as pa
+
+    return pa.schema([('subject_num', pa.int16()),
+                      ('num_days', pa.int16()),
+                      ('secs', pa.int32()),
+                      ('meas_sig_str', pa.float32())])
+
+
+def get_storage_backend(storage, engine=None, TABLE_NAME=None,
+                        database_already_existed=True, dataset_path=None):
+    """ Creates the storage backend selected by name.
+
+        Args:
+            storage: str: One of STORAGE_BACKENDS
+            engine, TABLE_NAME, database_already_existed: used by the 'sql'
+            backend
+            dataset_path: str: used by the 'parquet' backend
+        Returns:
+            storage_backend: SqlStorageBackend or ParquetStorageBackend
+    """
+
+    if storage == 'sql':
+        return SqlStorageBackend(engine, TABLE_NAME, database_already_existed)
+    elif storage == 'parquet':
+        return ParquetStorageBackend(dataset_path)
+    else:
+        raise StorageBackendIsUnknownError("storage must be one of "
+                                           "{0}".format(STORAGE_BACKENDS))
+
+
+def read_parquet_dataset(dataset_path, subject_nums=None, num_days=None,
+                         columns=None):
+    """ Reads (part of) a parquet dataset written by ParquetStorageBackend.
+    Only the partitions of the requested subjects and days and the requested
+    columns are read from disk.
+
+        Args:
+            dataset_path: str: Directory of the dataset
+            subject_nums: list of int: Optional, subjects to read, by default
+            all subjects
+            num_days: list of int: Optional, days to read, by default all days
+            columns: list of str: Optional, columns to read, by default all
+            columns
+        Returns:
+            subject_data: pandas DataFrame
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    filters = []
+    if subject_nums is not None:
+        filters.append(('subject_num', 'in', list(subject_nums)))
+    if num_days is not None:
+        filters.append(('num_days', 'in', list(num_days)))
+
+    schema = get_parquet_schema()
+    partitioning = ds.partitioning(
+        pa.schema([schema.field(name) for name in PARTITION_COLUMNS]),
+        flavor='hive')
+    table = pq.read_table(dataset_path, columns=columns,
+                          filters=filters if filters else None,
+                          partitioning=partitioning)
+
+    return table.to_pandas()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module builds the summary levels of the signal written during ingest:
+for every SUMMARY_LEVEL_SECS seconds of a subject (10 s, a minute, 10 minutes
+and an hour) the minimum, maximum, mean and standard deviation of
+meas_sig_str, the number of samples and the fraction of them that were filled
+in because of a gap. Viewing a week of a subject then reads a few thousand
+summary rows instead of the 600k rows of the subjects table.
+
+The bins of every level start at multiples of their length in seconds from
+the start of the recording, and a bin that spans the start of a period is
+split in two, so every summary row belongs to one period (num_days). Seconds
+without a sample (gaps that were not filled) are not counted.
+
+The rows are summarized as they are written, a block at a time: each block
+gives partial sums for the bins of the finest level, and the partial sums of
+a bin split across blocks are added up when the subject is complete. The
+coarser levels are built from the finest one.
+"""
+
+import threading
+import numpy as np
+import pandas as pd
+
+# Lengths (in seconds) of the bins of the summary levels, finest first. Each
+# is a multiple of the previous one:
+SUMMARY_LEVEL_SECS = (10, 60, 600, 3600)
+# Number of points a view is drawn with when no resolution is requested:
+MAX_POINTS = 2000
+# Partial summaries of a subject are added up once there are this many:
+MAX_SUMMARY_PARTS = 64
+
+# Columns of the partial summaries and how they are added up:
+PARTIAL_AGGREGATIONS = {'num_samples': 'sum', 'num_filled': 'sum',
+                        'sum': 'sum', 'sum_squares': 'sum', 'min': 'min',
+                        'max': 'max'}
+# Columns that identify a bin:
+SUMMARY_KEY_COLUMNS = ['subject_num', 'num_days', 'start_secs']
+# Columns of the summaries and their types:
+SUMMARY_DTYPES = {'subject_num': np.int16, 'level_secs': np.int16,
+                  'num_days': np.int16, 'start_secs': np.int32,
+                  'num_samples': np.int16, 'fraction_filled': np.float32,
+                  'min': np.float32, 'max': np.float32, 'mean': np.float32,
+                  'std': np.float32}
+
+
+def summarize_rows(subject_data, level_secs=SUMMARY_LEVEL_SECS[0]):
+    """ Computes the partial summaries of the rows of a block, for the bins
+    of one level.
+
+        Args:
+            subject_data: pandas DataFrame with a secs index or column and the
+            columns subject_num, num_days, meas_sig_str and status (missing in
+            the seconds that were not recorded)
+
+            level_secs: int: Length of the bins
+        Returns:
+            partial_summaries: pandas DataFrame with the columns in
+            SUMMARY_KEY_COLUMNS and PARTIAL_AGGREGATIONS
+    """
+
+    if 'secs' in subject_data.columns:
+        secs = subject_data['secs'].to_numpy(dtype=np.int64)
+    else:
+        secs = subject_data.index.to_numpy(dtype=np.int64)
+    signal = subject_data['meas_sig_str'].to_numpy(dtype=np.float64,
+                                                   na_value=np.nan)
+    has_sample = ~np.isnan(signal)
+    samples = np.where(has_sample, signal, 0.0)
+
+    rows = pd.DataFrame({
+        'subject_num': subject_data['subject_num'].to_numpy(),
+        'num_days': subject_data['num_days'].to_numpy(),
+        'start_secs': secs // level_secs * level_secs,
+        'num_samples': has_sample.astype(np.int64),
+        'num_filled': (has_sample &
+                       subject_data['status'].isna().to_numpy()).astype(
+                           np.int64),
+        'sum': samples,
+        'sum_squares': np.square(samples),
+        'min': signal,
+        'max': signal})
+
+    return add_up_partial_summaries(rows)
+
+
+def add_up_partial_summaries(partial_summaries, level_secs=None):
+    """ Adds up the partial summaries of the same bins, optionally moving them
+    to the (coarser) bins of another level first.
+
+        Args:
+            partial_summaries: pandas DataFrame as returned by summarize_rows
+            level_secs: int: Optional, length of the bins to add up to
+        Returns:
+            partial_summaries: pandas DataFrame, one row per bin
+    """
+
+    if level_secs is not None:
+        partial_summaries = partial_summaries.assign(
+            start_secs=partial_summaries['start_secs'] // level_secs *
+            level_secs)
+
+    return partial_summaries.groupby(
+        SUMMARY_KEY_COLUMNS, sort=False, as_index=False).agg(
+            PARTIAL_AGGREGATIONS)
+
+
+def finish_summaries(partial_summaries, level_secs):
+    """ Turns the partial sums of the bins of a level into summaries.
+
+        Args:
+            partial_summaries: pandas DataFrame, one row per bin (see
+            add_up_partial_summaries)
+            level_secs: int
+        Returns:
+            summaries: pandas DataFrame with the columns in SUMMARY_DTYPES
+    """
+
+    num_samples = partial_summaries['num_samples'].to_numpy(dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = partial_summaries['sum'].to_numpy() / num_samples
+        variance = partial_summaries['sum_squares'].to_numpy() / \
+            num_samples - np.square(mean)
+        fraction_filled = partial_summaries['num_filled'].to_numpy() / \
+            num_samples
+
+    summaries = partial_summaries[SUMMARY_KEY_COLUMNS].copy()
+    summaries.insert(1, 'level_secs', level_secs)
+    summaries['num_samples'] = partial_summaries['num_samples']
+    summaries['fraction_filled'] = fraction_filled
+    summaries['min'] = partial_summaries['min']
+    summaries['max'] = partial_summaries['max']
+    summaries['mean'] = mean
+    # Rounding can make the variance of a constant bin slightly negative:
+    summaries['std'] = np.sqrt(np.maximum(variance, 0.0))
+
+    return summaries.astype(SUMMARY_DTYPES)
+
+
+def build_summary_levels(partial_summaries):
+    """ Builds every summary level from the partial summaries of the finest
+    level.
+
+        Args:
+            partial_summaries: pandas DataFrame as returned by summarize_rows
+        Returns:
+            summaries: pandas DataFrame with the columns in SUMMARY_DTYPES,
+            ordered by subject_num, level_secs and start_secs
+    """
+
+    levels = []
+    for level_secs in SUMMARY_LEVEL_SECS:
+        partial_summaries = add_up_partial_summaries(partial_summaries,
+                                                     level_secs)
+        levels.append(finish_summaries(partial_summaries, level_secs))
+
+    return pd.concat(levels, ignore_index=True).sort_values(
+        ['subject_num', 'level_secs', 'start_secs', 'num_days'],
+        kind='mergesort', ignore_index=True)
+
+
+class SummaryAccumulator(object):
+    """ Collects the partial summaries of the blocks written for each
+    subject, until the subject is complete. Blocks may hold the rows of
+    several subjects, and may be added from several threads.
+    """
+
+    def __init__(self):
+        self.parts = {}
+        self.lock = threading.Lock()
+
+    def add(self, subject_data):
+        """ Summarizes a block of rows.
+
+            Args:
+                subject_data: pandas DataFrame: see summarize_rows
+            Returns: Nothing
+        """
+
+        if len(subject_data) == 0:
+            return
+        partial_summaries = summarize_rows(subject_data)
+        for (subject_num, subject_part) in partial_summaries.groupby(
+                'subject_num', sort=False):
+            with self.lock:
+                parts = self.parts.setdefault(int(subject_num), [])
+                parts.append(subject_part)
+                # Add up the parts of a subject that is written in many
+                # small blocks (e.g. a live recording):
+                if len(parts) >= MAX_SUMMARY_PARTS:
+                    parts[:] = [add_up_partial_summaries(pd.concat(parts))]
+
+    def pop(self, subject_num):
+        """ Builds the summary levels of a subject and forgets its blocks.
+
+            Args:
+                subject_num: int
+            Returns:
+                summaries: pandas DataFrame with the columns in
+                SUMMARY_DTYPES, empty if no rows of the subject were added
+        """
+
+        with self.lock:
+            parts = self.parts.pop(int(subject_num), [])
+        if len(parts) == 0:
+            return pd.DataFrame({column: pd.Series(dtype=dtype) for
+                                 (column, dtype) in SUMMARY_DTYPES.items()})
+
+        return build_summary_levels(pd.concat(parts, ignore_index=True))
+
+
+def choose_summary_level(resolution_secs):
+    """ Picks the coarsest summary level whose bins are no longer than a
+    resolution.
+
+        Args:
+            resolution_secs: float: Seconds per point wanted
+        Returns:
+            level_secs: int, the finest level if every level is coarser
+    """
+
+    levels = [level_secs for level_secs in SUMMARY_LEVEL_SECS
+              if level_secs <= resolution_secs]
+
+    return max(levels, default=SUMMARY_LEVEL_SECS[0])
+
+
+def get_summary(storage_backend, subject_num, from_secs=0, to_secs=None,
+                resolution_secs=None, max_points=MAX_POINTS):
+    """ Reads the summary of a range of seconds of a subject at the coarsest
+    level that meets a resolution, for example to plot a week of subject 2
+    with about 2000 points:
+
+        summary = get_summary(storage_backend, 2, 0, 7 * 86400)
+
+        Args:
+            storage_backend: see storage_backend_module
+
+            subject_num: int
+
+            from_secs: int: First second of the range
+
+            to_secs: int: Optional, the second after the range, by default
+            the end of the recording
+
+            resolution_secs: float: Optional, seconds per point wanted. By
+            default the range is divided into max_points points.
+
+            max_points: int: Used if resolution_secs is not given
+        Returns:
+            summary: pandas DataFrame with the columns in SUMMARY_DTYPES, one
+            row per bin that overlaps the range, ordered by start_secs
+    """
+
+    if resolution_secs is None:
+        if to_secs is None:
+            # The coarsest level is small and shows where the recording ends:
+            coarsest = storage_backend.read_summaries(
+                subject_num, SUMMARY_LEVEL_SECS[-1], from_secs)
+            if len(coarsest) == 0:
+                return coarsest
+            end_secs = int(coarsest['start_secs'].max()) + \
+                SUMMARY_LEVEL_SECS[-1]
+        else:
+            end_secs = to_secs
+        resolution_secs = (end_secs - from_secs) / max_points
+
+    return storage_backend.read_summaries(
+        subject_num, choose_summary_level(resolution_secs), from_secs,
+        to_secs)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module generates synthetic subject data in the format of the recorded
+csv files, for benchmarks and for trying out the pipeline on recordings of
+any length. A synthetic subject folder has a number of csv files that split
+a multi-day 1 Hz recording, with:
+    a signal that is low and quiet at night and higher and noisier in the day
+    a status that changes at night (STATUSES)
+    dropouts: gaps of random length, mostly a few seconds and sometimes
+    longer than MAX_COPY_FILL_SECS
+    garbage rows that repeat the column headers
+    files that overlap their neighbours by a number of seconds
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from sleeposcope_modules.preprocessing_module import LOCAL_TIME_ZONE
+
+# Status of the subject in the day and at night (between NIGHT_START_HOUR and
+# NIGHT_END_HOUR local time):
+STATUSES = ('NO', 'YES')
+NIGHT_START_HOUR = 23
+NIGHT_END_HOUR = 7
+
+# Default start of the synthetic recordings (UTC):
+RECORDING_START = '2017-08-18T10:00:00Z'
+
+
+def generate_subject_folder(subject_folder_path, num_days=1, num_files=4,
+                            dropout_rate=1e-3, mean_dropout_secs=20,
+                            long_dropout_fraction=0.05, header_row_rate=1e-4,
+                            overlap_secs=60, recording_start=RECORDING_START,
+                            time_zone=LOCAL_TIME_ZONE, seed=0):
+    """ Writes the csv files of a synthetic subject.
+
+        Args:
+            subject_folder_path: str: Directory the csv files are written to,
+            created if needed
+
+            num_days: float: Length of the recording in days
+
+            num_files: int: Number of csv files the recording is split into
+
+            dropout_rate: float: Probability that a dropout starts at any
+            recorded second
+
+            mean_dropout_secs: float: Mean length of the short dropouts, which
+            are exponentially distributed
+
+            long_dropout_fraction: float: Fraction of the dropouts that are
+            long (between 5 minutes and 2 hours)
+
+            header_row_rate: float: Probability that a garbage row repeating
+            the column headers follows any row
+
+            overlap_secs: int: Number of seconds each file shares with the
+            next one
+
+            recording_start: str: Time of the first second (UTC)
+
+            time_zone: str: Time zone the night is defined in
+
+            seed: int: Seed of the random numbers, the same seed gives the
+            same files
+        Returns:
+            file_names: list of str: The csv files written
+    """
+
+    random = np.random.default_rng(seed)
+    recording = generate_recording(int(num_days * 86400), dropout_rate,
+                                   mean_dropout_secs, long_dropout_fraction,
+                                   recording_start, time_zone, random)
+
+    os.makedirs(subject_folder_path, exist_ok=True)
+    file_names = []
+    boundaries = np.linspace(0, len(recording), num_files + 1).astype(int)
+    for f in range(num_files):
+        first = max(boundaries[f] - overlap_secs, 0)
+        file_df = recording.iloc[first:boundaries[f + 1]]
+        file_df = add_header_rows(file_df, header_row_rate, random)
+
+        file_name = os.path.join(subject_folder_path,
+                                 'synthetic_{0:03d}.csv'.format(f))
+        file_df.to_csv(file_name, index=False)
+        file_names.append(file_name)
+
+    return file_names
+
+
+def generate_recording(num_secs, dropout_rate=1e-3, mean_dropout_secs=20,
+                       long_dropout_fraction=0.05,
+                       recording_start=RECORDING_START,
+                       time_zone=LOCAL_TIME_ZONE, random=None):
+    """ Generates the rows of a synthetic recording, with its dropouts
+    removed.
+
+        Args:
+            num_secs: int: Length of the recording in seconds
+
+            dropout_rate, mean_dropout_secs, long_dropout_fraction,
+            recording_start, time_zone: see generate_subject_folder
+
+            random: numpy random Generator: Optional
+        Returns:
+            recording: pandas DataFrame with the columns name, time,
+            meas_sig_str and status of the csv files
+    """
+
+    if random is None:
+        random = np.random.default_rng()
+
+    date_time = pd.Timestamp(recording_start) + pd.to_timedelta(
+        np.arange(num_secs), unit='s')
+    local_hours = date_time.tz_convert(time_zone).hour
+    night = (local_hours >= NIGHT_START_HOUR) | (local_hours < NIGHT_END_HOUR)
+
+    # Quiet at night, with occasional movements:
+    level = np.where(night, 60.0, 300.0)
+    noise = np.where(night, 15.0, 80.0)
+    meas_sig_str = level + noise * random.standard_normal(num_secs)
+    movements = random.random(num_secs) < np.where(night, 2e-3, 0.0)
+    meas_sig_str[movements] += 500
+    meas_sig_str = np.clip(np.round(meas_sig_str), 0, None).astype(np.int64)
+
+    recorded = ~get_dropouts(num_secs, dropout_rate, mean_dropout_secs,
+                             long_dropout_fraction, random)
+
+    return pd.DataFrame({
+        'name': 'BioSignal',
+        'time': np.char.add(np.datetime_as_string(
+            date_time[recorded].tz_convert('UTC').tz_localize(None)
+            .to_numpy(), unit='s'), 'Z'),
+        'meas_sig_str': meas_sig_str[recorded],
+        'status': np.where(night, STATUSES[1], STATUSES[0])[recorded]})
+
+
+def get_dropouts(num_secs, dropout_rate=1e-3, mean_dropout_secs=20,
+                 long_dropout_fraction=0.05, random=None):
+    """ Draws the seconds the signal is dropped.
+
+        Args:
+            num_secs: int: Length of the recording in seconds
+
+            dropout_rate, mean_dropout_secs, long_dropout_fraction: see
+            generate_subject_folder
+
+            random: numpy random Generator: Optional
+        Returns:
+            dropped: numpy array of bool, True for the seconds dropped. The
+            first and last seconds are never dropped.
+    """
+
+    if random is None:
+        random = np.random.default_rng()
+
+    dropout_starts = np.flatnonzero(random.random(num_secs) < dropout_rate)
+    dropout_lengths = np.ceil(random.exponential(
+        mean_dropout_secs, len(dropout_starts))).astype(np.int64)
+    long_dropouts = random.random(len(dropout_starts)) < long_dropout_fraction
+    dropout_lengths[long_dropouts] = random.integers(
+        5 * 60 + 1, 2 * 3600, long_dropouts.sum())
+
+    # +1 where a dropout starts and -1 where it ends, the running sum is
+    # positive during dropouts:
+    changes = np.zeros(num_secs + 1, dtype=np.int64)
+    np.add.at(changes, dropout_starts, 1)
+    np.add.at(changes, np.minimum(dropout_starts + dropout_lengths,
+                                  num_secs), -1)
+    dropped = np.cumsum(changes[:-1]) > 0
+    dropped[[0, -1]] = False
+
+    return dropped
+
+
+def add_header_rows(file_df, header_row_rate, random):
+    """ Adds garbage rows that repeat the column headers after random rows.
+
+        Args:
+            file_df: pandas DataFrame with the columns of the csv files
+
+            header_row_rate: float: Probability that a header row follows any
+            row
+
+            random: numpy random Generator
+        Returns:
+            file_df: pandas DataFrame with the header rows
+    """
+
+    after_rows = np.flatnonzero(random.random(len(file_df)) < header_row_rate)
+    if len(after_rows) == 0:
+        return file_df
+
+    header_rows = pd.DataFrame([list(file_df.columns)] * len(after_rows),
+                               columns=file_df.columns)
+    positions = np.concatenate([np.arange(len(file_df)), after_rows + 0.5])
+    file_df = pd.concat([file_df.astype(str), header_rows], ignore_index=True)
+
+    return file_df.iloc[np.argsort(positions, kind='stable')]
@@ -5,19 +5,117 @@
 This module contains functions to connect and write to a PostgresSQL database.
 """
 
+import io
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, \
+    SmallInteger, BigInteger, Float, REAL, Text, String, DateTime, Index, \
+    inspect, select, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy_utils import database_exists, create_database
-from sleeposcope_modules.sanity_check_module import check_engine
+from sleeposcope_modules.sanity_check_module import check_engine, \
+    REGISTRY_TABLE_NAME
 
-def connect_to_sql_database(DB_USER_NAME, DB_PSWD, DB_NAME):
+# Columns of the subjects table and their types, in the order they are
+# written. They are as narrow as the data allows (see
+# preprocessing_module.SUBJECT_DATA_DTYPES). The status is not stored on
+# every second but as intervals (STATUS_INTERVALS_TABLE_NAME):
+TABLE_COLUMNS = [('subject_num', SmallInteger),
+                 ('num_days', SmallInteger),
+                 ('secs', Integer),
+                 ('meas_sig_str', REAL)]
+
+# Lookup table of the status codes in the status intervals table:
+STATUS_CODES_TABLE_NAME = 'status_codes_table'
+
+# Table of the status intervals (see status_interval_module), and its
+# columns; status holds the code of the status in STATUS_CODES_TABLE_NAME.
+# The intervals are looked up by subject, or by status across subjects:
+STATUS_INTERVALS_TABLE_NAME = 'status_intervals_table'
+STATUS_INTERVALS_COLUMNS = [('subject_num', SmallInteger),
+                            ('start_secs', Integer),
+                            ('end_secs', Integer),
+                            ('status', SmallInteger)]
+STATUS_INTERVALS_INDEXES = {'subject': ['subject_num', 'start_secs'],
+                            'status': ['status', 'subject_num', 'start_secs']}
+
+# Columns of the index on the subjects table, which serves the per subject
+# lookups (existence checks, day and second ranges):
+TABLE_INDEX_COLUMNS = ['subject_num', 'num_days', 'secs']
+
+# Number of rows sent to the database at a time:
+WRITE_BATCH_SIZE = 100000
+
+# Table recording which csv files of each subject have been ingested, and its
+# columns (see preprocessing_module.describe_data_file):
+MANIFEST_TABLE_NAME = 'ingested_files_table'
+MANIFEST_COLUMNS = [('subject_num', Integer),
+                    ('file_path', Text),
+                    ('file_size', BigInteger),
+                    ('file_mtime', Float),
+                    ('content_hash', String(64)),
+                    ('first_time', DateTime(timezone=True)),
+                    ('last_time', DateTime(timezone=True))]
+
+# Columns of the subject registry (REGISTRY_TABLE_NAME), one row per subject:
+REGISTRY_COLUMNS = [('subject_num', Integer),
+                    ('num_rows', BigInteger),
+                    ('start_time', DateTime(timezone=True)),
+                    ('end_time', DateTime(timezone=True)),
+                    ('num_days', Integer),
+                    ('ingested_at', DateTime(timezone=True))]
+
+# Table of the features of every epoch of the signal (see
+# feature_extraction_module), and its columns:
+FEATURES_TABLE_NAME = 'epoch_features_table'
+FEATURES_COLUMNS = [('subject_num', SmallInteger),
+                    ('num_days', SmallInteger),
+                    ('epoch_secs', SmallInteger),
+                    ('start_secs', Integer),
+                    ('num_secs', SmallInteger),
+                    ('recorded_fraction', REAL),
+                    ('mean', REAL),
+                    ('variance', REAL),
+                    ('activity_count', SmallInteger),
+                    ('zero_crossings', SmallInteger),
+                    ('power_low', REAL),
+                    ('power_mid', REAL),
+                    ('power_high', REAL)]
+FEATURES_INDEX_COLUMNS = ['subject_num', 'epoch_secs', 'num_days',
+                          'start_secs']
+
+# Table of the summary levels of the signal (see summary_module), and its
+# columns. Bins are looked up by subject, level and time:
+SUMMARIES_TABLE_NAME = 'signal_summaries_table'
+SUMMARIES_COLUMNS = [('subject_num', SmallInteger),
+                     ('level_secs', SmallInteger),
+                     ('num_days', SmallInteger),
+                     ('start_secs', Integer),
+                     ('num_samples', SmallInteger),
+                     ('fraction_filled', REAL),
+                     ('min', REAL),
+                     ('max', REAL),
+                     ('mean', REAL),
+                     ('std', REAL)]
+SUMMARIES_INDEX_COLUMNS = ['subject_num', 'level_secs', 'start_secs']
+
+
+def connect_to_sql_database(DB_USER_NAME, DB_PSWD, DB_NAME, pool_size=None):
     """ Creates a connection to a PostgreSQL database.
 
         Args:
+            DB_USER_NAME, DB_PSWD, DB_NAME: str
+            pool_size: int: Optional, number of connections kept in the
+            engine's pool, for engines shared by several threads
+        Returns:
+            engine: sqlalchemy.engine.base.Engine: Database connection
+            db_already_exists: bool
     """
 
+    pool_options = {} if pool_size is None else {'pool_size': pool_size}
     engine = create_engine(
-            'postgresql://%s:%s@localhost/%s'%(DB_USER_NAME, DB_PSWD, DB_NAME))
+            'postgresql://%s:%s@localhost/%s'%(DB_USER_NAME, DB_PSWD, DB_NAME),
+            **pool_options)
     
     # Check that the connection was established:
     check_engine(engine)
@@ -32,5 +130,665 @@ def connect_to_sql_database(DB_USER_NAME, DB_PSWD, DB_NAME):
     return engine, db_already_exists
 
 
-def write_to_sql_database(subject_data, engine, TABLE_NAME):
-    subject_data.to_sql(TABLE_NAME, engine, if_exists='append')
\ No newline at end of file
+def get_subjects_table(TABLE_NAME, metadata=None):
+    """ Describes the table the subject data is written to.
+
+        Args:
+            TABLE_NAME: str
+            metadata: sqlalchemy MetaData: Optional, the table is added to it
+        Returns:
+            table: sqlalchemy Table
+    """
+
+    if metadata is None:
+        metadata = MetaData()
+
+    return Table(TABLE_NAME, metadata,
+                 *[Column(name, column_type)
+                   for (name, column_type) in TABLE_COLUMNS],
+                 Index('{0}_{1}_idx'.format(TABLE_NAME,
+                                            '_'.join(TABLE_INDEX_COLUMNS)),
+                       *TABLE_INDEX_COLUMNS))
+
+
+def initialize_database(engine, TABLE_NAME):
+    """ Creates the subjects table, its index, the subject registry and the
+    status intervals table if they do not exist. The index is also added to a
+    subjects table created before it was introduced.
+
+        Args:
+            engine: sqlalchemy.engine.base.Engine: Database connection
+            TABLE_NAME: str
+        Returns:
+            None
+    """
+
+    table = get_subjects_table(TABLE_NAME)
+    table.create(engine, checkfirst=True)
+    for index in table.indexes:
+        index.create(engine, checkfirst=True)
+    get_registry_table().create(engine, checkfirst=True)
+    get_status_codes_table().create(engine, checkfirst=True)
+    get_status_intervals_table().create(engine, checkfirst=True)
+
+
+def write_to_sql_database(subject_data, engine, TABLE_NAME,
+                          batch_size=WRITE_BATCH_SIZE):
+    """ Adds subject data to a table, creating the table if it does not exist.
+    All rows are written in a single transaction, in batches of batch_size
+    rows. PostgreSQL databases are bulk loaded with COPY FROM STDIN, other
+    databases with executemany INSERTs.
+
+        Args:
+            subject_data: pandas DataFrame: It has the columns in
+            TABLE_COLUMNS, 'secs' may be its index instead of a column
+            engine: sqlalchemy.engine.base.Engine: Database connection
+            TABLE_NAME: str
+            batch_size: int: Number of rows sent to the database at a time
+        Returns:
+            None
+    """
+
+    subject_data = select_table_columns(subject_data)
+    table = get_subjects_table(TABLE_NAME)
+    table.create(engine, checkfirst=True)
+
+    with engine.begin() as connection:
+        write_rows(subject_data, connection, table, batch_size)
+
+
+def select_table_columns(subject_data):
+    """ Selects the columns of the subjects table from a DataFrame, in table
+    order. The index is never written, so a 'secs' index is turned into a
+    column.
+
+        Args:
+            subject_data: pandas DataFrame
+        Returns:
+            subject_data: pandas DataFrame with the columns in TABLE_COLUMNS
+    """
+
+    if 'secs' not in subject_data.columns:
+        subject_data = subject_data.reset_index()
+
+    return subject_data[[name for (name, column_type) in TABLE_COLUMNS]]
+
+
+def write_rows(subject_data, connection, table, batch_size=WRITE_BATCH_SIZE):
+    """ Writes the rows of a DataFrame to a table in batches, within the
+    transaction of the connection.
+
+        Args:
+            subject_data: pandas DataFrame with the columns of the table
+            connection: sqlalchemy Connection
+            table: sqlalchemy Table
+            batch_size: int: Number of rows sent to the database at a time
+        Returns:
+            None
+    """
+
+    for start in range(0, len(subject_data), batch_size):
+        batch = subject_data.iloc[start:start + batch_size]
+        if connection.dialect.name == 'postgresql':
+            copy_rows(batch, connection, table)
+        else:
+            insert_rows(batch, connection, table)
+
+
+def copy_rows(batch, connection, table):
+    """ Streams rows to a PostgreSQL table with COPY FROM STDIN.
+
+        Args:
+            batch: pandas DataFrame with the columns of the table
+            connection: sqlalchemy Connection to a PostgreSQL database
+            table: sqlalchemy Table
+        Returns:
+            None
+    """
+
+    csv_buffer = io.StringIO()
+    batch.to_csv(csv_buffer, header=False, index=False)
+    csv_buffer.seek(0)
+
+    copy_querry = 'COPY {0} ({1}) FROM STDIN WITH (FORMAT csv)'.format(
+        table.name, ', '.join(batch.columns))
+    # The raw DBAPI connection takes part in the connection's transaction:
+    cursor = connection.connection.cursor()
+    try:
+        if hasattr(cursor, 'copy_expert'):
+            # psycopg2:
+            cursor.copy_expert(copy_querry, csv_buffer)
+        else:
+            # psycopg (3):
+            with cursor.copy(copy_querry) as copy:
+                copy.write(csv_buffer.getvalue())
+    finally:
+        cursor.close()
+
+
+def insert_rows(batch, connection, table):
+    """ Inserts rows to a table with a single executemany.
+
+        Args:
+            batch: pandas DataFrame with the columns of the table
+            connection: sqlalchemy Connection
+            table: sqlalchemy Table
+        Returns:
+            None
+    """
+
+    # NaNs are written as NULLs:
+    batch = batch.astype(object).where(batch.notnull(), None)
+    connection.execute(table.insert(), batch.to_dict('records'))
+
+
+def get_status_codes_table(metadata=None):
+    """ Describes the lookup table of status codes.
+
+        Args:
+            metadata: sqlalchemy MetaData: Optional, the table is added to it
+        Returns:
+            table: sqlalchemy Table
+    """
+
+    if metadata is None:
+        metadata = MetaData()
+
+    return Table(STATUS_CODES_TABLE_NAME, metadata,
+                 Column('status_code', SmallInteger, primary_key=True),
+                 Column('status', Text, nullable=False, unique=True))
+
+
+def get_status_codes(connection, statuses):
+    """ Finds the codes of statuses, adding the statuses that do not have a
+    code yet to the lookup table. A status added at the same time by another
+    connection is read back instead.
+
+        Args:
+            connection: sqlalchemy Connection
+            statuses: iterable of str
+        Returns:
+            status_codes: dict mapping each status to its code
+    """
+
+    table = get_status_codes_table()
+    table.create(connection, checkfirst=True)
+
+    while True:
+        status_codes = dict(connection.execute(
+            select(table.c.status, table.c.status_code)).all())
+        new_statuses = [status for status in statuses
+                        if status not in status_codes]
+        if len(new_statuses) == 0:
+            return status_codes
+
+        next_code = max(status_codes.values(), default=0) + 1
+        try:
+            with connection.begin_nested():
+                connection.execute(table.insert(), [
+                    {'status_code': next_code + i, 'status': status}
+                    for (i, status) in enumerate(new_statuses)])
+        except IntegrityError:
+            continue
+
+
+def encode_status(status, status_codes):
+    """ Replaces statuses by their codes.
+
+        Args:
+            status: pandas Series of str or categorical, missing where the
+            status is unknown
+            status_codes: dict mapping each status to its code
+        Returns:
+            codes: pandas Series of nullable small integers
+    """
+
+    status = status.astype('category')
+    category_codes = np.array([status_codes[category] for category in
+                               status.cat.categories] + [0], dtype=np.int16)
+    # Missing values have category number -1, the extra last code:
+    codes = category_codes[status.cat.codes.to_numpy()]
+
+    return pd.Series(pd.arrays.IntegerArray(codes,
+                                            status.isnull().to_numpy()),
+                     index=status.index, name=status.name)
+
+
+def get_manifest_table(metadata=None):
+    """ Describes the table of ingested files.
+
+        Args:
+            metadata: sqlalchemy MetaData: Optional, the table is added to it
+        Returns:
+            table: sqlalchemy Table
+    """
+
+    if metadata is None:
+        metadata = MetaData()
+
+    return Table(MANIFEST_TABLE_NAME, metadata,
+                 *[Column(name, column_type)
+                   for (name, column_type) in MANIFEST_COLUMNS])
+
+
+def read_manifest(engine, subject_num):
+    """ Reads the ingested files of a subject.
+
+        Args:
+            engine: sqlalchemy.engine.base.Engine: Database connection
+            subject_num: int
+        Returns:
+            manifest: pandas DataFrame with the columns in MANIFEST_COLUMNS,
+            empty if no file of the subject has been ingested. first_time and
+            last_time are in UTC.
+    """
+
+    table = get_manifest_table()
+    if not inspect(engine).has_table(MANIFEST_TABLE_NAME):
+        manifest = pd.DataFrame(columns=table.columns.keys())
+    else:
+        manifest = pd.read_sql_query(
+            select(table).where(table.c.subject_num == subject_num), engine)
+
+    for column in ['first_time', 'last_time']:
+        manifest[column] = pd.to_datetime(manifest[column], utc=True)
+
+    return manifest
+
+
+def write_manifest(manifest, connection):
+    """ Adds ingested files to the table of ingested files, within the
+    transaction of the connection.
+
+        Args:
+            manifest: pandas DataFrame with the columns in MANIFEST_COLUMNS
+            connection: sqlalchemy Connection
+        Returns:
+            None
+    """
+
+    table = get_manifest_table()
+    table.create(connection, checkfirst=True)
+
+    if len(manifest) == 0:
+        return
+    manifest = manifest[table.columns.keys()].copy()
+    for column in ['first_time', 'last_time']:
+        manifest[column] = manifest[column].dt.tz_convert('UTC')
+    connection.execute(table.insert(), manifest.to_dict('records'))
+
+
+def delete_from_manifest(connection, subject_num, file_paths):
+    """ Removes files of a subject from the table of ingested files, within
+    the transaction of the connection.
+
+        Args:
+            connection: sqlalchemy Connection
+            subject_num: int
+            file_paths: list of str
+        Returns:
+            None
+    """
+
+    table = get_manifest_table()
+    if inspect(connection).has_table(MANIFEST_TABLE_NAME):
+        connection.execute(table.delete().where(
+            table.c.subject_num == subject_num,
+            table.c.file_path.in_(list(file_paths))))
+
+
+def read_subject_rows(engine, TABLE_NAME, subject_num, from_secs,
+                      to_secs=None):
+    """ Reads the rows of a subject in a range of seconds.
+
+        Args:
+            engine: sqlalchemy.engine.base.Engine: Database connection
+            TABLE_NAME: str
+            subject_num: int
+            from_secs: int: First second read
+            to_secs: int: Optional, second after the last second read, by
+            default the rows are read to the end of the recording
+        Returns:
+            subject_data: pandas DataFrame indexed by secs
+    """
+
+    table = get_subjects_table(TABLE_NAME)
+    querry = select(table).where(table.c.subject_num == subject_num,
+                                 table.c.secs >= from_secs)
+    if to_secs is not None:
+        querry = querry.where(table.c.secs < to_secs)
+    querry = querry.order_by(table.c.secs)
+
+    return pd.read_sql_query(querry, engine, index_col='secs')
+
+
+def delete_subject_rows(connection, TABLE_NAME, subject_num, from_secs=0):
+    """ Deletes the rows of a subject from a second on, within the transaction
+    of the connection.
+
+        Args:
+            connection: sqlalchemy Connection
+            TABLE_NAME: str
+            subject_num: int
+            from_secs: int: First second deleted, by default all rows of the
+            subject are deleted
+        Returns:
+            None
+    """
+
+    table = get_subjects_table(TABLE_NAME)
+    connection.execute(table.delete().where(table.c.subject_num == subject_num,
+                                            table.c.secs >= from_secs))
+
+
+def get_registry_table(metadata=None):
+    """ Describes the subject registry.
+
+        Args:
+            metadata: sqlalchemy MetaData: Optional, the table is added to it
+        Returns:
+            table: sqlalchemy Table
+    """
+
+    if metadata is None:
+        metadata = MetaData()
+
+    return Table(REGISTRY_TABLE_NAME, metadata,
+                 *[Column(name, column_type, primary_key=(name == 'subject_num'))
+                   for (name, column_type) in REGISTRY_COLUMNS])
+
+
+def read_registry(engine):
+    """ Reads the subject registry.
+
+        Args:
+            engine: sqlalchemy.engine.base.Engine: Database connection
+        Returns:
+            registry: pandas DataFrame with the columns in REGISTRY_COLUMNS,
+            indexed by subject_num. Times are in UTC.
+    """
+
+    table = get_registry_table()
+    if not inspect(engine).has_table(REGISTRY_TABLE_NAME):
+        registry = pd.DataFrame(columns=table.columns.keys())
+    else:
+        registry = pd.read_sql_query(
+            select(table).order_by(table.c.subject_num), engine)
+
+    for column in ['start_time', 'end_time', 'ingested_at']:
+        registry[column] = pd.to_datetime(registry[column], utc=True)
+
+    return registry.set_index('subject_num')
+
+
+def write_registry_entry(connection, subject_num, num_rows, start_time,
+                         end_time, num_days):
+    """ Records a subject in the subject registry, replacing its previous
+    entry, within the transaction of the connection. A subject without rows
+    is removed from the registry.
+
+        Args:
+            connection: sqlalchemy Connection
+            subject_num: int
+            num_rows: int: Number of rows of the subject
+            start_time, end_time: pandas Timestamp: First and last second of
+            the subject (time zone aware)
+            num_days: int: Number of 'days' of the subject
+        Returns:
+            None
+    """
+
+    table = get_registry_table()
+    table.create(connection, checkfirst=True)
+
+    connection.execute(table.delete().where(
+        table.c.subject_num == int(subject_num)))
+    if num_rows > 0:
+        connection.execute(table.insert(), {
+            'subject_num': int(subject_num),
+            'num_rows': int(num_rows),
+            'start_time': start_time.tz_convert('UTC').to_pydatetime(),
+            'end_time': end_time.tz_convert('UTC').to_pydatetime(),
+            'num_days': int(num_days),
+            'ingested_at': pd.Timestamp.now(tz='UTC').to_pydatetime()})
+
+
+def summarize_subject_rows(connection, TABLE_NAME, subject_num):
+    """ Counts the rows of a subject and finds its last second and day.
+
+        Args:
+            connection: sqlalchemy Connection
+            TABLE_NAME: str
+            subject_num: int
+        Returns:
+            num_rows: int
+            last_secs: int or None if the subject has no rows
+            num_days: int or None if the subject has no rows
+    """
+
+    table = get_subjects_table(TABLE_NAME)
+    (num_rows, last_secs, num_days) = connection.execute(
+        select(func.count(), func.max(table.c.secs),
+               func.max(table.c.num_days)).where(
+                   table.c.subject_num == int(subject_num))).one()
+
+    return num_rows, last_secs, num_days
+
+
+def get_features_table(metadata=None):
+    """ Describes the table of epoch features.
+
+        Args:
+            metadata: sqlalchemy MetaData: Optional, the table is added to it
+        Returns:
+            table: sqlalchemy Table
+    """
+
+    if metadata is None:
+        metadata = MetaData()
+
+    return Table(FEATURES_TABLE_NAME, metadata,
+                 *[Column(name, column_type)
+                   for (name, column_type) in FEATURES_COLUMNS],
+                 Index('{0}_idx'.format(FEATURES_TABLE_NAME),
+                       *FEATURES_INDEX_COLUMNS))
+
+
+def write_features(connection, subject_num, features,
+                   batch_size=WRITE_BATCH_SIZE):
+    """ Replaces the epoch features of a subject, within the transaction of
+    the connection. The table and its index are created if they do not exist.
+
+        Args:
+            connection: sqlalchemy Connection
+            subject_num: int
+            features: pandas DataFrame with the columns in FEATURES_COLUMNS
+            batch_size: int: Number of rows sent to the database at a time
+        Returns:
+            None
+    """
+
+    table = get_features_table()
+    table.create(connection, checkfirst=True)
+    for index in table.indexes:
+        index.create(connection, checkfirst=True)
+
+    connection.execute(table.delete().where(
+        table.c.subject_num == subject_num))
+    write_rows(features[table.columns.keys()], connection, table,
+               batch_size)
+
+
+def get_summaries_table(metadata=None):
+    """ Describes the table of signal summaries.
+
+        Args:
+            metadata: sqlalchemy MetaData: Optional, the table is added to it
+        Returns:
+            table: sqlalchemy Table
+    """
+
+    if metadata is None:
+        metadata = MetaData()
+
+    return Table(SUMMARIES_TABLE_NAME, metadata,
+                 *[Column(name, column_type)
+                   for (name, column_type) in SUMMARIES_COLUMNS],
+                 Index('{0}_idx'.format(SUMMARIES_TABLE_NAME),
+                       *SUMMARIES_INDEX_COLUMNS))
+
+
+def write_summaries(connection, subject_num, summaries, from_secs=0):
+    """ Replaces the signal summaries of a subject from a second on, within
+    the transaction of the connection. The table and its index are created
+    if they do not exist.
+
+        Args:
+            connection: sqlalchemy Connection
+            subject_num: int
+            summaries: pandas DataFrame with the columns in SUMMARIES_COLUMNS
+            from_secs: int: First second replaced, a multiple of every
+            summary level. By default all summaries of the subject are
+            replaced.
+        Returns:
+            None
+    """
+
+    table = get_summaries_table()
+    table.create(connection, checkfirst=True)
+    for index in table.indexes:
+        index.create(connection, checkfirst=True)
+
+    connection.execute(table.delete().where(
+        table.c.subject_num == subject_num, table.c.start_secs >= from_secs))
+    write_rows(summaries[table.columns.keys()], connection, table)
+
+
+def read_summaries(engine, subject_num, level_secs, from_secs=0,
+                   to_secs=None):
+    """ Reads the signal summaries of a subject at one level, for the bins
+    that overlap a range of seconds.
+
+        Args:
+            engine: sqlalchemy.engine.base.Engine: Database connection
+            subject_num: int
+            level_secs: int: One of summary_module.SUMMARY_LEVEL_SECS
+            from_secs: int: First second of the range
+            to_secs: int: Optional, the second after the range, by default
+            the end of the recording
+        Returns:
+            summaries: pandas DataFrame with the columns in SUMMARIES_COLUMNS,
+            ordered by start_secs
+    """
+
+    table = get_summaries_table()
+    if not inspect(engine).has_table(SUMMARIES_TABLE_NAME):
+        return pd.DataFrame(columns=table.columns.keys())
+
+    conditions = [table.c.subject_num == subject_num,
+                  table.c.level_secs == level_secs,
+                  table.c.start_secs > from_secs - level_secs]
+    if to_secs is not None:
+        conditions.append(table.c.start_secs < to_secs)
+    querry = select(table).where(*conditions).order_by(table.c.start_secs,
+                                                       table.c.num_days)
+
+    return pd.read_sql_query(querry, engine)
+
+
+def get_status_intervals_table(metadata=None):
+    """ Describes the table of status intervals.
+
+        Args:
+            metadata: sqlalchemy MetaData: Optional, the table is added to it
+        Returns:
+            table: sqlalchemy Table
+    """
+
+    if metadata is None:
+        metadata = MetaData()
+
+    return Table(STATUS_INTERVALS_TABLE_NAME, metadata,
+                 *[Column(name, column_type)
+                   for (name, column_type) in STATUS_INTERVALS_COLUMNS],
+                 *[Index('{0}_{1}_idx'.format(STATUS_INTERVALS_TABLE_NAME,
+                                              index_name), *index_columns)
+                   for (index_name, index_columns) in
+                   STATUS_INTERVALS_INDEXES.items()])
+
+
+def write_status_intervals(connection, subject_num, intervals, from_secs=0):
+    """ Replaces the status intervals of a subject that start from a second
+    on, within the transaction of the connection. The table and its indexes
+    are created if they do not exist.
+
+        Args:
+            connection: sqlalchemy Connection
+            subject_num: int
+            intervals: pandas DataFrame with the columns subject_num,
+            start_secs, end_secs and status (see
+            status_interval_module.find_status_intervals)
+            from_secs: int: Intervals starting before from_secs are kept. By
+            default all intervals of the subject are replaced.
+        Returns:
+            None
+    """
+
+    table = get_status_intervals_table()
+    table.create(connection, checkfirst=True)
+    for index in table.indexes:
+        index.create(connection, checkfirst=True)
+
+    connection.execute(table.delete().where(
+        table.c.subject_num == subject_num, table.c.start_secs >= from_secs))
+
+    # Statuses are written as their codes:
+    status_codes = get_status_codes(connection,
+                                    intervals['status'].dropna().unique())
+    intervals = intervals.assign(
+        status=encode_status(intervals['status'], status_codes))
+    write_rows(intervals[table.columns.keys()], connection, table)
+
+
+def read_status_intervals(engine, subject_nums=None, statuses=None,
+                          from_secs=None, to_secs=None):
+    """ Reads the status intervals that match the filters, for example every
+    interval of the cohort with the status 'YES':
+
+        intervals = read_status_intervals(engine, statuses=['YES'])
+
+        Args:
+            engine: sqlalchemy.engine.base.Engine: Database connection
+            subject_nums: list of int: Optional, by default all subjects
+            statuses: list of str: Optional, by default all statuses
+            from_secs: int: Optional, only intervals that end after it
+            to_secs: int: Optional, only intervals that start before it
+        Returns:
+            intervals: pandas DataFrame with the columns subject_num,
+            start_secs, end_secs and status (as text, None if its code is
+            missing from the status codes table, so that no interval is
+            dropped), ordered by subject_num and start_secs
+    """
+
+    table = get_status_intervals_table()
+    if not inspect(engine).has_table(STATUS_INTERVALS_TABLE_NAME):
+        return pd.DataFrame(columns=table.columns.keys())
+
+    status_codes_table = get_status_codes_table()
+    querry = select(
+        *[column for column in table.columns if column.name != 'status'],
+        status_codes_table.c.status).select_from(table.outerjoin(
+            status_codes_table,
+            table.c.status == status_codes_table.c.status_code))
+    if subject_nums is not None:
+        querry = querry.where(table.c.subject_num.in_(
+            [int(subject_num) for subject_num in subject_nums]))
+    if statuses is not None:
+        querry = querry.where(status_codes_table.c.status.in_(list(statuses)))
+    if from_secs is not None:
+        querry = querry.where(table.c.end_secs > int(from_secs))
+    if to_secs is not None:
+        querry = querry.where(table.c.start_secs < int(to_secs))
+    querry = querry.order_by(table.c.subject_num, table.c.start_secs)
+
+    return pd.read_sql_query(querry, engine)
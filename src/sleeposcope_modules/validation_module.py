@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+This module checks the quality of the subject data. Each csv file is checked
+once, as it is read in (see preprocessing_module.read_data_file), and the
+results are kept in a quality report, so that later steps can rely on the
+report instead of scanning the data again. The report of a subject combines
+the reports of its files with the checks that need all files (e.g. seconds
+recorded in more than one file).
+"""
+
+import numpy as np
+import pandas as pd
+from sleeposcope_modules.sanity_check_module import DataFileIsDefectiveError
+
+# Values of meas_sig_str outside this range are counted as out of range:
+SIGNAL_RANGE = (0, 2 ** 15 - 1)
+
+# Keys of the quality report of a file, in the order they are shown:
+FILE_REPORT_KEYS = ['file_path', 'rejected', 'num_rows', 'num_header_rows',
+                    'num_null_values', 'first_time', 'last_time',
+                    'is_time_sorted', 'num_duplicate_times',
+                    'num_out_of_range_values', 'min_signal', 'max_signal']
+
+
+def describe_file_quality(file_path, raw_file_df):
+    """ Checks a csv file as it was read, before any column is dropped or
+    converted: garbage header rows and null values (in any column, 'name'
+    included). The rest of the report is filled in by describe_file_content
+    once the file has been cleaned up and converted.
+
+        Args:
+            file_path: str: Full or relative path to the csv data file
+
+            raw_file_df: pandas DataFrame as read from the csv data file, with
+            the columns name, time, meas_sig_str and status
+        Returns:
+            file_report: dict with the keys in FILE_REPORT_KEYS
+    """
+
+    num_header_rows = int((raw_file_df['time'] == 'time').sum())
+
+    file_report = dict.fromkeys(FILE_REPORT_KEYS)
+    file_report.update({'file_path': file_path, 'rejected': False,
+                        'num_rows': len(raw_file_df) - num_header_rows,
+                        'num_header_rows': num_header_rows})
+
+    file_report['num_null_values'] = int(sum(
+        raw_file_df[column].isnull().sum() for column in raw_file_df.columns))
+
+    return file_report
+
+
+def describe_file_content(file_report, file_df):
+    """ Adds the checks of a cleaned up and converted csv file to its report:
+    time order, seconds recorded more than once and signal values out of
+    SIGNAL_RANGE. Each column is scanned once.
+
+        Args:
+            file_report: dict: Report returned by describe_file_quality,
+            updated in place
+
+            file_df: pandas DataFrame with the columns meas_sig_str, status
+            and date_time, as returned by read_data_file
+        Returns:
+            file_report: dict with the keys in FILE_REPORT_KEYS
+    """
+
+    file_report.update(describe_time_order(file_df['date_time']))
+
+    signal = file_df['meas_sig_str'].to_numpy(dtype=np.float64,
+                                              na_value=np.nan)
+    if len(signal) > 0:
+        file_report['num_out_of_range_values'] = int(np.count_nonzero(
+            (signal < SIGNAL_RANGE[0]) | (signal > SIGNAL_RANGE[1])))
+        file_report['min_signal'] = np.nanmin(signal)
+        file_report['max_signal'] = np.nanmax(signal)
+
+    return file_report
+
+
+def describe_rejected_file(file_path, num_raw_rows):
+    """ Reports a csv file whose content is not in the expected format, and
+    which is not read in.
+
+        Args:
+            file_path: str: Full or relative path to the csv data file
+
+            num_raw_rows: int: Number of rows read from the file
+        Returns:
+            file_report: dict with the keys in FILE_REPORT_KEYS
+    """
+
+    file_report = dict.fromkeys(FILE_REPORT_KEYS)
+    file_report.update({'file_path': file_path, 'rejected': True,
+                        'num_rows': num_raw_rows})
+
+    return file_report
+
+
+def describe_time_order(date_time):
+    """ Checks that time stamps are in order and counts the seconds recorded
+    more than once.
+
+        Args:
+            date_time: pandas Series of time stamps
+        Returns:
+            time_order: dict with the keys first_time, last_time,
+            is_time_sorted and num_duplicate_times
+    """
+
+    time_order = {'first_time': None, 'last_time': None,
+                  'is_time_sorted': True, 'num_duplicate_times': 0}
+    if len(date_time) == 0:
+        return time_order
+
+    secs = (date_time - date_time.iloc[0]).to_numpy() // np.timedelta64(1, 's')
+    steps = np.diff(secs)
+    time_order['is_time_sorted'] = bool((steps >= 0).all())
+    if not time_order['is_time_sorted']:
+        secs = np.sort(secs)
+        steps = np.diff(secs)
+    time_order['num_duplicate_times'] = int(np.count_nonzero(steps == 0))
+    time_order['first_time'] = date_time.iloc[0] + pd.Timedelta(
+        seconds=int(secs[0]))
+    time_order['last_time'] = date_time.iloc[0] + pd.Timedelta(
+        seconds=int(secs[-1]))
+
+    return time_order
+
+
+def check_file_quality(file_report):
+    """ Raises an exception if a file fails a check that makes its data
+    unusable. Files with null values are defective; other findings are only
+    reported.
+
+        Args:
+            file_report: dict: Report returned by describe_file_quality
+        Returns: Nothing
+    """
+
+    if file_report['num_null_values'] > 0:
+        raise DataFileIsDefectiveError("{0} contains NaNs".format(
+            file_report['file_path']))
+
+
+def describe_subject_quality(file_reports, subject_df):
+    """ Combines the reports of the files of a subject with the checks of
+    their concatenated data.
+
+        Args:
+            file_reports: list of dicts returned by describe_file_quality or
+            describe_rejected_file
+
+            subject_df: pandas DataFrame: The concatenated data of the files
+            that were read in, sorted by date_time
+        Returns:
+            quality_report: dict with the keys:
+                files: pandas DataFrame with one row per file and the columns
+                in FILE_REPORT_KEYS
+                num_files, num_rejected_files, num_rows, num_header_rows,
+                num_null_values, num_out_of_range_values: totals over the files
+                first_time, last_time, is_time_sorted, num_duplicate_times: of
+                the concatenated data (seconds recorded in more than one file
+                are duplicates)
+    """
+
+    files = pd.DataFrame(file_reports, columns=FILE_REPORT_KEYS)
+    read_in = files[~files.rejected.astype(bool)]
+
+    quality_report = {'files': files,
+                      'num_files': len(files),
+                      'num_rejected_files': len(files) - len(read_in)}
+    for key in ['num_rows', 'num_header_rows', 'num_null_values',
+                'num_out_of_range_values']:
+        quality_report[key] = int(read_in[key].fillna(0).sum())
+    quality_report.update(describe_time_order(subject_df['date_time']))
+
+    return quality_report
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run this script from command line, for example to keep ingesting the csv
+files that land in the subject directories:
+
+    'python watch_subject_data.py --data_root "../data/Subject*"'
+    Args:
+        data_root: str: Glob pattern matching the subject directories. The
+        subject number of each directory is the number its name ends in (e.g.
+        Subject12 is subject 12).
+
+        poll_secs: float: Optional, how often the subject directories are
+        checked for new or changed csv files (default 10).
+
+        debounce_secs: float: Optional, how long the csv files of a subject
+        must stay unchanged before they are ingested, so that files still
+        being written are not ingested (default 30).
+
+        retry_secs: float: Optional, how long to wait before ingesting a
+        subject again after it failed with an error that may go away (e.g.
+        the database was unreachable) (default 300). A subject that failed
+        because of its data (see NON_TRANSIENT_ERRORS) is marked failed and
+        is not ingested again until its files change.
+
+        status_path: str: Optional, JSON file the status of the service is
+        written to after every poll (default ../data/ingest_status.json).
+
+        All options of pre_process_subject_data.py (time_zone, num_workers,
+        chunk_secs, ...) apply to every subject. Subjects are always ingested
+        incrementally, so the sql storage is required.
+
+This script runs until it is stopped (Ctrl-C or SIGTERM), keeping the
+interpreter, the libraries and a pooled database engine loaded between
+ingests, instead of starting pre_process_subject_data.py each time new files
+arrive. Every poll_secs it looks at the size and modification time of the
+csv files of every subject. A subject whose files have changed is queued, and
+it is ingested (with --incremental, see pre_process_subject_data.py) once its
+files have not changed for debounce_secs. The status file lists the number of
+subjects queued and, for each subject, how long its oldest change has been
+waiting (its lag), when it was last ingested, its last error and whether it
+has failed for good.
+"""
+
+# Import the following modules:
+
+from pre_process_subject_data import get_argument_parser, check_arguments, \
+    connect_to_storage, pre_process_subject
+from sleeposcope_modules.sanity_check_module import \
+    infer_subject_num_from_subject_files_path, \
+    Subject_num_does_not_match_subject_files_path, SubjectExistsInDBError, \
+    DataFileOrFolderDoesNotExistError, DataFileIsDefectiveError, \
+    DateTimeColumnIsDefectiveError, FileIsNotCorrectDataFileError, \
+    FillMethodIsUnknownError, DuplicatePolicyIsUnknownError, \
+    ValueOutOfRangeError
+from glob import glob
+import pandas as pd
+import threading
+import signal
+import json
+import time
+import os
+
+# global variables
+STATUS_PATH = '../data/ingest_status.json'
+# Errors that ingesting the same files again cannot fix (e.g. a subject
+# ingested before the table of ingested files existed, or a defective file):
+NON_TRANSIENT_ERRORS = (SubjectExistsInDBError,
+                        Subject_num_does_not_match_subject_files_path,
+                        DataFileOrFolderDoesNotExistError,
+                        DataFileIsDefectiveError,
+                        DateTimeColumnIsDefectiveError,
+                        FileIsNotCorrectDataFileError,
+                        FillMethodIsUnknownError,
+                        DuplicatePolicyIsUnknownError, ValueOutOfRangeError)
+
+
+def snapshot_subject_files(subject_files_path):
+    """ Describes the csv files of a subject by their size and modification
+    time, without reading them.
+
+        Args:
+            subject_files_path: str: Directory were subject files are stored
+        Returns:
+            snapshot: dict: (size, modification time) of each csv file
+    """
+
+    snapshot = {}
+    for file_name in glob(os.path.join(subject_files_path, '*.csv')):
+        try:
+            file_stat = os.stat(file_name)
+        except FileNotFoundError:
+            # Removed since it was listed:
+            continue
+        snapshot[file_name] = (file_stat.st_size, file_stat.st_mtime)
+
+    return snapshot
+
+
+def get_empty_subject_status(subject_files_path):
+    """ Creates the status of a subject that has not been seen yet.
+
+        Args:
+            subject_files_path: str: Directory were subject files are stored
+        Returns:
+            subject_status: dict with the keys:
+                subject_files_path
+                snapshot: the files as last seen (see snapshot_subject_files)
+                ingested_snapshot: the files as last ingested
+                changed_at: time the files were last seen to change
+                pending_since: time of the oldest change not ingested yet,
+                None if every change has been ingested
+                retry_at: time a failed subject is ingested again
+                failed: True if the subject failed with one of
+                NON_TRANSIENT_ERRORS, it is not queued until its files change
+                last_ingested_at, last_num_rows, last_secs, last_error:
+                outcome of the last ingest
+            Times are from time.time().
+    """
+
+    return {'subject_files_path': subject_files_path, 'snapshot': None,
+            'ingested_snapshot': None, 'changed_at': None,
+            'pending_since': None, 'retry_at': None, 'failed': False,
+            'last_ingested_at': None, 'last_num_rows': None,
+            'last_secs': None, 'last_error': None}
+
+
+def poll_subjects(data_root, subject_statuses, now):
+    """ Looks for new or changed csv files in every subject directory, and
+    queues the subjects they belong to.
+
+        Args:
+            data_root: str: Glob pattern matching the subject directories
+            subject_statuses: dict: Status of each subject (see
+            get_empty_subject_status) by subject_num, updated
+            now: float: Current time (time.time())
+        Returns: Nothing
+    """
+
+    for path in sorted(glob(data_root)):
+        if not os.path.isdir(path):
+            continue
+        subject_files_path = path.rstrip('/')
+        try:
+            subject_num = infer_subject_num_from_subject_files_path(
+                subject_files_path)
+        except Subject_num_does_not_match_subject_files_path:
+            continue
+        subject_status = subject_statuses.setdefault(
+            subject_num, get_empty_subject_status(subject_files_path))
+
+        snapshot = snapshot_subject_files(subject_files_path)
+        if snapshot != subject_status['snapshot']:
+            subject_status['snapshot'] = snapshot
+            subject_status['changed_at'] = now
+            # A failed subject is tried again as soon as its files change:
+            subject_status['retry_at'] = None
+            subject_status['failed'] = False
+        # Directories without csv files are not queued until files arrive:
+        if snapshot != subject_status['ingested_snapshot'] and \
+                (snapshot or subject_status['ingested_snapshot']) and \
+                subject_status['pending_since'] is None and \
+                not subject_status['failed']:
+            subject_status['pending_since'] = now
+
+
+def get_due_subjects(subject_statuses, debounce_secs, now):
+    """ Finds the queued subjects whose files have not changed for
+    debounce_secs, oldest change first.
+
+        Args:
+            subject_statuses: dict: Status of each subject by subject_num
+            debounce_secs: float
+            now: float: Current time (time.time())
+        Returns:
+            subject_nums: list of int
+    """
+
+    due = [(subject_status['pending_since'], subject_num) for
+           (subject_num, subject_status) in subject_statuses.items()
+           if subject_status['pending_since'] is not None and
+           now - subject_status['changed_at'] >= debounce_secs and
+           (subject_status['retry_at'] is None or
+            now >= subject_status['retry_at'])]
+
+    return [subject_num for (pending_since, subject_num) in sorted(due)]
+
+
+def ingest_subject(subject_num, subject_status, storage_backend, args):
+    """ Ingests the new or changed csv files of a subject, recording the
+    outcome in its status instead of raising an exception. After one of
+    NON_TRANSIENT_ERRORS the subject is marked failed and taken off the queue,
+    after any other error it is tried again in retry_secs.
+
+        Args:
+            subject_num: int
+            subject_status: dict: see get_empty_subject_status, updated
+            storage_backend: see storage_backend_module
+            args: argparse.Namespace: Parsed command line options
+        Returns: Nothing
+    """
+
+    # Files changed after this are ingested next time:
+    snapshot = subject_status['snapshot']
+    start = time.perf_counter()
+    try:
+        subject_status['last_num_rows'] = pre_process_subject(
+            subject_num, subject_status['subject_files_path'],
+            storage_backend, args)
+        subject_status['ingested_snapshot'] = snapshot
+        subject_status['last_error'] = None
+        subject_status['retry_at'] = None
+        if snapshot == snapshot_subject_files(
+                subject_status['subject_files_path']):
+            subject_status['pending_since'] = None
+        else:
+            subject_status['pending_since'] = time.time()
+    except NON_TRANSIENT_ERRORS as error:
+        subject_status['last_error'] = '{0}: {1}'.format(
+            type(error).__name__, error)
+        subject_status['failed'] = True
+        subject_status['retry_at'] = None
+        subject_status['pending_since'] = None
+    except Exception as error:
+        subject_status['last_error'] = '{0}: {1}'.format(
+            type(error).__name__, error)
+        subject_status['retry_at'] = time.time() + args.retry_secs
+    subject_status['last_secs'] = time.perf_counter() - start
+    subject_status['last_ingested_at'] = time.time()
+
+
+def write_status(status_path, subject_statuses, debounce_secs, started_at,
+                 now):
+    """ Writes the status of the service to a JSON file. The file is replaced
+    at once, so readers never see it half written.
+
+        Args:
+            status_path: str
+            subject_statuses: dict: Status of each subject by subject_num
+            debounce_secs: float
+            started_at: float: Time the service started (time.time())
+            now: float: Current time (time.time())
+        Returns: Nothing
+    """
+
+    def format_time(seconds):
+        if seconds is None:
+            return None
+        return pd.Timestamp(seconds, unit='s', tz='UTC').isoformat()
+
+    subjects = {}
+    for (subject_num, subject_status) in sorted(subject_statuses.items()):
+        pending_since = subject_status['pending_since']
+        subjects[str(subject_num)] = {
+            'subject_files_path': subject_status['subject_files_path'],
+            'num_files': len(subject_status['snapshot'] or {}),
+            'queued': pending_since is not None,
+            'failed': subject_status['failed'],
+            'lag_secs': 0.0 if pending_since is None else now - pending_since,
+            'last_ingested_at': format_time(
+                subject_status['last_ingested_at']),
+            'last_num_rows': subject_status['last_num_rows'],
+            'last_secs': subject_status['last_secs'],
+            'last_error': subject_status['last_error']}
+
+    status = {'updated_at': format_time(now),
+              'started_at': format_time(started_at),
+              'queue_depth': sum(subject['queued'] for subject in
+                                 subjects.values()),
+              'num_due': len(get_due_subjects(subject_statuses, debounce_secs,
+                                              now)),
+              'subjects': subjects}
+
+    temp_path = status_path + '.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(status, file, indent=2)
+    os.replace(temp_path, status_path)
+
+
+def main():
+
+    parser = get_argument_parser()
+    parser.add_argument("--data_root", type=str)
+    parser.add_argument("--poll_secs", type=float, default=10)
+    parser.add_argument("--debounce_secs", type=float, default=30)
+    parser.add_argument("--retry_secs", type=float, default=300)
+    parser.add_argument("--status_path", type=str, default=STATUS_PATH)
+    args = parser.parse_args()
+    if args.storage != 'sql':
+        parser.error("the sql storage is required, subjects are ingested "
+                     "incrementally")
+    check_arguments(parser, args)
+    args.incremental = True
+    args.pipelined = False
+
+    # Stop after the current ingest on Ctrl-C or SIGTERM:
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopped.set())
+
+    # Connect once, the engine and its connections are kept between ingests:
+    storage_backend = connect_to_storage(args)
+
+    started_at = time.time()
+    subject_statuses = {}
+    while not stopped.is_set():
+        poll_subjects(args.data_root, subject_statuses, time.time())
+        for subject_num in get_due_subjects(subject_statuses,
+                                            args.debounce_secs, time.time()):
+            if stopped.is_set():
+                break
+            ingest_subject(subject_num, subject_statuses[subject_num],
+                           storage_backend, args)
+            subject_status = subject_statuses[subject_num]
+            print('subject {0:>5}  {1:<6} {2!s:>10} rows {3:>8.1f} s  '
+                  '{4}'.format(subject_num,
+                               'FAILED' if subject_status['last_error']
+                               else 'OK', subject_status['last_num_rows'],
+                               subject_status['last_secs'],
+                               subject_status['last_error'] or ''),
+                  flush=True)
+            write_status(args.status_path, subject_statuses,
+                         args.debounce_secs, started_at, time.time())
+        write_status(args.status_path, subject_statuses, args.debounce_secs,
+                     started_at, time.time())
+        stopped.wait(args.poll_secs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of batch_pre_process_subject_data.py: the subjects of a cohort,
+pre-processed at the same time through one storage backend that limits the
+concurrent writes, are stored as if each was pre-processed on its own.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os.path
+import shutil
+import sys
+import pandas as pd
+import pytest
+import batch_pre_process_subject_data
+from batch_pre_process_subject_data import pre_process_subject_and_report
+from pre_process_subject_data import get_argument_parser, pre_process_subject
+from sleeposcope_modules.storage_backend_module import \
+    ConcurrencyLimitedStorageBackend
+from sleeposcope_modules.synthetic_data_module import generate_subject_folder
+from test_ingest_modes import make_storage_backend, read_stored_subject, \
+    assert_stored_equal
+
+SUBJECT_NUMS = [4, 7]
+
+
+@pytest.fixture(scope='module')
+def file_names(tmp_path_factory):
+    """ The csv files of each subject, 3 per subject. """
+
+    data_path = tmp_path_factory.mktemp('data')
+    file_names = {}
+    for subject_num in SUBJECT_NUMS:
+        subject_files_path = str(data_path / 'Subject{0}'.format(subject_num))
+        file_names[subject_num] = sorted(generate_subject_folder(
+            subject_files_path, num_days=0.2, num_files=3, seed=subject_num))
+
+    return file_names
+
+
+def pre_process_cohort(subject_files_paths, storage_backend, options):
+    args = get_argument_parser().parse_args(options)
+    with ThreadPoolExecutor(max_workers=len(subject_files_paths)) as executor:
+        reports = list(executor.map(
+            lambda path: pre_process_subject_and_report(
+                path, storage_backend, args),
+            subject_files_paths))
+    assert all(report['succeeded'] for report in reports), reports
+
+    return reports
+
+
+def test_incremental_batch_matches_each_subject_on_its_own(tmp_path,
+                                                           file_names):
+    subject_files_paths = [str(tmp_path / 'Subject{0}'.format(subject_num))
+                           for subject_num in SUBJECT_NUMS]
+    storage_backend = ConcurrencyLimitedStorageBackend(
+        make_storage_backend(tmp_path, 'batch'), 1)
+
+    # The first files of every subject, then the last one:
+    for (subject_num, path) in zip(SUBJECT_NUMS, subject_files_paths):
+        os.makedirs(path)
+        for file_name in file_names[subject_num][:2]:
+            shutil.copy(file_name, path)
+    pre_process_cohort(subject_files_paths, storage_backend, ['--incremental'])
+    for (subject_num, path) in zip(SUBJECT_NUMS, subject_files_paths):
+        shutil.copy(file_names[subject_num][2], path)
+    reports = pre_process_cohort(subject_files_paths, storage_backend,
+                                 ['--incremental'])
+
+    full_storage_backend = make_storage_backend(tmp_path, 'full')
+    for (subject_num, path) in zip(SUBJECT_NUMS, subject_files_paths):
+        pre_process_subject(subject_num, path, full_storage_backend,
+                            get_argument_parser().parse_args([]))
+    expected = read_stored_subject(full_storage_backend.engine)
+    assert all(0 < report['num_rows'] < len(expected['rows']) / 2
+               for report in reports)
+    assert_stored_equal(read_stored_subject(storage_backend.engine), expected)
+
+
+def test_cohort_from_the_command_line(tmp_path, file_names, monkeypatch,
+                                      capsys):
+    for (subject_num, subject_file_names) in file_names.items():
+        path = str(tmp_path / 'data' / 'Subject{0}'.format(subject_num))
+        os.makedirs(path)
+        for file_name in subject_file_names:
+            shutil.copy(file_name, path)
+    storage_backend = make_storage_backend(tmp_path, 'cohort')
+    monkeypatch.setattr(batch_pre_process_subject_data, 'connect_to_storage',
+                        lambda args, pool_size: storage_backend)
+    monkeypatch.setattr(sys, 'argv', [
+        'batch_pre_process_subject_data.py', '--data_root',
+        str(tmp_path / 'data' / 'Subject*'), '--chunk_secs', '3600',
+        # SQLite holds one write transaction at a time, from its first block
+        # to the end of the subject:
+        '--num_subject_workers', '1', '--max_concurrent_writes', '1'])
+
+    batch_pre_process_subject_data.main()
+    assert '2 subjects, 2 succeeded, 0 failed' in capsys.readouterr().out
+    registry = read_stored_subject(storage_backend.engine)['registry']
+    assert list(registry.index) == SUBJECT_NUMS
+
+    # Both subjects are already stored:
+    with pytest.raises(SystemExit) as exit_info:
+        batch_pre_process_subject_data.main()
+    assert exit_info.value.code == 1
+    assert '2 subjects, 0 succeeded, 2 failed' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('options', [
+    ['--pipelined'], ['--chunk_secs', '3600', '--pipelined', '--incremental'],
+    ['--incremental', '--storage', 'parquet'], ['--invalidate_cache']])
+def test_options_that_cannot_be_used_together(monkeypatch, options):
+    monkeypatch.setattr(sys, 'argv', ['batch_pre_process_subject_data.py',
+                                      '--data_root', 'Subject*'] + options)
+
+    with pytest.raises(SystemExit) as exit_info:
+        batch_pre_process_subject_data.main()
+
+    assert exit_info.value.code == 2
+
+
+def test_blocks_are_pre_processed_without_a_write_slot(tmp_path):
+    storage_backend = ConcurrencyLimitedStorageBackend(
+        make_storage_backend(tmp_path, 'slots'), 1)
+    slot_was_free = []
+
+    def pre_process_blocks(num_blocks, fail=False):
+        for block_num in range(num_blocks):
+            # A block is pre-processed while no write slot is taken:
+            slot_was_free.append(storage_backend.write_slots.acquire(
+                blocking=False))
+            storage_backend.write_slots.release()
+            yield pd.DataFrame({
+                'subject_num': 4, 'num_days': 1,
+                'secs': range(block_num * 10, block_num * 10 + 10),
+                'meas_sig_str': 100.0, 'status': 'YES',
+                'date_time': pd.Timestamp('2017-08-20 11:00:00', tz='UTC') +
+                pd.to_timedelta(range(10), unit='s')})
+        if fail:
+            raise RuntimeError("failed after the last block")
+
+    assert storage_backend.write_subject(4, pre_process_blocks(3)) == 30
+    assert slot_was_free == [True] * 3
+
+    # The slot is given back when the subject fails:
+    with pytest.raises(RuntimeError):
+        storage_backend.write_subject(5, pre_process_blocks(2, fail=True))
+    assert storage_backend.write_slots.acquire(blocking=False)
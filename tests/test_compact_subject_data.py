@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the compact column types: integers are checked against the range
+of their type, and the signal is stored as the smallest type that holds it.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from sleeposcope_modules.preprocessing_module import compact_subject_data, \
+    compact_signal
+from sleeposcope_modules.sanity_check_module import ValueOutOfRangeError
+
+
+def make_subject_data(**columns):
+    subject_data = pd.DataFrame({'subject_num': [4, 4], 'num_days': [1, 2],
+                                 'secs': [0, 1], 'meas_sig_str': [1.0, 2.0],
+                                 'status': ['YES', 'NO']})
+    for (column, values) in columns.items():
+        subject_data[column] = values
+
+    return subject_data
+
+
+@pytest.mark.parametrize('column, low, high', [
+    ('subject_num', -2 ** 15, 2 ** 15 - 1),
+    ('num_days', -2 ** 15, 2 ** 15 - 1),
+    ('secs', -2 ** 31, 2 ** 31 - 1)])
+def test_integers_just_inside_their_range(column, low, high):
+    subject_data = compact_subject_data(make_subject_data(**{
+        column: [low, high]}))
+
+    assert list(subject_data[column]) == [low, high]
+    assert subject_data['status'].dtype == 'category'
+
+
+@pytest.mark.parametrize('column, values', [
+    ('subject_num', [4, 2 ** 15]), ('subject_num', [-2 ** 15 - 1, 4]),
+    ('num_days', [1, 2 ** 15]), ('secs', [0, 2 ** 31]),
+    ('secs', [-2 ** 31 - 1, 0])])
+def test_integers_just_outside_their_range(column, values):
+    with pytest.raises(ValueOutOfRangeError) as error:
+        compact_subject_data(make_subject_data(**{column: values}))
+
+    assert column in str(error.value)
+
+
+def test_empty_subject_data():
+    subject_data = compact_subject_data(make_subject_data().iloc[:0])
+
+    assert len(subject_data) == 0
+    assert subject_data['secs'].dtype == np.int32
+
+
+@pytest.mark.parametrize('values, dtype', [
+    ([-2 ** 15, 2 ** 15 - 1, np.nan], 'Int16'),
+    ([-2 ** 15 - 1, 0, np.nan], 'Int32'),
+    ([0, 2 ** 15, np.nan], 'Int32'),
+    ([-2 ** 31, 2 ** 31 - 1], 'Int32'),
+    ([0, 2 ** 31], 'float32'),
+    ([-2 ** 31 - 1, 0], 'float32'),
+    ([1.0, 2.5, np.nan], 'float32'),
+    ([np.nan, np.nan], 'Int16'),
+    ([], 'Int16')])
+def test_signal_types(values, dtype):
+    meas_sig_str = pd.Series(values, dtype=np.float64)
+
+    compacted = compact_signal(meas_sig_str)
+
+    assert str(compacted.dtype) == dtype
+    # NaNs become missing values, the others are kept:
+    assert list(compacted.isna()) == list(meas_sig_str.isna())
+    np.testing.assert_allclose(
+        compacted.to_numpy(dtype=np.float64, na_value=np.nan),
+        meas_sig_str.astype(np.float32 if dtype == 'float32' else np.float64))
+
+
+def test_signal_of_subject_data():
+    whole = compact_subject_data(make_subject_data(meas_sig_str=[3.0, np.nan]))
+    interpolated = compact_subject_data(make_subject_data(
+        meas_sig_str=[3.0, 3.25]))
+
+    assert str(whole['meas_sig_str'].dtype) == 'Int16'
+    assert whole['meas_sig_str'].isna().tolist() == [False, True]
+    assert interpolated['meas_sig_str'].dtype == np.float32
+    assert list(interpolated['meas_sig_str']) == [3.0, 3.25]
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the time-stamp conversion of convert_to_local_time: the fixed-format
+parser and its fallback to the flexible parser, against pd.to_datetime.
+"""
+
+import pandas as pd
+import pytest
+from sleeposcope_modules.preprocessing_module import convert_to_local_time, \
+    parse_fixed_format_time_stamps, LOCAL_TIME_ZONE
+from sleeposcope_modules.sanity_check_module import \
+    DateTimeColumnIsDefectiveError
+
+TIME_STAMPS = ['2017-05-25T23:59:59Z', '2017-05-26T00:00:00Z',
+               '2017-11-05T09:30:00Z', '2016-02-29T12:00:01Z']
+
+
+def convert_with_pandas(time_stamps, time_zone=LOCAL_TIME_ZONE):
+    return pd.to_datetime(time_stamps, utc=True, format='mixed').dt.tz_convert(
+        time_zone)
+
+
+def assert_same_times(date_time, expected):
+    assert str(date_time.dt.tz) == str(expected.dt.tz)
+    pd.testing.assert_series_equal(date_time.dt.as_unit('ns'),
+                                   expected.dt.as_unit('ns'),
+                                   check_names=False)
+
+
+@pytest.mark.parametrize('time_zone', [LOCAL_TIME_ZONE, 'Europe/Berlin',
+                                       'UTC'])
+def test_fixed_format(time_zone):
+    time_stamps = pd.Series(TIME_STAMPS, index=[3, 5, 7, 9])
+
+    date_time = convert_to_local_time(time_stamps, time_zone)
+
+    assert_same_times(date_time, convert_with_pandas(time_stamps, time_zone))
+    assert list(date_time.index) == [3, 5, 7, 9]
+
+
+@pytest.mark.parametrize('malformed', [
+    '2017-05-26 00:00:00',            # Space, no time zone
+    '2017-05-26T02:00:00+02:00',      # Offset
+    ' 2017-05-26T00:00:00Z',          # Leading space
+    '2017-05-26T00:00:00.250Z'])      # Fractional seconds
+def test_malformed_rows_fall_back_to_pandas(malformed):
+    time_stamps = pd.Series(TIME_STAMPS[:1] + [malformed] + TIME_STAMPS[1:])
+
+    fixed_format = parse_fixed_format_time_stamps(time_stamps)
+    date_time = convert_to_local_time(time_stamps, 'Europe/Berlin')
+
+    assert fixed_format[1] is pd.NaT
+    assert_same_times(date_time,
+                      convert_with_pandas(time_stamps, 'Europe/Berlin'))
+
+
+def test_fractional_seconds_are_kept():
+    time_stamps = pd.Series(['2017-05-26T00:00:00.250Z',
+                             '2017-05-26T00:00:01Z'])
+
+    date_time = convert_to_local_time(time_stamps, 'UTC')
+
+    assert list(date_time) == [
+        pd.Timestamp('2017-05-26 00:00:00.250', tz='UTC'),
+        pd.Timestamp('2017-05-26 00:00:01', tz='UTC')]
+
+
+def test_rows_that_are_not_ascii():
+    # Every row is handed to the flexible parser, which takes the others:
+    time_stamps = pd.Series(TIME_STAMPS + ['2017-05-26T00:00:00Zé'])
+
+    assert parse_fixed_format_time_stamps(time_stamps).isnull().all()
+    with pytest.raises(DateTimeColumnIsDefectiveError) as error:
+        convert_to_local_time(time_stamps)
+    assert 'in 1 rows' in str(error.value)
+
+
+def test_impossible_dates_in_the_fixed_format():
+    # Every row is handed to the flexible parser, which takes the others:
+    time_stamps = pd.Series(TIME_STAMPS + ['2017-13-01T00:00:00Z'])
+
+    assert parse_fixed_format_time_stamps(time_stamps).isnull().all()
+    with pytest.raises(DateTimeColumnIsDefectiveError) as error:
+        convert_to_local_time(time_stamps)
+    assert 'in 1 rows' in str(error.value)
+    assert '2017-13-01T00:00:00Z' in str(error.value)
+
+
+def test_defective_rows_are_reported():
+    time_stamps = pd.Series(TIME_STAMPS + ['time', 'not a time', '', 'time'])
+
+    with pytest.raises(DateTimeColumnIsDefectiveError) as error:
+        convert_to_local_time(time_stamps)
+
+    assert 'in 4 rows' in str(error.value)
+    assert "['time', 'not a time', '']" in str(error.value)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the period (num_days) boundaries of divide_to_24_hour_periods,
+against the original per-period loop.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from sleeposcope_modules.preprocessing_module import \
+    divide_to_24_hour_periods, get_period_onsets
+
+
+def divide_to_24_hour_periods_with_loop(full_subject_df):
+    """ The original divide_to_24_hour_periods: one mask per period, noon to
+    noon in US/Pacific. A last record exactly on an onset gets no period.
+    """
+
+    date_time = full_subject_df.date_time
+    day_nums = pd.Series(np.nan, index=date_time.index)
+
+    day_onsets = [date_time[0]]
+    end_of_time = date_time[len(date_time) - 1]
+
+    if date_time.loc[0].hour < 12:
+        next_day_onset = pd.to_datetime(str(date_time[0].date()) +
+                                        ' 12:00:00')
+    else:
+        next_day_onset = pd.to_datetime(
+            str(date_time[0].date()) + ' 12:00:00') + pd.Timedelta('24 hours')
+    next_day_onset = next_day_onset.tz_localize('US/Pacific')
+
+    while next_day_onset < end_of_time:
+        day_onsets.append(next_day_onset)
+        next_day_onset = next_day_onset + pd.Timedelta('24 hours')
+
+    for d in range(len(day_onsets)):
+        tomorrow = day_onsets[d + 1] if (d + 1 < len(day_onsets) - 1) \
+            else next_day_onset
+        day_mask = (date_time >= day_onsets[d]) & (date_time < tomorrow)
+        day_nums[day_mask] = d + 1
+
+    return day_nums.to_numpy()
+
+
+def make_recording(first_time, last_time):
+    """ A recording of one record per second from first_time to last_time
+    (included), in US/Pacific.
+    """
+
+    date_time = pd.date_range(pd.Timestamp(first_time, tz='US/Pacific'),
+                              pd.Timestamp(last_time, tz='US/Pacific'),
+                              freq='s')
+
+    return pd.DataFrame({'date_time': date_time,
+                         'meas_sig_str': np.ones(len(date_time))})
+
+
+def test_record_on_a_boundary_starts_the_new_period():
+    full_subject_df = make_recording('2017-08-20 11:59:58',
+                                     '2017-08-21 11:59:58')
+    expected = divide_to_24_hour_periods_with_loop(full_subject_df)
+
+    num_days = divide_to_24_hour_periods(full_subject_df)['num_days']
+
+    assert list(num_days[:4]) == [1, 1, 2, 2]
+    np.testing.assert_array_equal(num_days, expected)
+
+
+def test_recording_ending_on_a_boundary():
+    full_subject_df = make_recording('2017-08-20 08:00:00',
+                                     '2017-08-22 12:00:00')
+    expected = divide_to_24_hour_periods_with_loop(full_subject_df)
+
+    num_days = divide_to_24_hour_periods(full_subject_df)['num_days']
+
+    # The loop left the last record without a period; it is the first
+    # second of period 4:
+    assert np.isnan(expected[-1])
+    assert num_days.iloc[-1] == 4
+    assert num_days.iloc[-2] == 3
+    np.testing.assert_array_equal(num_days[:-1], expected[:-1])
+
+
+@pytest.mark.parametrize('first_time, last_time', [
+    ('2017-08-20 08:00:00', '2017-08-20 09:00:00'),
+    ('2017-08-20 12:00:00', '2017-08-20 20:00:00'),
+    ('2017-08-20 20:00:00', '2017-08-21 11:59:59')])
+def test_recording_shorter_than_one_period(first_time, last_time):
+    full_subject_df = make_recording(first_time, last_time)
+    expected = divide_to_24_hour_periods_with_loop(full_subject_df)
+
+    num_days = divide_to_24_hour_periods(full_subject_df)['num_days']
+
+    assert (num_days == 1).all()
+    np.testing.assert_array_equal(num_days, expected)
+
+
+def test_several_periods_match_the_loop():
+    full_subject_df = make_recording('2017-08-20 17:30:00',
+                                     '2017-08-24 03:10:00')
+    expected = divide_to_24_hour_periods_with_loop(full_subject_df)
+
+    num_days = divide_to_24_hour_periods(full_subject_df)['num_days']
+
+    assert num_days.dtype == np.int32
+    np.testing.assert_array_equal(num_days, expected)
+
+
+def test_period_onsets_include_an_onset_at_the_end():
+    recording_start = pd.Timestamp('2017-08-20 08:00:00', tz='US/Pacific')
+
+    period_onsets = get_period_onsets(
+        recording_start, pd.Timestamp('2017-08-21 12:00:00', tz='US/Pacific'))
+
+    assert list(period_onsets) == [
+        pd.Timestamp('2017-08-20 12:00:00', tz='US/Pacific'),
+        pd.Timestamp('2017-08-21 12:00:00', tz='US/Pacific')]
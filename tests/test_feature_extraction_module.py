@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the epoch features: the features of every epoch against the same
+features computed on its recorded samples one epoch at a time, and of
+extract_epoch_features.py.
+"""
+
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+import extract_epoch_features as extract_epoch_features_script
+from sleeposcope_modules.feature_extraction_module import \
+    get_epoch_features, extract_epoch_features, \
+    extract_features_from_subject_data, extract_features_from_signal_file, \
+    FREQUENCY_BANDS, MIN_RECORDED_FRACTION, ACTIVITY_THRESHOLD
+from sleeposcope_modules.signal_store_module import build_signal_store, \
+    GAP_MASK_VALUES
+from sleeposcope_modules.synthetic_data_module import generate_subject_folder
+from sleeposcope_modules.preprocessing_module import read_data, \
+    fill_missing_data, divide_to_24_hour_periods
+
+
+def make_epochs(num_secs, seed=0):
+    """ A signal with a gap filled in, a gap not filled in and a filled-in
+    epoch, with the mask of its recorded seconds.
+    """
+
+    rng = np.random.default_rng(seed)
+    signal = rng.normal(500, 100, num_secs)
+    gap_mask = np.full(num_secs, GAP_MASK_VALUES['recorded'], dtype=np.uint8)
+    gap_mask[35:45] = GAP_MASK_VALUES['filled']
+    gap_mask[70:80] = GAP_MASK_VALUES['not_filled']
+    signal[70:80] = np.nan
+    gap_mask[90:120] = GAP_MASK_VALUES['filled']
+
+    return signal, gap_mask
+
+
+def get_features_one_epoch_at_a_time(signal, recorded, epoch_length):
+    features = []
+    for start in range(0, len(signal), epoch_length):
+        values = signal[start:start + epoch_length]
+        valid = recorded[start:start + epoch_length] & ~np.isnan(values)
+        (mean, variance) = (values[valid].mean(), values[valid].var()) \
+            if valid.any() else (np.nan, np.nan)
+        pairs = valid[1:] & valid[:-1]
+        centered = values - mean
+        features.append({
+            'num_secs': len(values),
+            'recorded_fraction': valid.sum() / len(values),
+            'mean': mean, 'variance': variance,
+            'activity_count': (pairs & (np.abs(np.diff(values)) >
+                                        ACTIVITY_THRESHOLD)).sum(),
+            'zero_crossings': (pairs & (centered[1:] * centered[:-1] <
+                                        0)).sum()})
+
+    return pd.DataFrame(features)
+
+
+@pytest.mark.parametrize('include_filled', [False, True])
+def test_features_of_the_recorded_samples(include_filled):
+    signal, gap_mask = make_epochs(135)
+    recorded = gap_mask == GAP_MASK_VALUES['recorded']
+    if include_filled:
+        recorded |= gap_mask == GAP_MASK_VALUES['filled']
+    expected = get_features_one_epoch_at_a_time(signal, recorded, 30)
+
+    features = pd.DataFrame(get_epoch_features(signal, recorded, 30))
+
+    # The epochs with a gap, and the last one, shorter:
+    assert list(features.num_secs) == [30, 30, 30, 30, 15]
+    np.testing.assert_allclose(
+        features.recorded_fraction,
+        [1, 1, 20 / 30, 1, 1] if include_filled else
+        [1, 20 / 30, 20 / 30, 0, 1])
+    too_few = expected.recorded_fraction < MIN_RECORDED_FRACTION
+    expected.loc[too_few, ['mean', 'variance', 'activity_count',
+                           'zero_crossings']] = np.nan
+    pd.testing.assert_frame_equal(features[expected.columns], expected,
+                                  check_dtype=False)
+    assert features.loc[too_few, list(FREQUENCY_BANDS)].isnull().all(
+        axis=None)
+
+
+@pytest.mark.parametrize('epoch_length', [30, 31, 60])
+def test_band_powers_add_up_to_the_variance(epoch_length):
+    signal, gap_mask = make_epochs(600, seed=epoch_length)
+    recorded = gap_mask == GAP_MASK_VALUES['recorded']
+
+    features = pd.DataFrame(get_epoch_features(signal, recorded,
+                                               epoch_length))
+
+    band_powers = features[list(FREQUENCY_BANDS)]
+    assert (band_powers.dropna() > 0).all(axis=None)
+    np.testing.assert_allclose(band_powers.sum(axis=1, min_count=1),
+                               features.variance, rtol=1e-9)
+
+
+def test_a_slow_signal_has_its_power_in_the_low_band():
+    # One cycle per minute, 0.017 Hz:
+    secs = np.arange(600)
+    signal = 100 * np.sin(2 * np.pi * secs / 60)
+
+    features = pd.DataFrame(get_epoch_features(
+        signal, np.ones(600, dtype=bool), 60))
+
+    np.testing.assert_allclose(features.power_low, features.variance)
+    np.testing.assert_allclose(features.power_mid, 0, atol=1e-9)
+
+
+def test_epochs_start_at_each_period():
+    signal, gap_mask = make_epochs(250)
+
+    features = extract_epoch_features(signal, gap_mask, [0, 100],
+                                      epoch_secs=(30, 60))
+
+    assert list(features.num_days) == [1] * 4 + [2] * 5 + [1] * 2 + [2] * 3
+    assert list(features.start_secs) == [0, 30, 60, 90, 100, 130, 160, 190,
+                                         220, 0, 60, 100, 160, 220]
+    assert list(features.num_secs) == [30, 30, 30, 10, 30, 30, 30, 30, 30,
+                                       60, 40, 60, 60, 30]
+
+
+def test_features_of_subject_data_match_the_signal_file(tmp_path):
+    subject_files_path = str(tmp_path / 'Subject6')
+    generate_subject_folder(subject_files_path, num_days=0.5, num_files=2,
+                            dropout_rate=5e-3, seed=6)
+    full_subject_df, gap_summary = fill_missing_data(
+        read_data(subject_files_path), return_gap_summary=True)
+    full_subject_df = divide_to_24_hour_periods(full_subject_df)
+    file_path = build_signal_store(6, subject_files_path, str(tmp_path))
+
+    features = extract_features_from_subject_data(full_subject_df,
+                                                  gap_summary, 6)
+
+    assert gap_summary.filled.any()
+    assert full_subject_df.num_days.nunique() == 2
+    assert (features.recorded_fraction < 1).any()
+    # The signal file holds the signal as float32:
+    pd.testing.assert_frame_equal(
+        features, extract_features_from_signal_file(file_path, 6),
+        rtol=1e-4)
+
+
+def test_features_of_the_signal_store_from_the_command_line(tmp_path,
+                                                            monkeypatch):
+    subject_files_path = str(tmp_path / 'Subject6')
+    generate_subject_folder(subject_files_path, num_days=0.2, num_files=1,
+                            seed=6)
+    store_path = str(tmp_path / 'signal_store')
+    file_path = build_signal_store(6, subject_files_path, store_path)
+    dataset_path = str(tmp_path / 'features')
+    monkeypatch.setattr(sys, 'argv', [
+        'extract_epoch_features.py', '--store_path', store_path,
+        '--storage', 'parquet', '--dataset_path', dataset_path])
+
+    extract_epoch_features_script.main()
+
+    features = pd.read_parquet(dataset_path).sort_values(
+        ['epoch_secs', 'num_days', 'start_secs'], ignore_index=True)
+    expected = extract_features_from_signal_file(file_path, 6)
+    assert list(features.start_secs) == list(expected.start_secs)
+    np.testing.assert_allclose(features['mean'], expected['mean'])
+
+
+@pytest.mark.parametrize('options', [['--chunk_secs', '3600'],
+                                     ['--fill_method', 'interpolate']])
+def test_pre_processing_options_are_not_taken(monkeypatch, options):
+    monkeypatch.setattr(sys, 'argv', ['extract_epoch_features.py'] + options)
+
+    with pytest.raises(SystemExit) as exit_info:
+        extract_epoch_features_script.main()
+
+    assert exit_info.value.code == 2
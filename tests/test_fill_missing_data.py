@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the re-indexing of fill_missing_data, against the original one on
+Python sets, and of the policies for seconds recorded more than once.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from test_fill_missing_signal_values import \
+    fill_missing_signal_values_with_loop
+from sleeposcope_modules.preprocessing_module import fill_missing_data
+
+
+def fill_missing_data_with_sets(subject_df):
+    """ The original fill_missing_data: seconds from the first time stamp,
+    re-indexed to range(0, last second), which leaves out the last second
+    (sorted, as pandas no longer re-indexes with a set).
+    """
+
+    secs = subject_df['date_time'] - min(subject_df['date_time'])
+    secs = secs.apply(lambda x: int(x.total_seconds()))
+    subject_df['secs'] = secs
+    subject_df = subject_df.set_index('secs')
+
+    continuous_secs = set(range(0, max(subject_df.index)))
+    full_subject_df = subject_df.reindex(sorted(continuous_secs))
+    missing_secs = np.array(sorted(continuous_secs - set(secs))).astype(int)
+
+    convert_secs_to_time_stamp_vectorized = np.vectorize(
+        lambda x: pd.Timedelta(x, unit='s'))
+    missing_times = min(full_subject_df.date_time) + \
+        convert_secs_to_time_stamp_vectorized(missing_secs)
+    full_subject_df.loc[missing_secs, 'date_time'] = missing_times
+
+    return fill_missing_signal_values_with_loop(full_subject_df, missing_secs)
+
+
+def make_subject_df(num_secs, dropout_rate, seed=0):
+    """ Records of a subject with seconds dropped at random, none in the
+    first 10 minutes.
+    """
+
+    rng = np.random.default_rng(seed)
+    recorded = rng.random(num_secs) >= dropout_rate
+    recorded[:600] = True
+    recorded[-1] = True
+    secs = np.flatnonzero(recorded)
+
+    return pd.DataFrame({
+        'meas_sig_str': rng.integers(0, 1000, len(secs)).astype(float),
+        'status': rng.choice(['YES', 'NO'], len(secs)),
+        'date_time': pd.Timestamp('2017-08-20 11:00:00', tz='US/Pacific') +
+        pd.to_timedelta(secs, unit='s')})
+
+
+def test_matches_the_original_reindexing():
+    subject_df = make_subject_df(20000, 0.05)
+    expected = fill_missing_data_with_sets(subject_df.copy())
+
+    full_subject_df = fill_missing_data(subject_df)
+
+    # The last second of the recording is kept:
+    assert len(full_subject_df) == len(expected) + 1
+    assert list(full_subject_df.index) == list(range(20000))
+    pd.testing.assert_frame_equal(
+        full_subject_df.iloc[:-1][['meas_sig_str', 'status', 'date_time']],
+        expected[['meas_sig_str', 'status', 'date_time']],
+        check_dtype=False, check_index_type=False)
+
+
+@pytest.mark.parametrize('duplicates, expected', [
+    ('first', [10.0, 30.0, 40.0]),
+    ('last', [10.0, 32.0, 40.0]),
+    ('mean', [10.0, 31.0, 40.0])])
+def test_seconds_recorded_more_than_once(duplicates, expected):
+    date_time = pd.Timestamp('2017-08-20 11:00:00', tz='US/Pacific') + \
+        pd.to_timedelta([0, 1, 2, 1, 3], unit='s')
+    subject_df = pd.DataFrame({'meas_sig_str': [10.0, 30.0, 40.0, 32.0, 50.0],
+                               'status': ['YES'] * 5, 'date_time': date_time})
+
+    full_subject_df = fill_missing_data(subject_df, duplicates=duplicates)
+
+    assert list(full_subject_df.index) == [0, 1, 2, 3]
+    assert list(full_subject_df['meas_sig_str'].iloc[:3]) == expected
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the run-length gap engine of fill_missing_signal_values, against
+the original per-block loop.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from sleeposcope_modules.preprocessing_module import \
+    fill_missing_signal_values
+
+
+def fill_missing_signal_values_with_loop(full_subject_df, missing_secs):
+    """ The original fill_missing_signal_values: one group per block of
+    missing seconds, gaps of up to 5 minutes are copied from the segment of
+    the same length before them (groupby no longer takes axis=0).
+    """
+
+    sig_str_df = full_subject_df['meas_sig_str'].to_frame()
+    sig_str_df['newcol'] = 0
+    sig_str_df.loc[missing_secs, 'newcol'] = -1000
+    sig_str_df['block'] = (sig_str_df.newcol.shift(1) != sig_str_df.newcol). \
+        astype(int).cumsum()
+
+    block_groups = sig_str_df.groupby(['block', 'newcol'])
+
+    sig_str_df['copy_sig'] = np.nan
+    for (i, j), group in block_groups:
+        if j == -1000:
+            missing_block_inds = group.index
+            if group.shape[0] <= 5 * 60:
+                shape_filler_ind = missing_block_inds - len(missing_block_inds)
+                filler = np.array(sig_str_df.loc[shape_filler_ind,
+                                                 'meas_sig_str'])
+                sig_str_df.loc[missing_block_inds, 'copy_sig'] = filler
+
+                full_subject_df.loc[missing_secs, 'meas_sig_str'] = \
+                    sig_str_df.loc[missing_secs, 'copy_sig']
+
+    return full_subject_df
+
+
+def make_signal(num_secs, gaps, seed=0):
+    """ A signal of num_secs seconds, NaN in the gaps given as (first missing
+    second, length).
+    """
+
+    rng = np.random.default_rng(seed)
+    meas_sig_str = rng.integers(0, 1000, num_secs).astype(float)
+    for (gap_start, gap_length) in gaps:
+        meas_sig_str[gap_start:gap_start + gap_length] = np.nan
+    full_subject_df = pd.DataFrame({'meas_sig_str': meas_sig_str},
+                                   index=pd.RangeIndex(num_secs, name='secs'))
+
+    return full_subject_df, np.flatnonzero(np.isnan(meas_sig_str))
+
+
+def test_copy_previous_matches_the_loop():
+    # Short and long gaps, gaps on either side of the 5 minute limit and
+    # gaps whose source overlaps an earlier gap:
+    gaps = [(400, 1), (410, 7), (420, 3), (1000, 300), (1700, 301),
+            (2500, 50), (2560, 40), (3000, 2)]
+    full_subject_df, missing_secs = make_signal(4000, gaps)
+    expected = fill_missing_signal_values_with_loop(full_subject_df.copy(),
+                                                    missing_secs)
+
+    filled_df, gap_summary = fill_missing_signal_values(
+        full_subject_df.copy(), missing_secs)
+
+    pd.testing.assert_series_equal(filled_df['meas_sig_str'],
+                                   expected['meas_sig_str'])
+    assert list(gap_summary.start_secs) == [gap[0] for gap in gaps]
+    assert list(gap_summary.length_secs) == [gap[1] for gap in gaps]
+    assert list(gap_summary.filled) == [True, True, True, True, False, True,
+                                        True, True]
+
+
+def test_gap_without_a_whole_source_segment():
+    # The loop failed on such a gap, the seconds before the recording are
+    # NaN:
+    full_subject_df, missing_secs = make_signal(100, [(3, 5)])
+
+    filled_df, gap_summary = fill_missing_signal_values(
+        full_subject_df.copy(), missing_secs)
+
+    signal = full_subject_df['meas_sig_str'].to_numpy()
+    np.testing.assert_array_equal(filled_df['meas_sig_str'].iloc[3:8],
+                                  [np.nan, np.nan, signal[0], signal[1],
+                                   signal[2]])
+
+
+@pytest.mark.parametrize('max_gap_secs', [0, 5, 6])
+def test_interpolate_and_leave_nan(max_gap_secs):
+    full_subject_df, missing_secs = make_signal(50, [(10, 6), (30, 2)])
+    signal = full_subject_df['meas_sig_str'].to_numpy()
+
+    interpolated_df, gap_summary = fill_missing_signal_values(
+        full_subject_df.copy(), missing_secs, max_gap_secs, 'interpolate')
+    left_df, left_summary = fill_missing_signal_values(
+        full_subject_df.copy(), missing_secs, max_gap_secs, 'leave_nan')
+
+    expected = signal.copy()
+    for (gap_start, gap_length) in [(10, 6), (30, 2)]:
+        if gap_length <= max_gap_secs:
+            expected[gap_start:gap_start + gap_length] = np.interp(
+                np.arange(gap_start, gap_start + gap_length),
+                [gap_start - 1, gap_start + gap_length],
+                signal[[gap_start - 1, gap_start + gap_length]])
+    np.testing.assert_allclose(interpolated_df['meas_sig_str'], expected)
+    np.testing.assert_array_equal(left_df['meas_sig_str'], signal)
+    assert not left_summary.filled.any()
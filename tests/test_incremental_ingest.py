@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+End-to-end tests of the incremental ingest (--incremental): after csv files
+of a subject are added, changed or removed, the stored subject must be the
+same as if all of its current files were ingested at once.
+"""
+
+from glob import glob
+import os.path
+import shutil
+import pytest
+from pre_process_subject_data import get_argument_parser, pre_process_subject
+from sleeposcope_modules.synthetic_data_module import generate_subject_folder
+from test_ingest_modes import make_storage_backend, read_stored_subject, \
+    assert_stored_equal, SUBJECT_NUM
+
+
+@pytest.fixture(scope='module')
+def file_names(tmp_path_factory):
+    """ Half a day of recording in 4 csv files overlapping by 10 minutes. """
+
+    subject_files_path = str(tmp_path_factory.mktemp('data') /
+                             'Subject{0}'.format(SUBJECT_NUM))
+
+    return sorted(generate_subject_folder(
+        subject_files_path, num_days=0.5, num_files=4, dropout_rate=3e-3,
+        overlap_secs=600, seed=1))
+
+
+class IncrementalSubject(object):
+    """ A subject folder ingested incrementally, checked against a full
+    ingest of the same folder after every change.
+    """
+
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+        self.subject_files_path = str(tmp_path / 'incremental' /
+                                      'Subject{0}'.format(SUBJECT_NUM))
+        os.makedirs(self.subject_files_path)
+        self.storage_backend = make_storage_backend(tmp_path, 'incremental')
+        self.num_full_ingests = 0
+
+    def get_file_names(self):
+        return sorted(glob(os.path.join(self.subject_files_path, '*.csv')))
+
+    def ingest(self):
+        """ Ingests the changes and checks the stored subject.
+
+            Returns:
+                num_rows: int: Number of rows rewritten
+        """
+
+        num_rows = pre_process_subject(
+            SUBJECT_NUM, self.subject_files_path, self.storage_backend,
+            get_argument_parser().parse_args(['--incremental']))
+
+        self.num_full_ingests += 1
+        full_storage_backend = make_storage_backend(
+            self.tmp_path, 'full_{0}'.format(self.num_full_ingests))
+        pre_process_subject(SUBJECT_NUM, self.subject_files_path,
+                            full_storage_backend,
+                            get_argument_parser().parse_args([]))
+        assert_stored_equal(read_stored_subject(self.storage_backend.engine),
+                            read_stored_subject(full_storage_backend.engine))
+
+        return num_rows
+
+
+def test_files_added_one_at_a_time(tmp_path, file_names):
+    subject = IncrementalSubject(tmp_path)
+
+    num_rows = []
+    for file_name in file_names:
+        shutil.copy(file_name, subject.subject_files_path)
+        num_rows.append(subject.ingest())
+    num_stored_rows = len(read_stored_subject(
+        subject.storage_backend.engine)['rows'])
+
+    # Only the rows from the new file on are rewritten:
+    assert num_rows[0] == len(read_stored_subject(
+        make_storage_backend(tmp_path, 'full_1').engine)['rows'])
+    assert all(n < num_stored_rows / 2 for n in num_rows[1:])
+    # Nothing changed:
+    assert subject.ingest() == 0
+
+
+def test_files_changed_and_removed(tmp_path, file_names):
+    subject = IncrementalSubject(tmp_path)
+    for file_name in file_names:
+        shutil.copy(file_name, subject.subject_files_path)
+    subject.ingest()
+
+    # The last file shrinks, then grows back:
+    last_file_name = subject.get_file_names()[-1]
+    with open(last_file_name) as file:
+        lines = file.readlines()
+    with open(last_file_name, 'w') as file:
+        file.writelines(lines[:len(lines) // 2])
+    subject.ingest()
+    with open(last_file_name, 'w') as file:
+        file.writelines(lines)
+    subject.ingest()
+
+    # A file in the middle is removed, then restored:
+    os.remove(subject.get_file_names()[1])
+    subject.ingest()
+    shutil.copy(file_names[1], subject.subject_files_path)
+    subject.ingest()
+
+    # The first file is removed, the recording starts later:
+    os.remove(subject.get_file_names()[0])
+    subject.ingest()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+End-to-end tests of the ways a subject can be ingested: a synthetic subject
+(see synthetic_data_module) stored in an SQLite database must read back the
+same whether it was pre-processed as a whole recording, in blocks of time,
+pipelined or one sample at a time from a live feed, and stored in a parquet
+dataset it must read back the same as from the database.
+"""
+
+import asyncio
+from glob import glob
+import os.path
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+import pre_process_subject_data
+from pre_process_subject_data import get_argument_parser, \
+    pre_process_subject, TABLE_NAME
+from sleeposcope_modules.synthetic_data_module import generate_subject_folder
+from sleeposcope_modules.storage_backend_module import SqlStorageBackend, \
+    ParquetStorageBackend, read_parquet_dataset
+from sleeposcope_modules.talk_to_sql_module import initialize_database, \
+    read_registry, read_status_intervals, read_summaries
+from sleeposcope_modules.read_from_sql_module import iterate_rows, \
+    BLOCK_COLUMNS, BLOCK_DTYPES
+from sleeposcope_modules.status_interval_module import label_time_ranges
+from sleeposcope_modules.summary_module import SUMMARY_DTYPES
+from sleeposcope_modules.preprocessing_module import read_data, \
+    fill_missing_data, fill_missing_data_in_chunks, compact_subject_data
+from sleeposcope_modules.online_processing_module import process_stream, \
+    MicroBatchWriter, END_OF_STREAM
+from sleeposcope_modules.sanity_check_module import SubjectExistsInDBError
+
+SUBJECT_NUM = 4
+
+
+@pytest.fixture(scope='module')
+def subject_files_path(tmp_path_factory):
+    """ Half a day of recording (across noon) in 3 overlapping csv files,
+    with dropouts short and long and garbage header rows.
+    """
+
+    subject_files_path = str(tmp_path_factory.mktemp('data') /
+                             'Subject{0}'.format(SUBJECT_NUM))
+    generate_subject_folder(subject_files_path, num_days=0.5, num_files=3,
+                            dropout_rate=5e-3, header_row_rate=1e-3, seed=3)
+
+    return subject_files_path
+
+
+def make_storage_backend(tmp_path, name, storage='sql'):
+    if storage == 'parquet':
+        return ParquetStorageBackend(str(tmp_path / name))
+
+    engine = create_engine('sqlite:///{0}'.format(tmp_path /
+                                                  '{0}.db'.format(name)))
+    initialize_database(engine, TABLE_NAME)
+
+    return SqlStorageBackend(engine, TABLE_NAME)
+
+
+def read_stored_subject(engine):
+    """ Everything stored for the subject: its rows (with their status), its
+    registry entry (but the time it was written), status intervals and 1
+    minute summaries.
+    """
+
+    return {'rows': pd.concat([pd.DataFrame()] + list(iterate_rows(
+                engine, TABLE_NAME)), ignore_index=True),
+            'registry': read_registry(engine).drop(columns='ingested_at'),
+            'intervals': read_status_intervals(engine),
+            'summaries': read_summaries(engine, SUBJECT_NUM, 60)}
+
+
+def read_stored_parquet_subject(storage_backend):
+    """ Everything stored for the subject in a parquet dataset, as
+    read_stored_subject reads it from the database. The dataset has no
+    registry.
+    """
+
+    intervals = storage_backend.read_status_intervals()
+    if glob(os.path.join(storage_backend.dataset_path, 'subject_num=*')):
+        rows = read_parquet_dataset(storage_backend.dataset_path)
+        rows = rows.sort_values(['subject_num', 'num_days', 'secs'],
+                                ignore_index=True)
+        rows['status'] = label_time_ranges(
+            intervals, rows.rename(columns={'secs': 'start_secs'}))['status']
+        rows = rows[BLOCK_COLUMNS].astype({
+            column: BLOCK_DTYPES[column] for column in BLOCK_COLUMNS
+            if column != 'status'})
+    else:
+        rows = pd.DataFrame()
+
+    # With the wider types of the database columns:
+    summaries = storage_backend.read_summaries(SUBJECT_NUM, 60).astype(
+        {column: np.int64 if np.issubdtype(dtype, np.integer) else np.float64
+         for (column, dtype) in SUMMARY_DTYPES.items()})
+
+    return {'rows': rows,
+            'intervals': intervals.astype(
+                {'subject_num': 'int64', 'start_secs': 'int64',
+                 'end_secs': 'int64'}),
+            'summaries': summaries}
+
+
+def ingest(tmp_path, subject_files_path, options, storage='sql'):
+    storage_backend = make_storage_backend(
+        tmp_path, '_'.join(options + [storage]), storage)
+    num_rows = pre_process_subject(SUBJECT_NUM, subject_files_path,
+                                   storage_backend,
+                                   get_argument_parser().parse_args(options))
+
+    if storage == 'parquet':
+        stored = read_stored_parquet_subject(storage_backend)
+    else:
+        stored = read_stored_subject(storage_backend.engine)
+    assert num_rows == len(stored['rows'])
+
+    return stored
+
+
+@pytest.fixture(scope='module')
+def whole_recordings(tmp_path_factory, subject_files_path):
+    """ The subject stored as a whole recording, with each fill method. """
+
+    tmp_path = tmp_path_factory.mktemp('whole')
+
+    return {fill_method: ingest(tmp_path, subject_files_path,
+                                ['--fill_method', fill_method])
+            for fill_method in ['copy_previous', 'interpolate']}
+
+
+def assert_stored_equal(stored, expected):
+    for (key, value) in stored.items():
+        pd.testing.assert_frame_equal(value, expected[key], obj=key)
+
+
+@pytest.mark.parametrize('fill_method', ['copy_previous', 'interpolate'])
+# The whole recording, blocks shorter than the longest gap filled, and
+# longer:
+@pytest.mark.parametrize('options, storage', [
+    ([], 'parquet'),
+    (['--chunk_secs', '250'], 'sql'),
+    (['--chunk_secs', '3600'], 'sql'),
+    (['--chunk_secs', '3600'], 'parquet'),
+    (['--chunk_secs', '3600', '--pipelined', '--queue_size', '1'], 'sql'),
+    (['--chunk_secs', '3600', '--pipelined', '--queue_size', '1'], 'parquet'),
+    (['--chunk_secs', '7200', '--num_workers', '2'], 'sql')])
+def test_blocks_of_time_match_the_whole_recording(tmp_path,
+                                                  subject_files_path,
+                                                  whole_recordings,
+                                                  fill_method, options,
+                                                  storage):
+    expected = whole_recordings[fill_method]
+
+    stored = ingest(tmp_path, subject_files_path,
+                    options + ['--fill_method', fill_method], storage)
+
+    assert expected['rows'].secs.is_monotonic_increasing
+    assert expected['rows'].meas_sig_str.isnull().any()
+    assert expected['rows'].num_days.max() == 2
+    assert_stored_equal(stored, expected)
+
+
+@pytest.mark.parametrize('fill_method', ['copy_previous', 'interpolate'])
+@pytest.mark.parametrize('chunk_secs', [7, 60, 299])
+def test_gaps_filled_in_blocks_match_the_whole_recording(subject_files_path,
+                                                         fill_method,
+                                                         chunk_secs):
+    # Blocks much shorter than the gaps, where the source of a gap at the
+    # start of a block lies in several blocks before it:
+    subject_df = read_data(subject_files_path)
+    subject_df = subject_df[subject_df.date_time < subject_df.date_time.min() +
+                            pd.Timedelta(hours=2)]
+    expected = fill_missing_data(subject_df, max_gap_secs=60,
+                                 fill_method=fill_method)
+
+    block_nums = (subject_df.date_time - subject_df.date_time.min()) // \
+        pd.Timedelta(seconds=chunk_secs)
+    full_subject_df = pd.concat(fill_missing_data_in_chunks(
+        [block for (block_num, block) in subject_df.groupby(block_nums)],
+        max_gap_secs=60, fill_method=fill_method))
+
+    assert expected.meas_sig_str.isnull().any()
+    pd.testing.assert_frame_equal(full_subject_df, expected)
+
+
+@pytest.mark.parametrize('storage', ['sql', 'parquet'])
+@pytest.mark.parametrize('options', [
+    [], ['--chunk_secs', '3600'], ['--chunk_secs', '3600', '--pipelined']])
+def test_failure_stores_nothing(tmp_path, subject_files_path, monkeypatch,
+                                options, storage):
+    compact_subject_data = pre_process_subject_data.compact_subject_data
+    calls = []
+
+    def fail_on_second_block(subject_data):
+        calls.append(len(subject_data))
+        if len(calls) == 2:
+            raise RuntimeError("failed on the second block")
+        return compact_subject_data(subject_data)
+
+    monkeypatch.setattr(pre_process_subject_data, 'compact_subject_data',
+                        fail_on_second_block)
+    storage_backend = make_storage_backend(tmp_path, 'failed', storage)
+    # The whole recording is a single block:
+    if len(options) == 0:
+        calls.append(0)
+
+    with pytest.raises(RuntimeError):
+        pre_process_subject(SUBJECT_NUM, subject_files_path, storage_backend,
+                            get_argument_parser().parse_args(options))
+
+    if storage == 'parquet':
+        stored = read_stored_parquet_subject(storage_backend)
+        # Nor is the staged subject left behind:
+        assert glob(os.path.join(storage_backend.dataset_path, '.*')) == []
+    else:
+        stored = read_stored_subject(storage_backend.engine)
+        assert len(stored['registry']) == 0
+    assert len(stored['rows']) == 0
+    assert len(stored['intervals']) == 0
+    assert len(stored['summaries']) == 0
+
+
+def test_parquet_dataset_is_read_by_partition(tmp_path, subject_files_path,
+                                              whole_recordings):
+    storage_backend = make_storage_backend(tmp_path, 'dataset', 'parquet')
+    pre_process_subject(SUBJECT_NUM, subject_files_path, storage_backend,
+                        get_argument_parser().parse_args([]))
+    expected = whole_recordings['copy_previous']['rows']
+
+    # Only the files of the second period are read:
+    rows = read_parquet_dataset(storage_backend.dataset_path, [SUBJECT_NUM],
+                                [2], ['secs', 'meas_sig_str'])
+    assert list(rows.columns) == ['secs', 'meas_sig_str']
+    np.testing.assert_array_equal(
+        rows.sort_values('secs').meas_sig_str,
+        expected[expected.num_days == 2].meas_sig_str)
+    assert len(read_parquet_dataset(storage_backend.dataset_path,
+                                    [SUBJECT_NUM + 1])) == 0
+
+    # The subject is not written twice, and the intervals are filtered:
+    with pytest.raises(SubjectExistsInDBError):
+        pre_process_subject(SUBJECT_NUM, subject_files_path, storage_backend,
+                            get_argument_parser().parse_args([]))
+    intervals = storage_backend.read_status_intervals(
+        [SUBJECT_NUM], ['NO'], from_secs=3600, to_secs=7200)
+    expected_intervals = whole_recordings['copy_previous']['intervals']
+    expected_intervals = expected_intervals[
+        (expected_intervals.status == 'NO') &
+        (expected_intervals.end_secs > 3600) &
+        (expected_intervals.start_secs < 7200)]
+    assert list(intervals.start_secs) == list(expected_intervals.start_secs)
+
+
+def test_parquet_blocks_with_other_signal_types(tmp_path):
+    # A block of whole numbers is compacted to Int16, the next to float32:
+    storage_backend = make_storage_backend(tmp_path, 'types', 'parquet')
+    blocks = [compact_subject_data(pd.DataFrame({
+        'subject_num': SUBJECT_NUM, 'num_days': 1, 'secs': secs,
+        'meas_sig_str': meas_sig_str, 'status': 'YES'}))
+        for (secs, meas_sig_str) in [(range(0, 3), [1.0, 2.0, np.nan]),
+                                     (range(3, 6), [1.5, 2.0, 3.0])]]
+    assert [str(block.meas_sig_str.dtype) for block in blocks] == \
+        ['Int16', 'float32']
+    for block in blocks:
+        storage_backend.write(block)
+
+    rows = read_parquet_dataset(storage_backend.dataset_path)
+
+    assert rows.meas_sig_str.dtype == np.float32
+    np.testing.assert_array_equal(rows.sort_values('secs').meas_sig_str,
+                                  [1.0, 2.0, np.nan, 1.5, 2.0, 3.0])
+
+
+@pytest.mark.parametrize('naive_time_stamps', [False, True])
+def test_live_feed_matches_the_whole_recording(tmp_path, subject_files_path,
+                                               whole_recordings, monkeypatch,
+                                               naive_time_stamps):
+    # The csv files are sent one after the other, as a single feed:
+    lines = []
+    for file_name in sorted(glob(os.path.join(subject_files_path, '*.csv'))):
+        with open(file_name) as file:
+            lines += file.readlines()
+    lines.append(END_OF_STREAM)
+    if naive_time_stamps:
+        # Time-stamps without a time zone are in UTC, wherever the server
+        # runs:
+        lines = [line.replace('Z,', ',') for line in lines]
+        monkeypatch.setenv('TZ', 'Asia/Kolkata')
+        time.tzset()
+
+    async def iterate_lines():
+        for line in lines:
+            yield line
+
+    async def stream(storage_backend):
+        writer = MicroBatchWriter(storage_backend, batch_rows=5000)
+        return await process_stream(SUBJECT_NUM, iterate_lines(), writer)
+
+    storage_backend = make_storage_backend(tmp_path, 'live')
+    processor = asyncio.run(stream(storage_backend))
+
+    stored = read_stored_subject(storage_backend.engine)
+    assert processor.counters['late_samples'] > 0
+    assert_stored_equal(stored, whole_recordings['copy_previous'])
+
+
+@pytest.fixture(autouse=True)
+def restore_time_zone():
+    # Once monkeypatch has put TZ back:
+    yield
+    time.tzset()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the measurements of the stages of the pipeline.
+"""
+
+import pandas as pd
+from sleeposcope_modules import instrumentation_module
+from sleeposcope_modules.instrumentation_module import PipelineMetrics
+
+
+def merge_pairs(chunks):
+    """ A stage that takes two blocks for each block it yields. """
+
+    chunks = iter(chunks)
+    for chunk in chunks:
+        yield pd.concat([chunk, next(chunks, None)]).iloc[:1]
+
+
+def test_measure_chunks_counts_rows_in_and_out():
+    metrics = PipelineMetrics()
+    chunks = [pd.DataFrame({'secs': range(n)}) for n in [3, 4, 5]]
+
+    out_chunks = list(metrics.measure_chunks('merge_pairs', merge_pairs(
+        metrics.count_rows_in(chunks))))
+
+    record = metrics.records['merge_pairs']
+    assert len(out_chunks) == 2
+    assert record.calls == 3
+    assert record.rows_in == 12
+    assert record.rows_out == 2
+
+
+def test_peak_memory_is_in_bytes_on_every_platform(monkeypatch):
+    class Usage(object):
+        ru_maxrss = 1000
+
+    monkeypatch.setattr(instrumentation_module.resource, 'getrusage',
+                        lambda who: Usage())
+
+    monkeypatch.setattr(instrumentation_module.sys, 'platform', 'linux')
+    assert instrumentation_module.get_peak_memory_bytes() == 1024000
+    monkeypatch.setattr(instrumentation_module.sys, 'platform', 'darwin')
+    assert instrumentation_module.get_peak_memory_bytes() == 1000
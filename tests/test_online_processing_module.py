@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the live feeds of process_stream: a feed that is dropped and
+continued gives the same rows as one that is not, and the final rows of a
+feed that fails are written.
+"""
+
+import asyncio
+import pandas as pd
+import pytest
+from sleeposcope_modules.online_processing_module import process_stream, \
+    MicroBatchWriter, END_OF_STREAM
+
+
+class MemoryStorageBackend(object):
+    """ Keeps the rows written and the subjects registered. """
+
+    def __init__(self):
+        self.batches = []
+        self.registry = {}
+
+    def write(self, subject_data):
+        self.batches.append(subject_data)
+
+    def register_subject(self, subject_num, **registry_entry):
+        self.registry[subject_num] = registry_entry
+
+    def get_rows(self):
+        return pd.concat(self.batches, ignore_index=True).sort_values(
+            ['subject_num', 'secs'], ignore_index=True)
+
+
+async def iterate_lines(lines, fail_after=None):
+    for (l, line) in enumerate(lines):
+        if l == fail_after:
+            raise ConnectionResetError("connection reset by peer")
+        yield line
+
+
+def make_lines(num_secs):
+    """ Lines of a live csv feed of num_secs seconds, with a gap. """
+
+    lines = ['name,time,meas_sig_str,status']
+    for sec in range(num_secs):
+        if 20 <= sec < 25:
+            continue
+        time_stamp = pd.Timestamp('2017-08-20 18:00:00') + pd.Timedelta(
+            seconds=sec)
+        lines.append('sensor,{0}Z,{1},0'.format(
+            time_stamp.strftime('%Y-%m-%dT%H:%M:%S'), 100 + sec % 7))
+
+    return lines
+
+
+def stream_feeds(feeds):
+    """ Streams the feeds of subject 3 one after the other, as connections
+    of the same subject, and returns the storage backend.
+    """
+
+    async def stream():
+        writer = MicroBatchWriter(MemoryStorageBackend(), flush_secs=60)
+        for feed in feeds:
+            processor = writer.reserve_subject(3)
+            try:
+                await process_stream(3, feed, writer, processor,
+                                     max_gap_secs=10)
+            except ConnectionResetError:
+                pass
+            finally:
+                writer.release_subject(3)
+        return writer.storage_backend
+
+    return asyncio.run(stream())
+
+
+def test_dropped_feed_continues_when_the_subject_reconnects():
+    lines = make_lines(100)
+    whole = stream_feeds([iterate_lines(lines + [END_OF_STREAM])])
+
+    continued = stream_feeds([iterate_lines(lines[:40]),
+                              iterate_lines(lines[40:] + [END_OF_STREAM])])
+
+    pd.testing.assert_frame_equal(continued.get_rows(), whole.get_rows())
+    assert continued.registry == whole.registry
+    assert whole.registry[3]['num_rows'] == 100
+
+
+def test_dropped_feed_is_not_registered():
+    storage_backend = stream_feeds([iterate_lines(make_lines(100))])
+
+    assert storage_backend.registry == {}
+    # Rows that were final are written:
+    assert len(storage_backend.get_rows()) == 95
+
+
+def test_final_rows_of_a_failed_feed_are_written():
+    lines = make_lines(100)
+
+    storage_backend = stream_feeds([iterate_lines(lines, fail_after=60)])
+
+    # The header and 59 samples arrived, up to second 63 (5 seconds are
+    # missing), the rows up to max_delay_secs before it are final:
+    assert storage_backend.registry == {}
+    assert list(storage_backend.get_rows().secs) == list(range(59))
+
+
+def test_a_subject_cannot_stream_twice():
+    writer = MicroBatchWriter(MemoryStorageBackend())
+    writer.reserve_subject(3)
+
+    with pytest.raises(ValueError):
+        writer.reserve_subject(3)
+    writer.release_subject(3)
+    writer.reserve_subject(3)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the cache of pre-processed subjects: a subject read from the cache
+is the same as one pre-processed again, and the cache is not used once the
+csv files or the parameters have changed.
+"""
+
+import os.path
+import pandas as pd
+import pytest
+from sleeposcope_modules.synthetic_data_module import generate_subject_folder
+from sleeposcope_modules.preprocessing_module import read_preprocessed_data, \
+    invalidate_cache
+from sleeposcope_modules.instrumentation_module import PipelineMetrics
+
+
+@pytest.fixture
+def subject_files_path(tmp_path):
+    subject_files_path = str(tmp_path / 'Subject5')
+    generate_subject_folder(subject_files_path, num_days=0.2, num_files=2,
+                            seed=5)
+
+    return subject_files_path
+
+
+def read_subject(subject_files_path, cache_path, **parameters):
+    """ Returns the pre-processed subject and whether it came from the
+    cache.
+    """
+
+    metrics = PipelineMetrics()
+    full_subject_df = read_preprocessed_data(
+        subject_files_path, cache_path=cache_path, metrics=metrics,
+        **parameters)
+
+    return full_subject_df, metrics.counters.get('cache_hits', 0) > 0
+
+
+def test_cached_subject_matches_the_pre_processed_one(tmp_path,
+                                                      subject_files_path):
+    cache_path = str(tmp_path / 'cache')
+    expected = read_subject(subject_files_path, None)[0]
+
+    cold_df, cold_from_cache = read_subject(subject_files_path, cache_path)
+    warm_df, warm_from_cache = read_subject(subject_files_path, cache_path)
+
+    assert not cold_from_cache
+    assert warm_from_cache
+    pd.testing.assert_frame_equal(cold_df, expected)
+    pd.testing.assert_frame_equal(warm_df, expected)
+
+
+def test_cache_is_not_used_after_a_change(tmp_path, subject_files_path):
+    cache_path = str(tmp_path / 'cache')
+    read_subject(subject_files_path, cache_path)
+
+    # Other parameters:
+    interpolated_df, from_cache = read_subject(
+        subject_files_path, cache_path, fill_method='interpolate')
+    assert not from_cache
+    pd.testing.assert_frame_equal(interpolated_df, read_subject(
+        subject_files_path, None, fill_method='interpolate')[0])
+
+    # A csv file changed, with the same size:
+    file_name = os.path.join(subject_files_path,
+                             sorted(os.listdir(subject_files_path))[-1])
+    with open(file_name) as file:
+        lines = file.readlines()
+    fields = lines[1].split(',')
+    fields[2] = fields[2][:-1] + str((int(fields[2][-1]) + 1) % 10)
+    lines[1] = ','.join(fields)
+    with open(file_name, 'w') as file:
+        file.writelines(lines)
+    changed_df, from_cache = read_subject(subject_files_path, cache_path)
+    assert not from_cache
+    pd.testing.assert_frame_equal(changed_df,
+                                  read_subject(subject_files_path, None)[0])
+
+    # The cache emptied:
+    assert invalidate_cache(cache_path) == 3
+    assert not read_subject(subject_files_path, cache_path)[1]
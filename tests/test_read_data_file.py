@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the checks of read_data_file: a file is rejected for the same
+reasons as when the whole DataFrame was scanned for NaNs before clean up.
+"""
+
+import pytest
+from sleeposcope_modules.preprocessing_module import read_data_file
+from sleeposcope_modules.sanity_check_module import DataFileIsDefectiveError
+
+GOOD_ROWS = ['name,time,meas_sig_str,status',
+             'sensor,2017-08-20T19:00:00Z,120,0',
+             'name,time,meas_sig_str,status',
+             'sensor,2017-08-20T19:00:01Z,121,0',
+             'sensor,2017-08-20T19:00:02Z,122,1']
+
+
+def write_data_file(tmp_path, rows):
+    """ Writes rows to a csv data file and returns its path.
+    """
+
+    file_path = tmp_path / 'data_file.csv'
+    file_path.write_text('\n'.join(rows) + '\n')
+
+    return str(file_path)
+
+
+def test_report_counts_header_rows_and_rows(tmp_path):
+    file_df, file_report = read_data_file(
+        write_data_file(tmp_path, GOOD_ROWS), return_quality_report=True)
+
+    assert len(file_df) == 3
+    assert file_report['num_rows'] == 3
+    assert file_report['num_header_rows'] == 1
+    assert file_report['num_null_values'] == 0
+    assert file_report['is_time_sorted']
+    assert file_report['max_signal'] == 122
+
+
+@pytest.mark.parametrize('defective_row', [
+    ',2017-08-20T19:00:03Z,123,0',
+    'sensor,,123,0',
+    'sensor,2017-08-20T19:00:03Z,,0',
+    'sensor,2017-08-20T19:00:03Z,123,'])
+def test_nan_in_any_column_rejects_the_file(tmp_path, defective_row):
+    file_name = write_data_file(tmp_path, GOOD_ROWS + [defective_row])
+
+    with pytest.raises(DataFileIsDefectiveError):
+        read_data_file(file_name)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the signal store: a subject written to a signal file and
+memory-mapped again reads back the same as the subject stored in the
+database.
+"""
+
+import json
+import struct
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+import build_signal_store as build_signal_store_script
+from pre_process_subject_data import get_argument_parser, \
+    pre_process_subject, TABLE_NAME
+from sleeposcope_modules.signal_store_module import build_signal_store, \
+    open_signal_file, write_signal_file, get_signal_file_path, \
+    SIGNAL_FILE_PREFIX, SIGNAL_FILE_ALIGNMENT, GAP_MASK_VALUES
+from sleeposcope_modules.sanity_check_module import \
+    SignalFileIsDefectiveError
+from sleeposcope_modules.synthetic_data_module import generate_subject_folder
+from sleeposcope_modules.read_from_sql_module import iterate_rows
+from test_ingest_modes import make_storage_backend
+
+SUBJECT_NUM = 8
+
+
+@pytest.fixture(scope='module')
+def stored_subject(tmp_path_factory):
+    """ A subject over two periods, with gaps filled and not filled, written
+    to a signal file and to the database.
+    """
+
+    tmp_path = tmp_path_factory.mktemp('store')
+    subject_files_path = str(tmp_path / 'Subject{0}'.format(SUBJECT_NUM))
+    generate_subject_folder(subject_files_path, num_days=0.5, num_files=2,
+                            dropout_rate=5e-3, header_row_rate=1e-3,
+                            seed=SUBJECT_NUM)
+    # Gaps longer than 30 seconds are not filled:
+    options = ['--max_gap_secs', '30']
+    args = get_argument_parser().parse_args(options)
+
+    file_path = build_signal_store(
+        SUBJECT_NUM, subject_files_path, str(tmp_path / 'signal_store'),
+        max_gap_secs=args.max_gap_secs)
+    storage_backend = make_storage_backend(tmp_path, 'subjects')
+    pre_process_subject(SUBJECT_NUM, subject_files_path, storage_backend,
+                        args)
+    rows = pd.concat(iterate_rows(storage_backend.engine, TABLE_NAME),
+                     ignore_index=True).set_index('secs')
+
+    return open_signal_file(file_path), rows
+
+
+def test_header_and_offsets(stored_subject):
+    (subject_signal, rows) = stored_subject
+    header = subject_signal.header
+
+    assert header['num_samples'] == len(rows)
+    assert header['gap_mask_offset'] % SIGNAL_FILE_ALIGNMENT == 0
+    assert header['signal_offset'] % SIGNAL_FILE_ALIGNMENT == 0
+    assert header['gap_mask_offset'] >= SIGNAL_FILE_PREFIX.size + \
+        len(json.dumps(header))
+    assert header['signal_offset'] >= header['gap_mask_offset'] + len(rows)
+    assert subject_signal.start_time.tz is not None
+
+
+def test_signal_and_gap_mask_match_the_stored_rows(stored_subject):
+    (subject_signal, rows) = stored_subject
+
+    np.testing.assert_allclose(subject_signal.signal, rows.meas_sig_str,
+                               rtol=1e-6)
+    # Recorded seconds have a status, filled-in ones a signal only. A gap
+    # filled from seconds that were not filled stays empty:
+    gap_mask = pd.Series(subject_signal.gap_mask, index=rows.index)
+    np.testing.assert_array_equal(gap_mask == GAP_MASK_VALUES['recorded'],
+                                  rows.status.notna())
+    assert (gap_mask[rows.status.isna() & rows.meas_sig_str.notna()] ==
+            GAP_MASK_VALUES['filled']).all()
+    assert rows.meas_sig_str[gap_mask == GAP_MASK_VALUES['not_filled']
+                             ].isnull().all()
+    assert set(gap_mask) == set(GAP_MASK_VALUES.values())
+
+
+def test_views_of_days_and_time_ranges(stored_subject):
+    (subject_signal, rows) = stored_subject
+
+    assert list(subject_signal.day_start_secs) == list(
+        rows.groupby('num_days').apply(lambda day: day.index.min()))
+    for (num_days, day_rows) in rows.groupby('num_days'):
+        (signal, gap_mask) = subject_signal.get_day(num_days)
+        assert isinstance(signal, np.memmap)
+        np.testing.assert_allclose(signal, day_rows.meas_sig_str, rtol=1e-6)
+        assert len(gap_mask) == len(day_rows)
+    assert len(subject_signal.get_day(0)[0]) == 0
+    assert len(subject_signal.get_day(3)[0]) == 0
+
+    # In seconds from the start, and in time:
+    (signal, gap_mask) = subject_signal.get_time_range(3600, 7200)
+    np.testing.assert_allclose(signal, rows.loc[3600:7199, 'meas_sig_str'],
+                               rtol=1e-6)
+    (signal, gap_mask) = subject_signal.get_time_range(
+        subject_signal.start_time + pd.Timedelta(hours=1, seconds=0.5),
+        subject_signal.start_time + pd.Timedelta(hours=2))
+    np.testing.assert_allclose(signal, rows.loc[3601:7199, 'meas_sig_str'],
+                               rtol=1e-6)
+    # Clipped to the recording:
+    assert len(subject_signal.get_time_range(-100, 10 ** 9)[0]) == len(rows)
+
+
+def test_empty_subject(tmp_path):
+    file_path = str(tmp_path / 'empty.sig')
+    write_signal_file(
+        pd.DataFrame({'meas_sig_str': pd.Series(dtype=float),
+                      'num_days': pd.Series(dtype=int),
+                      'date_time': pd.Series(dtype='datetime64[ns, UTC]')}),
+        pd.DataFrame({'start_secs': [], 'length_secs': [], 'filled': []}),
+        file_path)
+
+    subject_signal = open_signal_file(file_path)
+
+    assert subject_signal.start_time is None
+    assert len(subject_signal) == 0
+    assert len(subject_signal.get_day(1)[0]) == 0
+    assert len(subject_signal.get_time_range(0, 100)[1]) == 0
+
+
+def test_defective_file(tmp_path):
+    file_path = str(tmp_path / 'defective.sig')
+    with open(file_path, 'wb') as file:
+        file.write(struct.pack('<8sI', b'NOTASIG0', 2) + b'{}')
+
+    with pytest.raises(SignalFileIsDefectiveError):
+        open_signal_file(file_path)
+
+
+def test_signal_store_from_the_command_line(tmp_path, monkeypatch):
+    subject_files_path = str(tmp_path / 'Subject{0}'.format(SUBJECT_NUM))
+    generate_subject_folder(subject_files_path, num_days=0.1, num_files=1,
+                            seed=SUBJECT_NUM)
+    store_path = str(tmp_path / 'signal_store')
+    monkeypatch.setattr(sys, 'argv', [
+        'build_signal_store.py', '--subject_num', str(SUBJECT_NUM),
+        '--subject_files_path', subject_files_path, '--store_path',
+        store_path, '--fill_method', 'interpolate'])
+
+    build_signal_store_script.main()
+
+    subject_signal = open_signal_file(get_signal_file_path(store_path,
+                                                           SUBJECT_NUM))
+    assert len(subject_signal) == 0.1 * 86400
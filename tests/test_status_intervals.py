@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of reading the status intervals back from the database (SQLite), and
+of the statuses of a stored subject against the pre-processed one.
+"""
+
+import pandas as pd
+from sqlalchemy import create_engine
+from sleeposcope_modules.talk_to_sql_module import initialize_database, \
+    write_status_intervals, read_status_intervals, get_status_codes_table, \
+    write_to_sql_database
+from sleeposcope_modules.read_from_sql_module import iterate_rows
+from sleeposcope_modules.status_interval_module import find_status_intervals, \
+    label_time_ranges
+from sleeposcope_modules.synthetic_data_module import generate_subject_folder
+from sleeposcope_modules.preprocessing_module import read_preprocessed_data
+from pre_process_subject_data import get_argument_parser, pre_process_subject
+from test_ingest_modes import make_storage_backend, read_stored_subject, \
+    SUBJECT_NUM
+
+TABLE_NAME = 'all_subjects_table'
+
+
+def make_engine(tmp_path):
+    engine = create_engine('sqlite:///{0}'.format(tmp_path / 'subjects.db'))
+    initialize_database(engine, TABLE_NAME)
+    intervals = pd.DataFrame({'subject_num': [4, 4, 4],
+                              'start_secs': [0, 10, 25],
+                              'end_secs': [10, 20, 30],
+                              'status': ['YES', 'NO', 'YES']})
+    with engine.begin() as connection:
+        write_status_intervals(connection, 4, intervals)
+
+    return engine
+
+
+def test_intervals_are_read_with_their_statuses(tmp_path):
+    engine = make_engine(tmp_path)
+
+    intervals = read_status_intervals(engine, [4], from_secs=5, to_secs=26)
+
+    assert list(intervals.start_secs) == [0, 10, 25]
+    assert list(intervals.status) == ['YES', 'NO', 'YES']
+    assert list(read_status_intervals(engine, statuses=['NO']).start_secs) \
+        == [10]
+
+
+def test_intervals_with_an_unknown_code_are_not_dropped(tmp_path):
+    engine = make_engine(tmp_path)
+    status_codes_table = get_status_codes_table()
+    with engine.begin() as connection:
+        connection.execute(status_codes_table.delete().where(
+            status_codes_table.c.status == 'NO'))
+
+    intervals = read_status_intervals(engine, [4])
+
+    assert list(intervals.start_secs) == [0, 10, 25]
+    assert list(intervals.status.isnull()) == [False, True, False]
+
+
+def test_rows_are_labelled_with_the_intervals(tmp_path):
+    engine = make_engine(tmp_path)
+    write_to_sql_database(pd.DataFrame({
+        'subject_num': 4, 'num_days': 1, 'secs': range(30),
+        'meas_sig_str': 100.0}), engine, TABLE_NAME)
+
+    rows = pd.concat(iterate_rows(engine, TABLE_NAME, [4], fetch_size=7))
+
+    assert list(rows.status.iloc[[0, 9, 10, 19, 25]]) == \
+        ['YES', 'YES', 'NO', 'NO', 'YES']
+    assert rows.status.iloc[20:25].isnull().all()
+
+
+def test_stored_statuses_match_the_pre_processed_subject(tmp_path):
+    # Each second of a subject, read back with the status of its interval,
+    # has the status it had before being stored (as the status column did):
+    subject_files_path = str(tmp_path / 'Subject{0}'.format(SUBJECT_NUM))
+    generate_subject_folder(subject_files_path, num_days=0.2, num_files=2,
+                            dropout_rate=5e-3, seed=7)
+    storage_backend = make_storage_backend(tmp_path, 'whole')
+    pre_process_subject(SUBJECT_NUM, subject_files_path, storage_backend,
+                        get_argument_parser().parse_args([]))
+    expected = read_preprocessed_data(subject_files_path).assign(
+        subject_num=SUBJECT_NUM)
+
+    rows = read_stored_subject(storage_backend.engine)['rows']
+    intervals = find_status_intervals(expected)
+
+    assert len(intervals) < len(expected) / 10
+    assert list(rows.secs) == list(expected.index)
+    assert list(rows.status) == list(expected.status)
+    labels = label_time_ranges(intervals,
+                               expected.assign(start_secs=expected.index))
+    assert list(labels.status) == list(expected.status)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of the summary levels of the signal: every level, built a block at a
+time as the rows are written, against a groupby over the written rows.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pytest
+from sleeposcope_modules.summary_module import summarize_rows, \
+    build_summary_levels, SummaryAccumulator, choose_summary_level, \
+    get_summary, SUMMARY_LEVEL_SECS, SUMMARY_DTYPES, MAX_SUMMARY_PARTS
+from sleeposcope_modules.read_from_sql_module import iterate_rows
+from test_ingest_modes import make_storage_backend
+from pre_process_subject_data import TABLE_NAME
+
+# The second the second period starts at, within a bin of every level:
+PERIOD_START_SECS = 7205
+
+
+def make_subject_data(subject_num, num_secs=3 * 3600, num_gaps=20, seed=0):
+    """ Rows of a subject with gaps that were filled in (a sample without a
+    status) and not (neither), and a period starting within a bin.
+    """
+
+    rng = np.random.default_rng(seed)
+    meas_sig_str = rng.normal(500, 100, num_secs).round()
+    status = pd.Series(rng.choice(['YES', 'NO'], num_secs), dtype=object)
+    for gap_start in rng.integers(0, max(num_secs - 400, 1), num_gaps):
+        gap_length = rng.integers(1, 400)
+        status[gap_start:gap_start + gap_length] = None
+        if gap_length > 300:
+            meas_sig_str[gap_start:gap_start + gap_length] = np.nan
+
+    return pd.DataFrame({
+        'subject_num': subject_num,
+        'num_days': np.where(np.arange(num_secs) < PERIOD_START_SECS, 1, 2),
+        'secs': np.arange(num_secs), 'meas_sig_str': meas_sig_str,
+        'status': status,
+        'date_time': pd.Timestamp('2017-08-20 10:00:00', tz='UTC') +
+        pd.to_timedelta(np.arange(num_secs), unit='s')})
+
+
+def summarize_with_groupby(rows):
+    """ The summary levels of rows, one groupby per level. Bins whose seconds
+    all lack a sample are kept, with no samples.
+    """
+
+    rows = rows.assign(has_sample=rows.meas_sig_str.notna(),
+                       filled=rows.meas_sig_str.notna() & rows.status.isna())
+    levels = []
+    for level_secs in SUMMARY_LEVEL_SECS:
+        bins = rows.assign(start_secs=rows.secs // level_secs * level_secs)
+        level = bins.groupby(['subject_num', 'num_days', 'start_secs'],
+                             as_index=False).agg(
+            num_samples=('has_sample', 'sum'), num_filled=('filled', 'sum'),
+            min=('meas_sig_str', 'min'), max=('meas_sig_str', 'max'),
+            mean=('meas_sig_str', 'mean'),
+            std=('meas_sig_str', lambda x: x.std(ddof=0)))
+        level.insert(1, 'level_secs', level_secs)
+        level.insert(4, 'fraction_filled',
+                     level.pop('num_filled') / level.num_samples)
+        levels.append(level)
+
+    return pd.concat(levels, ignore_index=True)[list(SUMMARY_DTYPES)].astype(
+        SUMMARY_DTYPES).sort_values(
+            ['subject_num', 'level_secs', 'start_secs', 'num_days'],
+            ignore_index=True)
+
+
+def assert_summaries_equal(summaries, expected):
+    pd.testing.assert_frame_equal(
+        summaries[list(SUMMARY_DTYPES)].reset_index(drop=True), expected,
+        check_dtype=False, rtol=1e-5)
+
+
+def test_levels_match_a_groupby():
+    subject_data = make_subject_data(4)
+
+    summaries = build_summary_levels(summarize_rows(subject_data))
+
+    expected = summarize_with_groupby(subject_data)
+    assert_summaries_equal(summaries, expected)
+    # The bins at the start of the second period are split in two:
+    for level_secs in SUMMARY_LEVEL_SECS:
+        bin_start = PERIOD_START_SECS // level_secs * level_secs
+        split_bin = summaries[(summaries.level_secs == level_secs) &
+                              (summaries.start_secs == bin_start)]
+        assert list(split_bin.num_days) == [1, 2]
+    # Seconds without a sample are not counted, filled seconds are:
+    assert summaries.num_samples.sum() == \
+        len(SUMMARY_LEVEL_SECS) * subject_data.meas_sig_str.notna().sum()
+    assert 0 < summaries.fraction_filled.mean() < 1
+
+
+def test_fraction_filled_counts_only_the_filled_seconds():
+    subject_data = make_subject_data(4, num_secs=20, num_gaps=0)
+    # 3 seconds filled in, 4 not filled in, in the first bin:
+    subject_data.loc[2:4, 'status'] = None
+    subject_data.loc[5:8, ['meas_sig_str', 'status']] = [np.nan, None]
+
+    summaries = build_summary_levels(summarize_rows(subject_data))
+
+    first_bins = summaries[summaries.start_secs == 0].set_index('level_secs')
+    assert first_bins.loc[10, 'num_samples'] == 6
+    assert first_bins.loc[10, 'fraction_filled'] == pytest.approx(3 / 6)
+    assert first_bins.loc[60, 'num_samples'] == 16
+    assert first_bins.loc[60, 'fraction_filled'] == pytest.approx(3 / 16)
+
+
+def test_blocks_added_up_across_threads_and_subjects():
+    subject_datas = [make_subject_data(subject_num, num_secs=7800,
+                                       seed=subject_num)
+                     for subject_num in [4, 7]]
+    accumulator = SummaryAccumulator()
+
+    # Blocks of a few seconds (more than MAX_SUMMARY_PARTS of them, so the
+    # parts are added up on the way), holding the rows of both subjects and
+    # splitting bins:
+    block_secs = 31
+    blocks = [pd.concat([subject_data.iloc[block_start:
+                                           block_start + block_secs]
+                         for subject_data in subject_datas])
+              for block_start in range(0, 7800, block_secs)]
+    assert len(blocks) > 2 * MAX_SUMMARY_PARTS
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(accumulator.add, blocks))
+
+    for subject_data in subject_datas:
+        subject_num = subject_data.subject_num.iloc[0]
+        assert len(accumulator.parts[subject_num]) < MAX_SUMMARY_PARTS
+        assert_summaries_equal(accumulator.pop(subject_num),
+                               summarize_with_groupby(subject_data))
+    assert len(accumulator.pop(4)) == 0
+
+
+@pytest.mark.parametrize('resolution_secs, level_secs', [
+    (1, 10), (10, 10), (59.9, 10), (60, 60), (3599, 600), (86400, 3600)])
+def test_choose_summary_level(resolution_secs, level_secs):
+    assert choose_summary_level(resolution_secs) == level_secs
+
+
+@pytest.fixture
+def storage_backend(tmp_path):
+    """ A subject written in blocks of 1000 seconds. """
+
+    storage_backend = make_storage_backend(tmp_path, 'summaries')
+    subject_data = make_subject_data(4)
+    storage_backend.write_subject(4, (
+        subject_data.iloc[block_start:block_start + 1000]
+        for block_start in range(0, len(subject_data), 1000)))
+
+    return storage_backend
+
+
+def test_stored_levels_match_the_written_rows(storage_backend):
+    rows = pd.concat(iterate_rows(storage_backend.engine, TABLE_NAME, [4]),
+                     ignore_index=True)
+    expected = summarize_with_groupby(rows)
+
+    for level_secs in SUMMARY_LEVEL_SECS:
+        assert_summaries_equal(
+            storage_backend.read_summaries(4, level_secs),
+            expected[expected.level_secs == level_secs].reset_index(
+                drop=True))
+
+
+def test_get_summary(storage_backend):
+    # An hour in about 60 points:
+    summary = get_summary(storage_backend, 4, 1800, 5400, max_points=60)
+    assert set(summary.level_secs) == {60}
+    assert summary.start_secs.min() == 1800
+    assert summary.start_secs.max() == 5340
+
+    # The resolution asked for, with a bin that overlaps the range:
+    summary = get_summary(storage_backend, 4, 1805, 1830,
+                          resolution_secs=10)
+    assert list(summary.start_secs) == [1800, 1810, 1820]
+
+    # The whole recording, 3 hours in about 10 points:
+    summary = get_summary(storage_backend, 4, max_points=10)
+    assert set(summary.level_secs) == {600}
+    assert summary.start_secs.max() == 3 * 3600 - 600
+
+    # A subject without summaries:
+    assert len(get_summary(storage_backend, 5)) == 0
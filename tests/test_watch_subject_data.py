@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of how the watch service queues and retries subjects, with the ingest
+itself replaced.
+"""
+
+import argparse
+import watch_subject_data
+from sleeposcope_modules.sanity_check_module import SubjectExistsInDBError
+from watch_subject_data import poll_subjects, get_due_subjects, ingest_subject
+
+
+def make_subject_folder(tmp_path):
+    subject_files_path = tmp_path / 'Subject7'
+    subject_files_path.mkdir()
+    (subject_files_path / 'data_file_1.csv').write_text('name\n')
+
+    return subject_files_path
+
+
+def poll_and_ingest(tmp_path, subject_statuses, now):
+    """ One poll of the service, returning the subjects it ingested. """
+
+    args = argparse.Namespace(retry_secs=300)
+    poll_subjects(str(tmp_path / 'Subject*'), subject_statuses, now)
+    due = get_due_subjects(subject_statuses, 0, now)
+    for subject_num in due:
+        ingest_subject(subject_num, subject_statuses[subject_num], None, args)
+
+    return due
+
+
+def test_non_transient_error_marks_the_subject_failed(tmp_path, monkeypatch):
+    subject_files_path = make_subject_folder(tmp_path)
+
+    def pre_process_subject(subject_num, subject_files_path,
+                            storage_backend, args):
+        raise SubjectExistsInDBError("Subject 7 is already in the database")
+
+    monkeypatch.setattr(watch_subject_data, 'pre_process_subject',
+                        pre_process_subject)
+    subject_statuses = {}
+
+    assert poll_and_ingest(tmp_path, subject_statuses, 0) == [7]
+    assert subject_statuses[7]['failed']
+    assert subject_statuses[7]['pending_since'] is None
+    # Not tried again, however long it waits:
+    assert poll_and_ingest(tmp_path, subject_statuses, 10 ** 10) == []
+
+    # Until its files change:
+    (subject_files_path / 'data_file_2.csv').write_text('name\n')
+    assert poll_and_ingest(tmp_path, subject_statuses, 10 ** 10 + 1) == [7]
+
+
+def test_transient_error_is_retried(tmp_path, monkeypatch):
+    make_subject_folder(tmp_path)
+
+    def pre_process_subject(subject_num, subject_files_path,
+                            storage_backend, args):
+        raise ConnectionError("database unreachable")
+
+    monkeypatch.setattr(watch_subject_data, 'pre_process_subject',
+                        pre_process_subject)
+    subject_statuses = {}
+
+    assert poll_and_ingest(tmp_path, subject_statuses, 0) == [7]
+    assert not subject_statuses[7]['failed']
+    assert poll_and_ingest(tmp_path, subject_statuses, 100) == []
+    assert poll_and_ingest(tmp_path, subject_statuses, 10 ** 10) == [7]